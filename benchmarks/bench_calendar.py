@@ -0,0 +1,264 @@
+"""
+日历性能测试, 使用单元测试的日历数据(`tests/calendar_data.py`), 不需要MongoDB
+
+    python benchmarks/bench_calendar.py                                # 只打印结果
+    python benchmarks/bench_calendar.py --check benchmarks/baseline.json
+    python benchmarks/bench_calendar.py --rounds 3 --save benchmarks/baseline.json # 重新生成基准
+
+基准中的耗时保存为同一台机器上参考工作量(`_calibrate`)耗时的倍数, 不同机器之间可以比较,
+内存直接保存KB。有意改变性能(新增项目、优化或者接受的变慢)后用`--save`重新生成基准,
+和代码一起提交, `--rounds`多跑几轮取中位数减少误差
+
+`--check`时任何一项比基准慢(或者内存多)超过`--tolerance`倍, 并且差值超过
+`--min-delta`(微秒或者KB, 避免很快的项目因为误差报错)就返回非0, 用于CI
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import timeit
+import tracemalloc
+from datetime import datetime, timedelta
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "tests"))
+
+from calendar_data import HOLIDAYS, PRODUCTS, calendar_frames  # noqa: E402
+
+from quantcalendar.calendar import DAILY  # noqa: E402
+from quantcalendar.calendar_7x24 import Time7x24Calendar  # noqa: E402
+from quantcalendar.calendar_astock import CalendarAstock  # noqa: E402
+from quantcalendar.calendar_ctp import CalendarCTP  # noqa: E402
+from quantcalendar.source import DataFrameSource  # noqa: E402
+
+QUERY_START = datetime(2018, 1, 1)
+QUERY_DAYS = 365 * 6
+QUERY_COUNT = 1000
+BATCH_SIZE = 100_000
+CALENDAR_START = "2010-01-01"
+CALENDAR_END = "2026-12-31"
+# 每年都按2024年的日期放假
+YEARLY_HOLIDAYS = [
+    (f"{year}{first[4:]}", f"{year}{last[4:]}")
+    for year in range(2010, 2027)
+    for first, last in HOLIDAYS
+    if first.startswith("2024")
+]
+
+
+def _random_datetimes(seed=0):
+    rnd = random.Random(seed)
+    return [
+        QUERY_START
+        + timedelta(days=rnd.randrange(QUERY_DAYS), seconds=rnd.randrange(86400))
+        for _ in range(QUERY_COUNT)
+    ]
+
+
+def _bench(func, queries, repeat=9):
+    """每次调用的最短时间(微秒), 每轮把`queries`全部跑一遍"""
+
+    def run():
+        for q in queries:
+            func(q)
+
+    run()  # 预热, 不计算第一次创建索引的时间
+    best = min(timeit.repeat(run, number=1, repeat=repeat))
+    return best / len(queries) * 1e6
+
+
+def _bench_once(func, repeat=9):
+    best = min(timeit.repeat(func, number=1, repeat=repeat))
+    return best * 1e6
+
+
+def _memory(func):
+    """`func`返回的对象占用的内存(KB)"""
+    gc.collect()
+    tracemalloc.start()
+    obj = func()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del obj
+    return current / 1024
+
+
+def _build_ctp(ctp_data):
+    cal = CalendarCTP(data=ctp_data, preload=PRODUCTS)
+    for product_id in PRODUCTS:
+        sub = cal.get(product_id)
+        for interval in (60, 300, DAILY):
+            sub.get_current_bartime(QUERY_START, interval)
+    return cal
+
+
+def _make_data():
+    """CalendarAstock和CalendarCTP已经读取好的日历数据, 不计算读取数据的时间"""
+    source = DataFrameSource(
+        calendar_frames(CALENDAR_START, CALENDAR_END, YEARLY_HOLIDAYS)
+    )
+    return CalendarAstock._fetch_data(source), CalendarCTP._fetch_data(source)
+
+
+def _calibrate():
+    """参考工作量(Python排序和numpy排序)的耗时(微秒), 基准中的耗时按它的倍数保存"""
+    rnd = random.Random(0)
+    values = [rnd.random() for _ in range(100_000)]
+    arr = np.array(values)
+    return _bench_once(lambda: (sorted(values), np.sort(arr)))
+
+
+def _is_memory(name):
+    return name.startswith("memory_kb.")
+
+
+def run_benchmarks():
+    astock_data, ctp_data = _make_data()
+    queries = _random_datetimes()
+    ctp = CalendarCTP(data=ctp_data)
+    calendars = {
+        "ctp.ag": ctp.get("ag"),
+        "ctp.IF": ctp.get("IF"),
+        "ctp.T": ctp.get("T"),
+        "ctp.c": ctp.get("c"),
+        "astock": CalendarAstock(data=astock_data),
+        "7x24": Time7x24Calendar(),
+    }
+
+    results = {}
+    results["construct.CalendarCTP"] = _bench_once(lambda: CalendarCTP(data=ctp_data))
+    results["construct.CalendarCTP.preload"] = _bench_once(
+        lambda: CalendarCTP(data=ctp_data, preload=PRODUCTS)
+    )
+    results["construct.CalendarAstock"] = _bench_once(
+        lambda: CalendarAstock(data=astock_data)
+    )
+
+    batch = np.array(
+        np.datetime64(QUERY_START)
+        + np.sort(np.random.default_rng(0).integers(0, QUERY_DAYS * 86400, BATCH_SIZE))
+        * np.timedelta64(1, "s"),
+        dtype="datetime64[ns]",
+    )
+    for name, cal in calendars.items():
+        cases = {
+            "get_current_bartime.1m": lambda q: cal.get_current_bartime(q, 60),
+            "get_current_bartime.1D": lambda q: cal.get_current_bartime(q, DAILY),
+            "get_bartimes.5m.count100": lambda q: cal.get_bartimes(300, q, count=100),
+            "is_trading": cal.is_trading,
+            "get_open_close_dt": cal.get_open_close_dt,
+            "get_session_dt": cal.get_session_dt,
+            "is_trading_day": cal.is_trading_day,
+            "get_tradedays_gte": lambda q: next(iter(cal.get_tradedays_gte(q))),
+            "get_tradedays_lte": lambda q: next(iter(cal.get_tradedays_lte(q))),
+            "get_tradedays_next": cal.get_tradedays_next,
+            "get_tradedays_last": cal.get_tradedays_last,
+            "get_tradedays_between.30d": lambda q: cal.get_tradedays_between(
+                q, q + timedelta(days=30)
+            ),
+            "get_tradedays_month_end.count12": lambda q: cal.get_tradedays_month_end(
+                q, count=12
+            ),
+            "tradeday_offset.-20": lambda q: cal.tradeday_offset(
+                q, -20, roll="backward"
+            ),
+            "count_tradedays.30d": lambda q: cal.count_tradedays(
+                q, q + timedelta(days=30)
+            ),
+        }
+        for case, func in cases.items():
+            results[f"{name}.{case}"] = _bench(func, queries)
+        results[f"{name}.get_current_bartimes.1m.100k"] = _bench_once(
+            lambda: cal.get_current_bartimes(batch, 60)
+        )
+
+    results["memory_kb.CalendarCTP"] = _memory(lambda: CalendarCTP(data=ctp_data))
+    results["memory_kb.CalendarCTP.indexed"] = _memory(lambda: _build_ctp(ctp_data))
+    results["memory_kb.CalendarAstock"] = _memory(
+        lambda: CalendarAstock(data=astock_data)
+    )
+    return results
+
+
+def check(results, baseline, tolerance, min_delta):
+    """
+    返回超过基准`tolerance`倍并且差值超过`min_delta`的项目,
+    基准中没有的项目也返回, 基准为None, 需要重新保存基准
+    """
+    regressions = []
+    for name, value in results.items():
+        base = baseline["results"].get(name)
+        if base is None:
+            regressions.append((name, None, value))
+        elif value > base * tolerance and value - base > min_delta:
+            regressions.append((name, base, value))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--save", help="保存结果到基准文件")
+    parser.add_argument("--check", help="与基准文件比较")
+    parser.add_argument("--tolerance", type=float, default=2.0)
+    parser.add_argument("--min-delta", type=float, default=1.0)
+    parser.add_argument("--rounds", type=int, default=1, help="运行几轮, 取中位数")
+    args = parser.parse_args(argv)
+
+    rounds = [run_benchmarks() for _ in range(max(args.rounds, 1))]
+    results = {name: float(np.median([r[name] for r in rounds])) for name in rounds[0]}
+    calibration = float(np.median([_calibrate() for _ in rounds]))
+    baseline = None
+    if args.check:
+        with open(args.check, encoding="utf-8") as f:
+            baseline = json.load(f)
+        # 换算成本机的微秒
+        baseline["results"] = {
+            name: value if _is_memory(name) else value * calibration
+            for name, value in baseline["results"].items()
+        }
+    for name, value in results.items():
+        unit = "KB" if _is_memory(name) else "us"
+        line = f"{name:<60}{value:>14.2f} {unit}"
+        if baseline is not None and name in baseline["results"]:
+            line += f"  ({value / baseline['results'][name]:.2f}x)"
+        print(line)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "calibration_us": round(calibration, 3),
+                    "results": {
+                        name: round(
+                            value if _is_memory(name) else value / calibration, 6
+                        )
+                        for name, value in results.items()
+                    },
+                },
+                f,
+                indent=2,
+            )
+            f.write("\n")
+
+    if baseline is not None:
+        regressions = check(results, baseline, args.tolerance, args.min_delta)
+        for name, base, value in regressions:
+            if base is None:
+                print(f"MISSING {name}: not in baseline {args.check}")
+            else:
+                print(f"REGRESSION {name}: {base:.2f} -> {value:.2f}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+from datetime import datetime
+from functools import reduce
+from typing import Sequence
+
+import numpy as np
+
+from .calendar import Calendar
+
+__all__ = [
+    "union_tradedays",
+    "intersect_tradedays",
+    "union_bartimes",
+    "intersect_bartimes",
+    "align_bars",
+]
+
+
+def union_tradedays(
+    calendars: Sequence[Calendar], start: datetime, end: datetime
+) -> np.ndarray:
+    """任一日历交易的交易日(`start`<=交易日<=`end`), 返回`datetime64[ns]`数组"""
+    return reduce(
+        np.union1d, (cal.get_tradedays_array(start, end) for cal in calendars)
+    )
+
+
+def intersect_tradedays(
+    calendars: Sequence[Calendar], start: datetime, end: datetime
+) -> np.ndarray:
+    """所有日历都交易的交易日(`start`<=交易日<=`end`), 返回`datetime64[ns]`数组"""
+    return reduce(
+        lambda a, b: np.intersect1d(a, b, assume_unique=True),
+        (cal.get_tradedays_array(start, end) for cal in calendars),
+    )
+
+
+def union_bartimes(
+    calendars: Sequence[Calendar], interval: int, start: datetime, end: datetime
+) -> np.ndarray:
+    """
+    任一日历的K线时间, 每个日历的K线时间同`get_bartimes(interval, start, end)`,
+    返回`datetime64[ns]`数组
+
+    Params:
+        calendars: 品种日历, 比如[cal.get("AG"), cal.get("IH")]
+        interval(seconds): K线间隔周期
+    """
+    return reduce(
+        np.union1d,
+        (cal.get_bartimes_array(interval, start, end) for cal in calendars),
+    )
+
+
+def intersect_bartimes(
+    calendars: Sequence[Calendar], interval: int, start: datetime, end: datetime
+) -> np.ndarray:
+    """所有日历共同的K线时间, 参数同`union_bartimes`"""
+    return reduce(
+        lambda a, b: np.intersect1d(a, b, assume_unique=True),
+        (cal.get_bartimes_array(interval, start, end) for cal in calendars),
+    )
+
+
+def align_bars(grid, calendars: Sequence[Calendar], interval: int) -> np.ndarray:
+    """
+    对齐多个品种的K线, 比如价差、期现基差策略
+
+    Params:
+        grid: 对齐的时间点, `DatetimeIndex`或者`datetime64[ns]`数组,
+            比如`union_bartimes`的结果
+        calendars: 品种日历
+        interval(seconds): K线间隔周期
+
+    Returns:
+        `int64`数组, 形状为(len(grid), len(calendars)), 每个时间点每个品种已经结束
+        的最后一根K线的序号(见`Calendar.get_bar_ordinal`), 没有时为-1
+    """
+    ordinals = np.empty((len(grid), len(calendars)), dtype=np.int64)
+    for i, cal in enumerate(calendars):
+        ordinals[:, i] = cal.get_closed_bar_ordinals(grid, interval)
+    return ordinals
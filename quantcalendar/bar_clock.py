@@ -0,0 +1,87 @@
+from datetime import datetime
+from enum import Enum
+
+from .calendar import Calendar
+
+__all__ = ["BarStatus", "BarClock"]
+
+
+class BarStatus(Enum):
+    SAME_BAR = 0  # 属于当前K线
+    NEW_BAR = 1  # 开始新的K线
+    NEW_SESSION = 2  # 开始新的K线, 与上一根K线之间跨越了休息时间或者节假日
+
+
+class BarClock:
+    """
+    实时行情K线时钟，记住当前K线的结束时间
+
+    tick时间必须单调递增, 属于当前K线的tick只需要比较一次，
+    只有开始新K线时才查询日历, 平摊下来每个tick是O(1)
+    """
+
+    def __init__(self, calendar: Calendar, interval: int, symbol: str = None):
+        """
+        Params:
+            calendar: 日历, 会通过`calendar.get(symbol)`获取品种日历
+            interval(seconds): K线间隔周期
+        """
+        self.calendar = calendar.get(symbol)
+        self.interval = interval
+        self.bar_open: datetime = None
+        """ 当前K线开始时间"""
+        self.bar_close: datetime = None
+        """ 当前K线结束时间"""
+        self.prev_bar_close: datetime = None
+        """ 上一根K线时间, 返回`NEW_BAR`或`NEW_SESSION`时表示刚刚结束的K线"""
+        self.last_tick: datetime = None
+
+    def update(self, dt: datetime) -> BarStatus:
+        """输入tick时间, 返回该tick与当前K线的关系"""
+        if self.last_tick is not None and dt < self.last_tick:
+            raise ValueError(f"tick时间必须单调递增: {dt} < {self.last_tick}")
+        self.last_tick = dt
+        if self.bar_close is not None and dt <= self.bar_close:
+            if dt < self.bar_close or self._contains_close():
+                return BarStatus.SAME_BAR
+
+        self.prev_bar_close = prev_close = self.bar_close
+        self.bar_open, self.bar_close = self.calendar.get_current_bar(dt, self.interval)
+        if prev_close is None:
+            return BarStatus.NEW_BAR
+        # 上一根K线结束之后先收盘再开盘, 并且开盘时间不晚于新K线结束时间
+        sos, eos = self.calendar.get_session_dt(prev_close)
+        if eos < sos <= self.bar_close:
+            return BarStatus.NEW_SESSION
+        return BarStatus.NEW_BAR
+
+    @property
+    def _side_right(self):
+        return self.calendar.bartime_side == "right"
+
+    def _contains_close(self) -> bool:
+        """
+        当前K线是否包含结束时间, `left`时下一根K线正好从结束时间开始的不包含,
+        见`Calendar.bartime_side`
+        """
+        if self._side_right:
+            return True
+        _, bar_close = self.calendar.get_current_bar(self.bar_close, self.interval)
+        return bar_close == self.bar_close
+
+    @property
+    def bartime(self) -> datetime:
+        """当前K线时间, 按日历的`bartime_side`取结束时间或者开始时间"""
+        return self.bar_close if self._side_right else self.bar_open
+
+    def seconds_remaining(self, dt: datetime = None) -> float:
+        """当前K线距离结束的秒数, 默认从最后一个tick开始算"""
+        if dt is None:
+            dt = self.last_tick
+        return (self.bar_close - dt).total_seconds()
+
+    def reset(self):
+        self.bar_open = None
+        self.bar_close = None
+        self.prev_bar_close = None
+        self.last_tick = None
@@ -1,12 +1,24 @@
 import copy
+import threading
 from abc import ABC, abstractmethod
-from collections import namedtuple
+from bisect import bisect_right
+from collections import OrderedDict, namedtuple
+from collections.abc import Sequence
 from datetime import datetime, time, timedelta
+from functools import cached_property
 from typing import Iterable, List, Mapping, Tuple, overload
 
-import quantdata as qd
+import numpy as np
 
-DB_NAME_CALENDAR = "quantcalendar"
+from . import snapshot
+from .source import (  # noqa: F401
+    _EPOCH_ORDINAL,
+    COLLECTION_NAME_VERSIONS,
+    DB_NAME_CALENDAR,
+    CalendarSource,
+    _to_days,
+    as_source,
+)
 
 I1H = 3600
 I2H = 7200
@@ -15,8 +27,10 @@ I4H = 14400
 DAILY = 86400
 WEEKLY = 7 * 86400
 MONTHLY = 30 * 86400
+QUARTERLY = 3 * MONTHLY
+YEARLY = 365 * 86400
 
-supproted_bartime = (DAILY, WEEKLY, MONTHLY)
+supproted_bartime = (DAILY, WEEKLY, MONTHLY, QUARTERLY, YEARLY)
 
 
 class OutOfCalendar(Exception):
@@ -28,8 +42,134 @@ SpecialSessions = namedtuple(
     "SpecialSessions", ["name", "open_close_sessions", "ordered_sessions"]
 )
 
+
+class TradeDaysView(Sequence):
+    """
+    交易日列表`days[start:stop]`的只读视图，不复制数据。
+    支持索引、切片(步长为1时仍返回视图)、`len`和迭代，可以与list比较
+    """
+
+    __slots__ = ("_days", "_start", "_stop")
+
+    def __init__(self, days: list, start: int = 0, stop: int = None):
+        self._days = days
+        self._start, self._stop, _ = slice(start, stop).indices(len(days))
+        if self._stop < self._start:
+            self._stop = self._start
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            r = range(self._start, self._stop)[key]
+            if r.step == 1:
+                return TradeDaysView(self._days, r.start, r.stop)
+            return [self._days[i] for i in r]
+        if key < 0:
+            key += len(self)
+        if key < 0 or key >= len(self):
+            raise IndexError("TradeDaysView index out of range")
+        return self._days[self._start + key]
+
+    def __iter__(self):
+        return map(self._days.__getitem__, range(self._start, self._stop))
+
+    def __reversed__(self):
+        return map(self._days.__getitem__, range(self._stop - 1, self._start - 1, -1))
+
+    def __eq__(self, other):
+        if isinstance(other, (TradeDaysView, list, tuple)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"TradeDaysView({list(self)!r})"
+
+
+_missing = object()
+
+
+class LRUCache(OrderedDict):
+    """
+    最多保存`maxsize`个元素, 设置`maxbytes`时元素(按`nbytes`计算, 比如numpy数组)
+    总共最多占用`maxbytes`字节, 超出时删除最久没有用到的, 最后添加的元素总是保留
+
+    可以在多个线程中共用, 修改在锁内(保证`nbytes`正确), 读取不加锁
+    """
+
+    def __init__(self, maxsize: int, name: str = None, maxbytes: int = None):
+        super().__init__()
+        self.maxsize = maxsize
+        self.name = name
+        """ 缓存名称, 用于统计命中率, 见`instrument`"""
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        """ 元素占用的字节数"""
+        self._lock = threading.RLock()
+
+    def __reduce__(self):
+        # 锁不能pickle, 只保存参数和元素
+        with self._lock:
+            items = list(self.items())
+        return (
+            type(self),
+            (self.maxsize, self.name, self.maxbytes),
+            None,
+            None,
+            iter(items),
+        )
+
+    def get(self, key, default=None):
+        # 单个字典操作是原子的, 读取不需要加锁
+        value = super().get(key, _missing)
+        if value is _missing:
+            return default
+        try:
+            self.move_to_end(key)
+        except KeyError:
+            # 其它线程刚刚删除
+            pass
+        return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            if key in self:
+                del self[key]
+            super().__setitem__(key, value)
+            self.nbytes += getattr(value, "nbytes", 0)
+            while len(self) > self.maxsize or (
+                self.maxbytes is not None
+                and self.nbytes > self.maxbytes
+                and len(self) > 1
+            ):
+                self.popitem(last=False)
+
+    def __delitem__(self, key):
+        with self._lock:
+            self.nbytes -= getattr(self[key], "nbytes", 0)
+            super().__delitem__(key)
+
+    def popitem(self, last: bool = True):
+        with self._lock:
+            key, value = super().popitem(last)
+            self.nbytes -= getattr(value, "nbytes", 0)
+            return key, value
+
+    def clear(self):
+        with self._lock:
+            super().clear()
+            self.nbytes = 0
+
+
+_add_lock = threading.RLock()
+""" `Calendar.add`修改共用的品种日历和模板, 同一时间只有一个线程添加"""
+
 day_offset = timedelta(days=1)
 zero_offset = timedelta()
+ns_per_second = 1_000_000_000
 
 
 class Calendar(ABC):
@@ -39,48 +179,105 @@ class Calendar(ABC):
 
     sessions = ()
     """ 开盘-收盘时间(包括中间的休息时间), 按当天秒数来算 eg. ((32400, 36900), (37800, 41400), (48600, 54000))"""
-    special_sessions: Mapping[str, SpecialSessions] = {}
-    """ 特殊原因提前收盘或者延迟开盘, Key为datetime.date().isoformat()"""
+    special_sessions: Mapping[int, SpecialSessions] = {}
+    """ 特殊原因提前收盘或者延迟开盘, Key为datetime.toordinal()"""
     tz = None
     """ 时区"""
     offset = zero_offset
     """ 有些市场交易时间会跨越凌晨0点, offset表示超过0点的时间差, 越过0点表示下一个交易日"""
     intervals = ()
-    """ 支持的K线周期间隔,单位s,只支持分钟和小时 eg. (60, 300, 600) 表示 1min, 5min, 10min 的K线时间"""
+    """ 常用的K线周期间隔,单位s eg. (60, 300, 600) 表示 1min, 5min, 10min 的K线时间
+
+        只用于显示, 小于一天的任意周期(包括秒级)都支持, 第一次用到时计算
+    """
+    bartime_cache_size = 32
+    """ 每个交易时间段最多缓存多少个K线周期的K线时间和索引"""
+    bartime_cache_bytes = 64 * 1024 * 1024
+    """ 每个交易时间段的K线结束时间索引最多占用的内存(开始时间索引另算, 同样大小),
+
+        整个日历的索引超过该大小的K线周期(比如长期日历的秒级K线)不建索引, 逐日计算
+    """
     bartime_side = "right"
     """ K线时间是按`right` 结束时间 或者`left` 开始时间表示，默认结束时间
 
-        TODO: `left`暂未实现
+        `right`时K线包含结束时间不包含开始时间(开始时间, 结束时间],
+        `left`时K线包含开始时间不包含结束时间[开始时间, 结束时间), 同数字货币和行情商家的K线,
+        只有下一根K线正好从结束时间开始时才有区别, 收盘(包括休息)时刻都属于收盘前的K线
     """
 
     def __init__(self):
         # 每个交易品种对应不同的交易日历
         self._sub_calendars = {}
-        # 记录每天交易状态 1-表示交易日
-        self._trade_status = {}
-        self._offset_seconds = self.offset.total_seconds()
-        self._offset_minus_day = self.offset - day_offset
-        self._bartime_side_right = self.bartime_side == "right"
+        # 交易时间段相同的品种日历共用的模板, 见`add`
+        self._templates = {}
+        # 记录每天交易状态 1-表示交易日, 下标为距离`_first_ordinal`的天数
+        self._trade_status = []
+        self._first_ordinal = 0
         self.init()
 
     def init(self):
-        self._session_time = [
+        self._offset_seconds = self.offset.total_seconds()
+        self._offset_minus_day = self.offset - day_offset
+        self._bartime_side_right = self.bartime_side == "right"
+        self._session_time = tuple(
             (seconds_to_time(sos), seconds_to_time(eos)) for sos, eos in self.sessions
-        ]
+        )
         self._open_close_sessions = (
             (self._session_time[0][0], self._session_time[-1][1]),
         )
-        self._sorted_session_time = sorted(self._session_time, key=lambda x: x[0])
-        self._bartimestamp = self._calc_bartimestamp(self.sessions)
+        self._sorted_session_time = tuple(
+            sorted(self._session_time, key=lambda x: x[0])
+        )
+        # 一天之内的K线时间, key为(K线周期, 是否K线结束时间), 见`_get_bartimestamp`
+        self._bartimestamps = LRUCache(self.bartime_cache_size, "bartimestamps")
+        # 按K线周期缓存的K线结束时间索引(纳秒时间戳)
+        self._bartime_indexes = LRUCache(
+            self.bartime_cache_size, "bartime_indexes", self.bartime_cache_bytes
+        )
+        # 按K线周期缓存的K线开始时间索引, 与`_bartime_indexes`一一对应
+        self._bar_open_indexes = LRUCache(
+            self.bartime_cache_size, "bar_open_indexes", self.bartime_cache_bytes
+        )
+        # 开盘、收盘时间索引, key为是否包含休息时间段
+        self._session_indexes = {}
+        # 交易时间前缀和索引, key同`_session_indexes`, 见`_get_trading_time_index`
+        self._trading_time_indexes = {}
 
     def add(self, symbol: str, **kwargs):
-        """添加不同证券品种的日历"""
-        self._sub_calendars[symbol] = cal = copy.copy(self)
-        for k, v in kwargs.items():
-            setattr(cal, k, v)
-        cal.init()
+        """
+        添加不同证券品种的日历
+
+        `_template_key`相同的品种日历共用第一个品种`init`计算的结果(交易时间段、K线时间、
+        特殊交易时间段和索引缓存), 这些数据创建后不再修改。参数改变`_template_key`中
+        任何一项(比如`offset`、`bartime_side`)时按新的参数重新`init`
+        """
+        with _add_lock:
+            cal = copy.copy(self)
+            for k, v in kwargs.items():
+                setattr(cal, k, v)
+            key = cal._template_key()
+            template = self._templates.get(key)
+            if template is None:
+                cal.init()
+                self._templates[key] = cal
+            else:
+                cal = copy.copy(template)
+                for k, v in kwargs.items():
+                    setattr(cal, k, v)
+            self._sub_calendars[symbol] = cal
         return cal
 
+    def _template_key(self):
+        """`init`计算结果和索引缓存只与该key有关"""
+        return (
+            tuple((sos, eos) for sos, eos in self.sessions),
+            self.offset,
+            self.bartime_side,
+            tuple(sorted(self.special_sessions.items())),
+            self.bartime_cache_size,
+            self.bartime_cache_bytes,
+        )
+
     def get(self, symbol: str = None):
         """根据不同的证券品种获取不同的日历"""
         if not symbol or not self._sub_calendars:
@@ -89,12 +286,12 @@ class Calendar(ABC):
             return self._sub_calendars.get(symbol, self)
 
     @abstractmethod
-    def get_tradedays_gte(self, dt: datetime) -> List[datetime]:
+    def get_tradedays_gte(self, dt: datetime) -> Sequence[datetime]:
         """get trade days >= dt"""
         pass
 
     @abstractmethod
-    def get_tradedays_lte(self, dt: datetime) -> List[datetime]:
+    def get_tradedays_lte(self, dt: datetime) -> Sequence[datetime]:
         """get trade days <= dt"""
         pass
 
@@ -111,11 +308,64 @@ class Calendar(ABC):
     @abstractmethod
     def get_tradedays_between(
         self, start_dt: datetime, end_dt: datetime
-    ) -> List[datetime]:
+    ) -> Sequence[datetime]:
         """get start_dt <= trade days <= end_dt"""
         pass
 
-    def _calc_bartimestamp(self, sessions):
+    def get_tradedays_array(self, start_dt: datetime, end_dt: datetime) -> np.ndarray:
+        """同`get_tradedays_between`, 返回`datetime64[ns]`数组"""
+        days = self.get_tradedays_between(start_dt, end_dt)
+        return np.array(list(days), dtype="datetime64[ns]")
+
+    def tradeday_offset(self, dt: datetime, n: int, roll: str = "raise") -> datetime:
+        """
+        `dt`所在交易日之后(n为负数时之前)第n个交易日, 同`numpy.busday_offset`
+
+        Params:
+            roll: `dt`不是交易日时, "forward"从下一个交易日开始算,
+                "backward"从上一个交易日开始算, "raise"抛出`ValueError`
+        """
+        day = self._roll_tradeday(dt, roll)
+        for _ in range(abs(n)):
+            if n > 0:
+                day = self.get_tradedays_next(day + timedelta(days=1))
+            else:
+                day = self.get_tradedays_last(day - timedelta(days=1))
+        return day
+
+    def _roll_tradeday(self, dt: datetime, roll: str) -> datetime:
+        if roll == "forward":
+            return self.get_tradedays_next(dt)
+        if roll == "backward":
+            return self.get_tradedays_last(dt)
+        if roll == "raise":
+            day = self.get_tradedays_next(dt)
+            if day.date() != dt.date():
+                raise ValueError(f"{dt}不是交易日")
+            return day
+        raise ValueError(f"roll {roll} not supported")
+
+    def count_tradedays(self, start_dt: datetime, end_dt: datetime) -> int:
+        """start_dt <= trade days <= end_dt的个数"""
+        return len(self.get_tradedays_between(start_dt, end_dt))
+
+    def _get_bartimestamp(self, interval: int, side_right: bool = None):
+        """
+        一天之内的K线时间, `side_right`为True时是K线结束时间, False时是K线开始时间,
+        默认按`bartime_side`。第一次用到时计算, 不是日内K线周期时返回None
+        """
+        if side_right is None:
+            side_right = self._bartime_side_right
+        key = (interval, side_right)
+        times = self._bartimestamps.get(key)
+        if times is None:
+            if not 0 < interval < DAILY:
+                return None
+            times = self._calc_bartimestamp(self.sessions, interval, side_right)
+            self._bartimestamps[key] = times
+        return times
+
+    def _calc_bartimestamp(self, sessions, interval: int, side_right: bool):
         start = sessions[0][0]
         end = sessions[-1][1]
         jumps = []
@@ -130,14 +380,9 @@ class Calendar(ABC):
             last_eos = eos
         if end < start:
             end += 86400
-        ret = {}
-        if self._bartime_side_right:
-            for inte in self.intervals:
-                ret[inte] = self._calc_bartimestamp_right(start, end, jumps, inte)
-        else:
-            for inte in self.intervals:
-                ret[inte] = self._calc_bartimestamp_left(start, end, jumps, inte)
-        return ret
+        if side_right:
+            return self._calc_bartimestamp_right(start, end, jumps, interval)
+        return self._calc_bartimestamp_left(start, end, jumps, interval)
 
     def _calc_bartimestamp_left(self, start, end, jumps, inte):
         jump_idx = 0
@@ -148,12 +393,12 @@ class Calendar(ABC):
             start += inte
             while jump_idx < jumps_len:
                 jtime, cumj = jumps[jump_idx]
-                if start > jtime:
+                if start >= jtime:
                     start += cumj
                     jump_idx += 1
                 else:
                     break
-        return list(map(self.__bartime_seconds_to_time, ret))
+        return tuple(map(self.__bartime_seconds_to_time, ret))
 
     def _calc_bartimestamp_right(self, start, end, jumps, inte):
         jump_idx = 0
@@ -172,94 +417,402 @@ class Calendar(ABC):
                 ret.append(start)
         if not ret or ret[-1] < end:
             ret.append(end)
-        return list(map(self.__bartime_seconds_to_time, ret))
+        return tuple(map(self.__bartime_seconds_to_time, ret))
 
     def __bartime_seconds_to_time(self, sec):
         return seconds_to_time(sec) if sec < 86400 else seconds_to_time(sec - 86400)
 
     def get_current_bartime(self, dt: datetime, interval: int):
-        """获取K线时间
+        """获取K线时间, 带时区的`dt`先转换为日历时区`tz`的当地时间, 返回与`dt`相同时区的K线时间
 
         Params:
             interval(seconds): K线间隔周期
         """
+        if dt.tzinfo is not None:
+            bartime = self.get_current_bartime(self._to_naive_local(dt), interval)
+            return self._from_naive_local(bartime, dt.tzinfo)
+        found = self._search_bar_index(interval, datetime_to_ns(dt))
+        if found is not None:
+            i, _, labels = found
+            if i >= len(labels):
+                raise OutOfCalendar()
+            return ns_to_datetime(int(labels[i]))
         return self.get_bartimes(interval, dt, count=1)[0]
 
+    def get_current_bar(self, dt: datetime, interval: int) -> Tuple[datetime, datetime]:
+        """获取`dt`所在K线的(开始时间, 结束时间)，与`bartime_side`无关, 时区同`get_current_bartime`
+
+        Params:
+            interval(seconds): K线间隔周期
+        """
+        if dt.tzinfo is not None:
+            bar = self.get_current_bar(self._to_naive_local(dt), interval)
+            return tuple(self._from_naive_local(bt, dt.tzinfo) for bt in bar)
+        found = self._search_bar_index(interval, datetime_to_ns(dt))
+        if found is not None:
+            i, closes, _ = found
+            if i >= len(closes):
+                raise OutOfCalendar()
+            opens = self._get_bar_open_index(interval)
+            return ns_to_datetime(int(opens[i])), ns_to_datetime(int(closes[i]))
+        dt, start_day = self._to_offset_dt(dt)
+        for bar_open, bar_close, next_open in self._iter_bar_bounds(
+            interval, start_day
+        ):
+            if self._bar_contains(bar_close, next_open, dt):
+                return bar_open + self.offset, bar_close + self.offset
+        raise OutOfCalendar()
+
+    def get_current_bartimes(self, dts, interval: int) -> np.ndarray:
+        """批量获取K线时间，结果与逐个调用`get_current_bartime`相同
+
+        Params:
+            dts: `DatetimeIndex`或者`datetime64[ns]`数组，带时区的先转换为日历时区`tz`的当地时间
+            interval(seconds): K线间隔周期
+
+        Returns:
+            `datetime64[ns]`数组
+        """
+        dts = _naive_local_index(dts, self.tz)
+        values = np.asarray(dts, dtype="datetime64[ns]")
+        if values.size == 0:
+            return values.copy()
+        found = self._search_bar_index(interval, values.view(np.int64))
+        if found is None:
+            # 只计算一次覆盖[start, end]区间的K线，再二分查找
+            dt, start_day = self._to_offset_dt(datetime64_to_datetime(values.min()))
+            end = datetime64_to_datetime(values.max()) - self.offset
+            opens = []
+            closes = []
+            for bar_open, bar_close in self._iter_bars(interval, start_day):
+                opens.append(bar_open)
+                closes.append(bar_close)
+                if bar_close > end:
+                    break
+            offset = np.timedelta64(self.offset)
+            closes = (np.array(closes, dtype="datetime64[ns]") + offset).view(np.int64)
+            opens = (np.array(opens, dtype="datetime64[ns]") + offset).view(np.int64)
+            found = self._search_bars(closes, opens, values.view(np.int64))
+        idx, _, labels = found
+        if idx.max() >= len(labels):
+            raise OutOfCalendar()
+        return labels[idx].view("datetime64[ns]")
+
     def get_bartimes(
         self, interval: int, start: datetime, end: datetime = None, count=0
     ) -> List[datetime]:
         """
-        获取某段时间内所有的K线时间，含start，不含end，或者取前count个。
-        end和count二者必须设置其一
-
-        TODO: 还需要实现 bartime_side==left
+        获取某段时间内所有的K线时间，含start所在的K线，不含end，或者取前count个。
+        end和count二者必须设置其一, 时间段内没有K线时返回空列表,
+        带时区的时间先转换为日历时区`tz`的当地时间, 返回与`start`相同时区的K线时间
 
         Params:
             interval(seconds): K线间隔周期
         """
-        ret = []
-
-        def _check_append_conditions(bt):
-            if end is not None and bt >= end:
-                return True
-            ret.append(bt + self.offset)
-            if count > 0 and len(ret) >= count:
-                return True
-            return False
+        if _is_aware(start, end):
+            tzinfo = start.tzinfo
+            start, end = self._to_naive_local(start), self._to_naive_local(end)
+            bartimes = self.get_bartimes(interval, start, end, count)
+            return [self._from_naive_local(bt, tzinfo) for bt in bartimes]
+        found = self._search_bar_index(interval, datetime_to_ns(start))
+        if found is not None:
+            lo, _, labels = found
+            lo = int(lo)
+            if lo >= len(labels):
+                raise OutOfCalendar()
+            hi = len(labels)
+            if end is not None:
+                hi = int(labels.searchsorted(datetime_to_ns(end), side="left"))
+            if count > 0:
+                hi = min(hi, lo + count)
+            return list(map(ns_to_datetime, labels[lo:hi].tolist()))
 
-        times = self._bartimestamp.get(interval, None)
+        ret = []
         dt, start_day = self._to_offset_dt(start)
-        if times is None:
-            if interval == DAILY:
-                for day in self.get_tradedays_gte(start_day):
-                    close_time = self._combine_date_time(
-                        day, self._open_close_sessions[0][-1]
-                    )
-                    if dt <= close_time:
-                        if _check_append_conditions(close_time):
-                            return ret
-
-            elif interval == WEEKLY:
-                for close_time in self._get_bartimes(dt, start_day, _check_next_week):
-                    if _check_append_conditions(close_time):
-                        return ret
-
-            elif interval == MONTHLY:
-                for close_time in self._get_bartimes(dt, start_day, _check_next_month):
-                    if _check_append_conditions(close_time):
-                        return ret
+        for bar_open, bar_close, next_open in self._iter_bar_bounds(
+            interval, start_day
+        ):
+            if not self._bar_contains(bar_close, next_open, dt):
+                continue
+            if self._bartime_side_right:
+                bt = bar_close + self.offset
             else:
-                raise ValueError(f"bartime {interval} not supported")
-        else:
-            for day in self.get_tradedays_gte(start_day):
-                sessions = self._get_sessions_with_breaks(day)
-                bts = list(map(lambda x: self._combine_date_time(day, x), times))
-                for sos, eos in sessions:
-                    eos = self._combine_date_time(day, eos)
-                    if dt > eos:
-                        continue
-                    sos = self._combine_date_time_sos(day, sos)
-                    for bt in bts:
-                        if bt >= dt and bt <= eos and bt >= sos:
-                            if _check_append_conditions(bt):
-                                return ret
+                bt = bar_open + self.offset
+            if end is not None and bt >= end:
+                return ret
+            ret.append(bt)
+            if count > 0 and len(ret) >= count:
+                return ret
+        # 日历中已经没有K线
         if not ret:
             raise OutOfCalendar()
         return ret
 
-    def _get_bartimes(self, dt, start_day, check_func):
-        last_day = None
-        close_time = None
-        for day in self.get_tradedays_gte(start_day):
-            if last_day is not None:
-                if check_func(day, last_day):
-                    yield close_time
-            close_time = self._combine_date_time(day, self._open_close_sessions[0][-1])
-            if dt > close_time:
-                continue
-            last_day = day
+    def get_bar_ordinal(self, dt: datetime, interval: int) -> int:
+        """
+        `dt`所在K线的序号, 与`get_current_bartime`对应, 日历第一根K线为0,
+        同一个日历相邻K线的序号相差1
+
+        Params:
+            interval(seconds): K线间隔周期
+        """
+        dt = self._to_naive_local(dt)
+        found = self._search_bar_index(interval, datetime_to_ns(dt))
+        if found is None:
+            raise ValueError(f"bartime {interval} not supported")
+        i, closes, _ = found
+        if i >= len(closes):
+            raise OutOfCalendar()
+        return int(i)
+
+    def get_bar_ordinals(self, dts, interval: int) -> np.ndarray:
+        """批量获取K线序号，结果与逐个调用`get_bar_ordinal`相同
+
+        Params:
+            dts: `DatetimeIndex`或者`datetime64[ns]`数组，带时区的先转换为日历时区`tz`的当地时间
+            interval(seconds): K线间隔周期
+
+        Returns:
+            `int64`数组
+        """
+        dts = _naive_local_index(dts, self.tz)
+        values = np.asarray(dts, dtype="datetime64[ns]").view(np.int64)
+        found = self._search_bar_index(interval, values)
+        if found is None:
+            raise ValueError(f"bartime {interval} not supported")
+        idx, closes, _ = found
+        if values.size and idx.max() >= len(closes):
+            raise OutOfCalendar()
+        return idx.astype(np.int64, copy=False)
+
+    def get_bartime_by_ordinal(self, ordinal: int, interval: int) -> datetime:
+        """序号为`ordinal`的K线时间, `get_bar_ordinal`的逆运算"""
+        labels = self._get_bar_labels(interval)
+        if labels is None:
+            raise ValueError(f"bartime {interval} not supported")
+        if not 0 <= ordinal < len(labels):
+            raise OutOfCalendar()
+        return ns_to_datetime(int(labels[ordinal]))
+
+    def get_closed_bar_ordinals(self, dts, interval: int) -> np.ndarray:
+        """
+        每个时间已经结束的最后一根K线的序号(结束时间不晚于该时间), 没有时为-1,
+        用于对齐不同日历的K线
+
+        Params:
+            dts: `DatetimeIndex`或者`datetime64[ns]`数组，带时区的先转换为日历时区`tz`的当地时间
+            interval(seconds): K线间隔周期
+        """
+        closes = self._get_bartime_index(interval)
+        if closes is None:
+            raise ValueError(f"bartime {interval} not supported")
+        dts = _naive_local_index(dts, self.tz)
+        values = np.asarray(dts, dtype="datetime64[ns]").view(np.int64)
+        return closes.searchsorted(values, side="right").astype(np.int64) - 1
+
+    def get_bartimes_array(
+        self, interval: int, start: datetime, end: datetime
+    ) -> np.ndarray:
+        """
+        同`get_bartimes(interval, start, end)`, 返回`datetime64[ns]`数组(日历时区`tz`的当地时间),
+        没有K线时返回空数组
+        """
+        start, end = self._to_naive_local(start), self._to_naive_local(end)
+        found = self._search_bar_index(interval, datetime_to_ns(start))
+        if found is None:
+            bartimes = self.get_bartimes(interval, start, end)
+            return np.array(bartimes, dtype="datetime64[ns]")
+        lo, _, labels = found
+        if lo >= len(labels):
+            raise OutOfCalendar()
+        hi = labels.searchsorted(datetime_to_ns(end), side="left")
+        return labels[lo:hi].view("datetime64[ns]")
+
+    def count_bars(self, interval: int, start: datetime, end: datetime) -> int:
+        """`get_bartimes(interval, start, end)`的K线个数, 没有K线时为0"""
+        start, end = self._to_naive_local(start), self._to_naive_local(end)
+        found = self._search_bar_index(interval, datetime_to_ns(start))
+        if found is None:
+            return len(self.get_bartimes(interval, start, end))
+        lo, _, labels = found
+        if lo >= len(labels):
+            raise OutOfCalendar()
+        hi = labels.searchsorted(datetime_to_ns(end), side="left")
+        return max(int(hi) - int(lo), 0)
+
+    def _get_bar_labels(self, interval: int):
+        """K线时间索引, 按`bartime_side`取结束时间或者开始时间，不支持时返回None"""
+        if self._bartime_side_right:
+            return self._get_bartime_index(interval)
+        if self._get_bartime_index(interval) is None:
+            return None
+        return self._get_bar_open_index(interval)
+
+    def _bar_contains(self, bar_close: datetime, next_open: datetime, dt: datetime):
+        """
+        结束时间为`bar_close`的K线是否包含`dt`或者在`dt`之后,
+        `next_open`为下一根K线的开始时间, 见`bartime_side`
+        """
+        if dt != bar_close or self._bartime_side_right:
+            return dt <= bar_close
+        # 下一根K线从结束时间开始时属于下一根K线
+        return next_open != bar_close
+
+    def _search_bar_index(self, interval: int, ns):
+        """
+        在K线索引中查找纳秒时间戳`ns`(可以是数组)所在K线，
+        返回(下标, K线结束时间索引, K线时间索引)，不支持时返回None
+        """
+        closes = self._get_bartime_index(interval)
+        if closes is None:
+            return None
+        if self._bartime_side_right:
+            return self._search_bars(closes, None, ns)
+        return self._search_bars(closes, self._get_bar_open_index(interval), ns)
+
+    def _search_bars(self, closes: np.ndarray, opens: np.ndarray, ns):
+        """
+        `closes`和`opens`为一一对应的K线结束、开始时间(`right`时不需要`opens`),
+        返回(下标, K线结束时间索引, K线时间索引)
+        """
+        if self._bartime_side_right:
+            return closes.searchsorted(ns, side="left"), closes, closes
+        # 最后一根开始时间不晚于`ns`的K线, 已经结束(休息时间)的算下一根K线
+        i = opens.searchsorted(ns, side="right") - 1
+        i = np.maximum(i, 0)
+        if len(closes):
+            i = i + (ns > closes[np.minimum(i, len(closes) - 1)])
+        return i, closes, opens
+
+    def _get_bartime_index(self, interval: int):
+        """
+        返回K线结束时间索引(已排序的纳秒时间戳`int64`数组)，不支持或者索引超过
+        `bartime_cache_bytes`时返回None，此时`get_bartimes`逐日计算
+        """
+        return None
+
+    def _get_bar_open_index(self, interval: int):
+        """
+        返回K线开始时间索引，与`_get_bartime_index`一一对应，
+        跨越休息时间的K线从上一根K线结束开始，否则从开盘开始
+        """
+        return None
+
+    def _calc_day_bartimes(self, sessions, interval: int) -> List[int]:
+        """
+        按某个交易日的交易时间段`sessions`，计算当天的K线结束时间，
+        单位为距离交易日0点的秒数
+        """
+        times = [
+            self._time_to_day_seconds(tm)
+            for tm in self._get_bartimestamp(interval, True)
+        ]
+        ret = []
+        for sos, eos in sessions:
+            sos = self._time_to_day_seconds(sos, True)
+            eos = self._time_to_day_seconds(eos)
+            ret.extend(t for t in times if t >= sos and t <= eos)
+        return ret
+
+    def _get_session_index(self, with_breaks: bool):
+        """
+        返回(开盘时间, 收盘时间)索引(已排序的纳秒时间戳`int64`数组)，
+        不支持时返回None，此时`_find_next_session`逐日计算
+        """
+        return None
 
-    def _get_certain_tradedays(self, dt, check_func):
+    def _calc_day_session_bounds(self, sessions, side: int) -> List[int]:
+        """
+        某个交易日的开盘(`side`=0)或收盘(`side`=1)时间，单位为距离交易日0点的秒数
+        """
+        return [
+            self._time_to_day_seconds(s[side], side == 0)
+            for s in sessions
+            if s[side] is not None
+        ]
+
+    def _iter_bars(self, interval: int, start_day: datetime):
+        """
+        逐个生成(K线开始时间, K线结束时间)，未加上offset，包含交易日`start_day`所在的K线
+        """
+        start_day = self._get_bars_start_day(interval, start_day)
+        sessions = (
+            session
+            for day in self.get_tradedays_gte(start_day)
+            for session in self._get_day_sessions(day)
+        )
+        session = next(sessions, None)
+        if session is None:
+            return
+        sos, eos = session
+        bar_open = sos
+        for bar_close in self._iter_bar_closes(interval, start_day):
+            yield bar_open, bar_close
+            # 下一根K线从本K线结束开始, 本K线在收盘时结束的从下一次开盘开始
+            while eos <= bar_close:
+                session = next(sessions, None)
+                if session is None:
+                    return
+                sos, eos = session
+            bar_open = max(sos, bar_close)
+
+    def _iter_bar_bounds(self, interval: int, start_day: datetime):
+        """
+        同`_iter_bars`, 逐个生成(K线开始时间, K线结束时间, 下一根K线开始时间),
+        最后一根K线的下一根K线开始时间为None
+        """
+        bars = self._iter_bars(interval, start_day)
+        prev = next(bars, None)
+        for bar in bars:
+            yield prev[0], prev[1], bar[0]
+            prev = bar
+        if prev is not None:
+            yield prev[0], prev[1], None
+
+    def _get_bars_start_day(self, interval: int, start_day: datetime):
+        """从上一根K线所在交易日开始计算，才能知道`start_day`所在K线的开始时间"""
+        if interval in _PERIOD_CHECKS:
+            start_day = _get_period_first_day(start_day, interval)
+        try:
+            return self.get_tradedays_last(start_day - day_offset)
+        except OutOfCalendar:
+            return start_day
+
+    def _iter_bar_closes(self, interval: int, start_day: datetime):
+        times = self._get_bartimestamp(interval, True)
+        if times is not None:
+            for day in self.get_tradedays_gte(start_day):
+                bts = sorted(self._combine_date_time(day, tm) for tm in times)
+                last_bt = None
+                for sos, eos in self._get_day_sessions(day):
+                    for bt in bts:
+                        if bt >= sos and bt <= eos and bt != last_bt:
+                            yield bt
+                            last_bt = bt
+        elif interval == DAILY:
+            close_time = self._open_close_sessions[0][-1]
+            for day in self.get_tradedays_gte(start_day):
+                yield self._combine_date_time(day, close_time)
+        elif interval in _PERIOD_CHECKS:
+            close_time = self._open_close_sessions[0][-1]
+            for _, last_day in self._get_certain_tradedays(start_day, interval):
+                yield self._combine_date_time(last_day, close_time)
+        else:
+            raise ValueError(f"bartime {interval} not supported")
+
+    def _get_day_sessions(self, day: datetime) -> List[Tuple[datetime, datetime]]:
+        """某个交易日按时间先后排序的交易时间段(包括休息时间)，未加上offset"""
+        return sorted(
+            (self._combine_date_time_sos(day, sos), self._combine_date_time(day, eos))
+            for sos, eos in self._get_sessions_with_breaks(day)
+        )
+
+    def _get_certain_tradedays(self, dt, period: int):
+        """
+        逐个生成(本周期第一个交易日, 上周期最后一个交易日),
+        `period`为`WEEKLY`, `MONTHLY`, `QUARTERLY`或者`YEARLY`
+        """
+        check_func = _PERIOD_CHECKS[period]
         last_day = None
         for day in self.get_tradedays_gte(dt):
             if last_day is not None:
@@ -268,10 +821,10 @@ class Calendar(ABC):
             last_day = day
 
     def _get_tradedays_xxx_end(
-        self, start: datetime, end: datetime, count: int, check_func
+        self, start: datetime, end: datetime, count: int, period: int
     ) -> List[datetime]:
         ret = []
-        for d in self._get_certain_tradedays(start, check_func):
+        for d in self._get_certain_tradedays(start, period):
             bt = d[1]
             if end is not None and bt > end:
                 break
@@ -281,11 +834,11 @@ class Calendar(ABC):
         return ret
 
     def _get_tradedays_xxx_begin(
-        self, start: datetime, end: datetime, count: int, check_func
+        self, start: datetime, end: datetime, count: int, period: int
     ) -> List[datetime]:
         ret = []
         last_tradeday = self.get_tradedays_last(start - timedelta(days=1))
-        for d in self._get_certain_tradedays(last_tradeday, check_func):
+        for d in self._get_certain_tradedays(last_tradeday, period):
             bt = d[0]
             if end is not None and bt > end:
                 break
@@ -294,6 +847,28 @@ class Calendar(ABC):
                 break
         return ret
 
+    def _iter_periods(self, start: datetime, period: int):
+        """
+        从`start`所在周期开始, 逐个生成(周期内的交易日列表, 周期是否已经结束),
+        日历的第一个周期不知道从哪天开始, 不生成
+        """
+        check_func = _PERIOD_CHECKS[period]
+        first_day = _get_period_first_day(start, period)
+        days = None
+        last_day = None
+        for day in self.get_tradedays_gte(
+            self.get_tradedays_last(first_day - timedelta(days=1))
+        ):
+            if last_day is not None and check_func(day, last_day):
+                if days is not None:
+                    yield days, True
+                days = []
+            if days is not None:
+                days.append(day)
+            last_day = day
+        if days:
+            yield days, False
+
     @overload
     def get_tradedays_month_end(self, start: datetime) -> List[datetime]:
         """return all month ends >=`start`"""
@@ -309,7 +884,7 @@ class Calendar(ABC):
     def get_tradedays_month_end(
         self, start: datetime, end: datetime = None, count: int = 0
     ) -> List[datetime]:
-        return self._get_tradedays_xxx_end(start, end, count, _check_next_month)
+        return self._get_tradedays_xxx_end(start, end, count, MONTHLY)
 
     @overload
     def get_tradedays_month_begin(self, start: datetime) -> List[datetime]:
@@ -330,7 +905,7 @@ class Calendar(ABC):
     def get_tradedays_month_begin(
         self, start: datetime, end: datetime = None, count: int = 0
     ) -> List[datetime]:
-        return self._get_tradedays_xxx_begin(start, end, count, _check_next_month)
+        return self._get_tradedays_xxx_begin(start, end, count, MONTHLY)
 
     @overload
     def get_tradedays_week_end(self, start: datetime) -> List[datetime]:
@@ -347,7 +922,7 @@ class Calendar(ABC):
     def get_tradedays_week_end(
         self, start: datetime, end: datetime = None, count: int = 0
     ) -> List[datetime]:
-        return self._get_tradedays_xxx_end(start, end, count, _check_next_week)
+        return self._get_tradedays_xxx_end(start, end, count, WEEKLY)
 
     @overload
     def get_tradedays_week_begin(self, start: datetime) -> List[datetime]:
@@ -368,7 +943,7 @@ class Calendar(ABC):
     def get_tradedays_week_begin(
         self, start: datetime, end: datetime = None, count: int = 0
     ) -> List[datetime]:
-        return self._get_tradedays_xxx_begin(start, end, count, _check_next_week)
+        return self._get_tradedays_xxx_begin(start, end, count, WEEKLY)
 
     @overload
     def get_tradedays_week_day(self, weekday: int, start: datetime) -> List[datetime]:
@@ -399,9 +974,126 @@ class Calendar(ABC):
                     break
         return ret
 
+    @overload
+    def get_tradedays_quarter_end(self, start: datetime) -> List[datetime]:
+        """return all quarter ends >=`start`"""
+
+    @overload
+    def get_tradedays_quarter_end(
+        self, start: datetime, *, count: int
+    ) -> List[datetime]:
+        """return n quarter ends >=`start`"""
+
+    @overload
+    def get_tradedays_quarter_end(
+        self, start: datetime, end: datetime
+    ) -> List[datetime]:
+        """return all `end` >= quarter ends >=`start`"""
+
+    def get_tradedays_quarter_end(
+        self, start: datetime, end: datetime = None, count: int = 0
+    ) -> List[datetime]:
+        return self._get_tradedays_xxx_end(start, end, count, QUARTERLY)
+
+    @overload
+    def get_tradedays_quarter_begin(self, start: datetime) -> List[datetime]:
+        """return all quarter begins >=`start`"""
+
+    @overload
+    def get_tradedays_quarter_begin(
+        self, start: datetime, *, count: int
+    ) -> List[datetime]:
+        """return n quarter begins >=`start`"""
+
+    @overload
+    def get_tradedays_quarter_begin(
+        self, start: datetime, end: datetime
+    ) -> List[datetime]:
+        """return all `end` >= quarter begins >=`start`"""
+
+    def get_tradedays_quarter_begin(
+        self, start: datetime, end: datetime = None, count: int = 0
+    ) -> List[datetime]:
+        return self._get_tradedays_xxx_begin(start, end, count, QUARTERLY)
+
+    @overload
+    def get_tradedays_year_end(self, start: datetime) -> List[datetime]:
+        """return all year ends >=`start`"""
+
+    @overload
+    def get_tradedays_year_end(self, start: datetime, *, count: int) -> List[datetime]:
+        """return n year ends >=`start`"""
+
+    @overload
+    def get_tradedays_year_end(self, start: datetime, end: datetime) -> List[datetime]:
+        """return all `end` >= year ends >=`start`"""
+
+    def get_tradedays_year_end(
+        self, start: datetime, end: datetime = None, count: int = 0
+    ) -> List[datetime]:
+        return self._get_tradedays_xxx_end(start, end, count, YEARLY)
+
+    @overload
+    def get_tradedays_year_begin(self, start: datetime) -> List[datetime]:
+        """return all year begins >=`start`"""
+
+    @overload
+    def get_tradedays_year_begin(
+        self, start: datetime, *, count: int
+    ) -> List[datetime]:
+        """return n year begins >=`start`"""
+
+    @overload
+    def get_tradedays_year_begin(
+        self, start: datetime, end: datetime
+    ) -> List[datetime]:
+        """return all `end` >= year begins >=`start`"""
+
+    def get_tradedays_year_begin(
+        self, start: datetime, end: datetime = None, count: int = 0
+    ) -> List[datetime]:
+        return self._get_tradedays_xxx_begin(start, end, count, YEARLY)
+
+    def get_tradedays_nth(
+        self,
+        period: int,
+        n: int,
+        start: datetime,
+        end: datetime = None,
+        count: int = 0,
+        *,
+        weekday: int = None,
+    ) -> List[datetime]:
+        """
+        每个周期的第n个交易日(不早于`start`), 比如每月第3个交易日、每季度最后一个
+        交易周五, 交易日不足n个的周期跳过
+
+        Params:
+            period: `WEEKLY`, `MONTHLY`, `QUARTERLY`或者`YEARLY`
+            n: 从1开始, 负数表示倒数第n个, 只在周期结束以后才有
+            weekday: 只算星期几的交易日, weekday in [1, 7]
+        """
+        _check_nth_args(period, n, weekday)
+        ret = []
+        first_day = self.get_tradedays_next(start)
+        for days, finished in self._iter_periods(start, period):
+            if weekday is not None:
+                days = [day for day in days if _check_week_day(day, weekday)]
+            if len(days) < abs(n) or n < 0 and not finished:
+                continue
+            day = days[n - 1 if n > 0 else n]
+            if day < first_day:
+                continue
+            if end is not None and day > end:
+                break
+            ret.append(day)
+            if count > 0 and len(ret) >= count:
+                break
+        return ret
+
     def get_special_sessions(self, dt: datetime):
         """从配置special_sessions中读取，或者重写该函数"""
-        return self.special_sessions.get(dt.date().isoformat())
+        return self.special_sessions.get(dt.toordinal())
 
     def _get_sessions_with_breaks(
         self, dt: datetime
@@ -425,7 +1117,7 @@ class Calendar(ABC):
 
     def _to_offset_dt(self, dt: datetime):
         trading_day = dt = dt - self.offset
-        if dt.time() == time.min and self._bartime_side_right:
+        if dt.time() == time.min:
             trading_day -= day_offset
         return dt, trading_day
 
@@ -440,16 +1132,47 @@ class Calendar(ABC):
         time_sec = time_to_seconds(tm)
         if time_sec > self._offset_seconds:
             offset = self.offset
-        elif time_sec == self._offset_seconds:
-            if self._bartime_side_right:
-                offset = self._offset_minus_day
-            else:
-                offset = self.offset
         else:
             offset = self._offset_minus_day
         return datetime.combine(trading_day.date(), tm) - offset
 
+    def _time_to_day_seconds(self, tm: time, sos: bool = False):
+        """
+        与`_combine_date_time`(`sos`为True时`_combine_date_time_sos`)结果一致，
+        返回距离交易日0点的秒数，跨越0点的时间加上一天
+        """
+        time_sec = time_to_seconds(tm)
+        if sos and tm == self._session_time[0][0]:
+            return time_sec
+        if time_sec > self._offset_seconds:
+            return time_sec
+        return time_sec + 86400
+
+    def _search_session_index(self, index, ns):
+        """
+        在开盘、收盘时间索引中查找纳秒时间戳`ns`(可以是数组)之后的
+        下一次(开盘, 收盘)纳秒时间戳
+        """
+        opens, closes = index
+        i = opens.searchsorted(ns, side="right")
+        j = closes.searchsorted(ns, side="left")
+        if isinstance(ns, np.ndarray):
+            if ns.size and (i.max() >= len(opens) or j.max() >= len(closes)):
+                raise OutOfCalendar()
+            return opens[i], closes[j]
+        if i >= len(opens) or j >= len(closes):
+            raise OutOfCalendar()
+        return int(opens[i]), int(closes[j])
+
     def _find_next_session(self, dt: datetime, with_breaks: bool):
+        if dt.tzinfo is not None:
+            session = self._find_next_session(self._to_naive_local(dt), with_breaks)
+            return tuple(self._from_naive_local(t, dt.tzinfo) for t in session)
+        index = self._get_session_index(with_breaks)
+        if index is not None:
+            sos_ns, eos_ns = self._search_session_index(index, datetime_to_ns(dt))
+            return (ns_to_datetime(sos_ns), ns_to_datetime(eos_ns))
+
         dt, start_day = self._to_offset_dt(dt)
         next_sos_dt = next_eos_dt = None
         for day in self.get_tradedays_gte(start_day):
@@ -473,12 +1196,12 @@ class Calendar(ABC):
         return (next_sos_dt + self.offset, next_eos_dt + self.offset)
 
     def get_open_close_dt(self, dt: datetime) -> Tuple[datetime, datetime]:
-        """给定时间`dt`, 获取下一次(开盘, 收盘)。"""
+        """给定时间`dt`, 获取下一次(开盘, 收盘)。时区同`get_current_bartime`"""
         return self._find_next_session(dt, False)
 
     def get_session_dt(self, dt: datetime) -> Tuple[datetime, datetime]:
         """
-        给定时间`dt`, 获取下一次(开盘, 收盘)。休息时间段也算是收盘
+        给定时间`dt`, 获取下一次(开盘, 收盘)。休息时间段也算是收盘, 时区同`get_current_bartime`
         """
         return self._find_next_session(dt, True)
 
@@ -496,25 +1219,237 @@ class Calendar(ABC):
 
     def is_trading(self, dt: datetime):
         """
-        判断时间`dt`是否正在交易中, `dt`时间必须是交易所本地时间
+        判断时间`dt`是否正在交易中, 不带时区的`dt`必须是交易所本地时间,
+        带时区的先转换为日历时区`tz`的当地时间
         """
-        if dt.tzinfo is not None:
-            dt = dt.replace(tzinfo=None)
+        dt = self._to_naive_local(dt)
+        index = self._get_session_index(True)
+        if index is not None:
+            sos_ns, eos_ns = self._search_session_index(index, datetime_to_ns(dt))
+            return eos_ns < sos_ns
         sos_dt, eos_dt = self.get_session_dt(dt)
         return eos_dt < sos_dt  # 先收盘 再开盘
 
+    def _to_naive_local(self, dt: datetime) -> datetime:
+        """带时区的`dt`转换为日历时区`tz`的当地时间并去掉时区, `tz`为None时只去掉时区"""
+        if dt is not None and dt.tzinfo is not None:
+            if self.tz is not None:
+                dt = dt.astimezone(self.tz)
+            dt = dt.replace(tzinfo=None)
+        return dt
+
+    def _from_naive_local(self, dt: datetime, tzinfo) -> datetime:
+        """`_to_naive_local`的逆运算, 日历时区`tz`的当地时间`dt`转换为`tzinfo`时区"""
+        if tzinfo is None:
+            return dt
+        if self.tz is None:
+            return dt.replace(tzinfo=tzinfo)
+        return dt.replace(tzinfo=self.tz).astimezone(tzinfo)
+
+    def to_local_ns(self, ts):
+        """
+        UTC纳秒时间戳(`int`或者`int64`数组)转换为日历时区`tz`的当地时间纳秒时间戳,
+        `tz`为None时不转换
+        """
+        if self.tz is None:
+            return ts
+        return _get_tz_table(self.tz).to_local(ts)
+
+    def to_utc_ns(self, ns):
+        """`to_local_ns`的逆运算"""
+        if self.tz is None:
+            return ns
+        return _get_tz_table(self.tz).to_utc(ns)
+
+    def is_trading_ns(self, ts):
+        """
+        同`is_trading`, 不需要创建`datetime`, 用于逐笔行情
+
+        Params:
+            ts: UTC纳秒时间戳(`int`或者`int64`数组)、`datetime64`或者`DatetimeIndex`,
+                按日历时区`tz`转换为当地时间
+
+        Returns:
+            `bool`, `ts`为数组时返回`bool`数组
+        """
+        ns, _ = self._epoch_to_local(ts)
+        index = self._get_session_index(True)
+        if index is not None:
+            sos, eos = self._search_session_index(index, ns)
+            return eos < sos
+        if isinstance(ns, np.ndarray):
+            return np.array(
+                [self.is_trading(ns_to_datetime(v)) for v in ns.tolist()], dtype=bool
+            )
+        return self.is_trading(ns_to_datetime(ns))
+
+    def get_current_bartime_ns(self, ts, interval: int):
+        """
+        同`get_current_bartime`, 参数`ts`同`is_trading_ns`,
+        返回与`ts`相同类型的UTC时间戳
+
+        Params:
+            interval(seconds): K线间隔周期
+        """
+        ns, as_datetime64 = self._epoch_to_local(ts)
+        if isinstance(ns, np.ndarray):
+            bartimes = self.get_current_bartimes(ns.view("datetime64[ns]"), interval)
+            return self._local_to_epoch(bartimes.view(np.int64), as_datetime64)
+        found = self._search_bar_index(interval, ns)
+        if found is None:
+            bt = datetime_to_ns(self.get_current_bartime(ns_to_datetime(ns), interval))
+        else:
+            i, _, labels = found
+            if i >= len(labels):
+                raise OutOfCalendar()
+            bt = int(labels[i])
+        return self._local_to_epoch(bt, as_datetime64)
+
+    def get_open_close_ns(self, ts):
+        """同`get_open_close_dt`, 参数和返回值同`get_current_bartime_ns`"""
+        return self._find_next_session_ns(ts, False)
+
+    def get_session_ns(self, ts):
+        """同`get_session_dt`, 参数和返回值同`get_current_bartime_ns`"""
+        return self._find_next_session_ns(ts, True)
+
+    def _find_next_session_ns(self, ts, with_breaks: bool):
+        ns, as_datetime64 = self._epoch_to_local(ts)
+        index = self._get_session_index(with_breaks)
+        if index is not None:
+            sos, eos = self._search_session_index(index, ns)
+        elif isinstance(ns, np.ndarray):
+            sessions = [
+                self._find_next_session(ns_to_datetime(v), with_breaks)
+                for v in ns.tolist()
+            ]
+            sos = np.array([datetime_to_ns(s[0]) for s in sessions], dtype=np.int64)
+            eos = np.array([datetime_to_ns(s[1]) for s in sessions], dtype=np.int64)
+        else:
+            sos, eos = self._find_next_session(ns_to_datetime(ns), with_breaks)
+            sos, eos = datetime_to_ns(sos), datetime_to_ns(eos)
+        return (
+            self._local_to_epoch(sos, as_datetime64),
+            self._local_to_epoch(eos, as_datetime64),
+        )
+
+    def _epoch_to_local(self, ts):
+        """
+        UTC时间戳转换为当地时间纳秒时间戳(`int`或者`int64`数组),
+        返回(纳秒时间戳, 输入是否为`datetime64`)
+        """
+        if type(ts) is int:
+            return self.to_local_ns(ts), False
+        as_datetime64 = False
+        if getattr(ts, "tz", None) is not None:
+            # 带时区的DatetimeIndex转换为UTC, 不带时区的按UTC处理
+            ts = ts.tz_convert(None)
+        if hasattr(ts, "dtype") and ts.dtype.kind == "M":
+            ts = np.asarray(ts, dtype="datetime64[ns]").view(np.int64)
+            as_datetime64 = True
+        if np.ndim(ts):
+            ts = np.asarray(ts, dtype=np.int64)
+        else:
+            ts = int(ts)
+        return self.to_local_ns(ts), as_datetime64
+
+    def _local_to_epoch(self, ns, as_datetime64: bool):
+        """`_epoch_to_local`的逆运算"""
+        ns = self.to_utc_ns(ns)
+        if not as_datetime64:
+            return ns
+        if isinstance(ns, np.ndarray):
+            return ns.view("datetime64[ns]")
+        return np.datetime64(ns, "ns")
+
+    def get_trading_seconds(self, start: datetime, end: datetime) -> float:
+        """
+        `start`到`end`之间的交易秒数, 不包括休息时间和节假日,
+        `end`早于`start`时为负数, 带时区的先转换为日历时区`tz`的当地时间
+        """
+        index = self._get_trading_time_index(True)
+        if index is None:
+            raise ValueError(f"{type(self).__name__}不支持交易时间计算")
+        start = self._to_naive_local(start)
+        end = self._to_naive_local(end)
+        start_ns = self._elapsed_trading_ns(index, datetime_to_ns(start))
+        end_ns = self._elapsed_trading_ns(index, datetime_to_ns(end))
+        return (end_ns - start_ns) / ns_per_second
+
+    def trading_time_offset(self, dt: datetime, delta) -> datetime:
+        """
+        `dt`之后(`delta`为负数时之前)经过`delta`交易时间的时刻,
+        正好在收盘时结束时返回收盘时间, 倒退到开盘时返回开盘时间,
+        带时区的`dt`按日历时区`tz`计算, 返回与`dt`相同时区的时间
+
+        Params:
+            delta: 交易秒数或者`timedelta`
+        """
+        index = self._get_trading_time_index(True)
+        if index is None:
+            raise ValueError(f"{type(self).__name__}不支持交易时间计算")
+        if isinstance(delta, timedelta):
+            delta_ns = delta // _one_microsecond * 1000
+        else:
+            delta_ns = round(delta * ns_per_second)
+        if delta_ns == 0:
+            return dt
+        opens, _, elapsed = index
+        ns = datetime_to_ns(self._to_naive_local(dt))
+        target = self._elapsed_trading_ns(index, ns) + delta_ns
+        side = "left" if delta_ns > 0 else "right"
+        k = int(elapsed.searchsorted(target, side=side)) - 1
+        if k < 0 or k >= len(opens):
+            raise OutOfCalendar()
+        ns = int(opens[k]) + target - int(elapsed[k])
+        return self._from_naive_local(ns_to_datetime(ns), dt.tzinfo)
+
+    def _get_trading_time_index(self, with_breaks: bool):
+        """
+        返回(开盘时间, 收盘时间, 每次开盘之前累计的交易纳秒数)索引,
+        由`_get_session_index`计算, 不支持时返回None
+        """
+        index = self._trading_time_indexes.get(with_breaks)
+        if index is None:
+            session_index = self._get_session_index(with_breaks)
+            if session_index is None:
+                return None
+            opens, closes = session_index
+            elapsed = np.concatenate(([0], np.cumsum(closes - opens)))
+            elapsed.flags.writeable = False
+            index = (opens, closes, elapsed)
+            self._trading_time_indexes[with_breaks] = index
+        return index
+
+    def _elapsed_trading_ns(self, index, ns: int) -> int:
+        """从日历第一次开盘到纳秒时间戳`ns`累计的交易纳秒数"""
+        opens, closes, elapsed = index
+        i = int(opens.searchsorted(ns, side="right")) - 1
+        if i < 0 or ns > closes[-1]:
+            raise OutOfCalendar()
+        sos, eos = int(opens[i]), int(closes[i])
+        return int(elapsed[i]) + min(ns, eos) - sos
+
     def is_trading_day(self, dt: datetime):
         """
-        判断是否交易日
+        判断是否交易日, 带时区的`dt`先转换为日历时区`tz`的当地时间
         """
-        _, today = self._to_offset_dt(dt)
-        return self._trade_status[today.date().isoformat()] == 1
+        _, today = self._to_offset_dt(self._to_naive_local(dt))
+        return bool(self._trade_status[self._day_pos(today)] == 1)
+
+    def _day_pos(self, dt: datetime) -> int:
+        """`dt`所在日期在`_trade_status`中的下标"""
+        pos = dt.toordinal() - self._first_ordinal
+        if pos < 0 or pos >= len(self._trade_status):
+            raise OutOfCalendar()
+        return pos
 
     def is_trading_time(self, dt: datetime):
         """
-        判断是否交易时间段，不判断是否交易，只要在时间段内，都返回True
+        判断是否交易时间段，不判断是否交易，只要在时间段内，都返回True,
+        带时区的`dt`先转换为日历时区`tz`的当地时间
         """
-        tm = dt.time()
+        tm = self._to_naive_local(dt).time()
         for start, end in self._sorted_session_time:
             if start < end:
                 if tm >= start and tm <= end:
@@ -542,15 +1477,17 @@ K线时间点划分:
             i += 1
 
         bartimestamps = []
-        for k, v in self._bartimestamp.items():
-            v = list(map(lambda x: x.isoformat(), v))
+        for k in self.intervals:
+            v = list(map(lambda x: x.isoformat(), self._get_bartimestamp(k)))
             if len(v) > 8:
                 v = f"[{v[0]},{v[1]},{v[2]},{v[3]},...{v[-4]},{v[-3]},{v[-2]},{v[-1]}]"
-            k //= 60
-            unit = "m"
-            if k >= 60:
+            unit = "s"
+            if k % 60 == 0:
                 k //= 60
-                unit = "H"
+                unit = "m"
+                if k >= 60 and k % 60 == 0:
+                    k //= 60
+                    unit = "H"
             bartimestamps.append(f"\t{k}{unit})\t{v}")
 
         return self.string_format.format(
@@ -563,48 +1500,464 @@ K线时间点划分:
 class MongoDBCalendar(Calendar):
     COLLECTION_NAME = ""
 
-    def __init__(self, mongo_client):
+    def __init__(self, mongo_client=None, *, data: dict = None):
+        """
+        Params:
+            mongo_client: 从MongoDB读取日历数据, 也可以是`CalendarSource`,
+                比如`ParquetSource`从本地Parquet文件读取
+            data: 已经读取好的日历数据(格式同`_fetch_data`), 不为None时不访问数据来源
+        """
         super().__init__()
-        days = qd.mongo_get_data(mongo_client[DB_NAME_CALENDAR], self.COLLECTION_NAME)
-        self._tradedays: list = []
-        # 为了加速`get_tradedays_gte`和`get_tradedays_lte`的执行
-        self._tradedays_indexers: dict = {}
-
-        for day in days:
-            dt = day["_id"]
-            status = day["status"]
-            strdt = dt.date().isoformat()
-            self._trade_status[strdt] = status
-            _index = len(self._tradedays)
-            if status == 1:
-                self._tradedays.append(dt)
-                self._tradedays_indexers[strdt] = (_index, _index)
-            else:
-                self._tradedays_indexers[strdt] = (_index - 1, _index)
+        self.data_version = None
+        """ 日历数据版本, 见`get_data_version`"""
+        if data is None:
+            source = as_source(mongo_client)
+            self.data_version = self.get_data_version(source)
+            data = self._fetch_data(source)
+        self._load_data(data)
+
+    @classmethod
+    def collection_names(cls) -> Tuple[str, ...]:
+        """日历数据所在的集合"""
+        return (cls.COLLECTION_NAME,)
+
+    @classmethod
+    def get_data_version(cls, source):
+        """读取`update`写入的数据版本, 任一集合没有记录时返回None"""
+        source = as_source(source)
+        versions = []
+        for col in cls.collection_names():
+            version = source.read_version(col)
+            if version is None:
+                return None
+            versions.append(f"{col}:{version}")
+        return ",".join(versions)
+
+    @classmethod
+    def _fetch_data(cls, source: CalendarSource) -> dict:
+        """
+        从数据来源读取日历数据, 返回
+        {"dates": 连续的日期(列表或者`datetime64`数组), "status": 每天的交易状态}
+        """
+        dates, status = source.read_days(cls.COLLECTION_NAME)
+        return {"dates": dates, "status": status}
+
+    def _load_data(self, data: dict):
+        if "tradedays" in data:
+            # 快照中已经计算好的数组, 直接引用, 不复制
+            first_ordinal, days = data["first_ordinal"], data
+        else:
+            first_ordinal, days = _calc_day_arrays(
+                self.COLLECTION_NAME, data["dates"], data["status"]
+            )
+        self._first_ordinal = first_ordinal
+        self._trade_status = days["status"]
+        self._tradedays_ns = days["tradedays"]
+        # 为了加速`get_tradedays_gte`和`get_tradedays_lte`的执行, 下标与`_trade_status`相同
+        # 小于等于当天的最后一个交易日, 大于等于当天的第一个交易日
+        self._tradedays_lte = days["tradedays_lte"]
+        self._tradedays_gte = days["tradedays_gte"]
+        self._nth_positions = LRUCache(self.bartime_cache_size, "nth_positions")
+
+    @cached_property
+    def _tradedays(self) -> list:
+        """交易日列表(`datetime`), 第一次用到时从`_tradedays_ns`生成"""
+        return (
+            self._tradedays_ns.view("datetime64[ns]").astype("datetime64[us]").tolist()
+        )
+
+    @cached_property
+    def _period_ids(self) -> Mapping[int, np.ndarray]:
+        """每个交易日所在的周、月、季度、年的编号"""
+        days = self._tradedays_ns.view("datetime64[ns]").astype("datetime64[D]")
+        weeks = (days.view(np.int64) + _EPOCH_ORDINAL - 1) // 7
+        months = days.astype("datetime64[M]").view(np.int64)  # 从1970年1月开始
+        return {
+            WEEKLY: weeks,
+            MONTHLY: months,
+            QUARTERLY: months // 3,
+            YEARLY: months // 12,
+        }
+
+    @cached_property
+    def _period_ends(self) -> Mapping[int, np.ndarray]:
+        """每个周期最后一个交易日在`_tradedays`中的下标, 不包括最后一个周期"""
+        return {
+            period: np.flatnonzero(np.diff(ids))
+            for period, ids in self._period_ids.items()
+        }
+
+    @cached_property
+    def _weekday_positions(self) -> Tuple[np.ndarray, ...]:
+        """周一到周日(ordinal 1是周一)的交易日在`_tradedays`中的下标"""
+        days = self._tradedays_ns.view("datetime64[ns]").astype("datetime64[D]")
+        weekdays = (days.view(np.int64) + _EPOCH_ORDINAL - 1) % 7
+        return tuple(np.flatnonzero(weekdays == i) for i in range(7))
+
+    def _snapshot_data(self) -> dict:
+        """除了`dates`和`status`以外, 需要保存到快照的日历数据(可JSON序列化)"""
+        return {}
+
+    @classmethod
+    def _snapshot_config(cls) -> str:
+        """类属性改变后快照失效"""
+        return repr((cls.sessions, cls.offset, cls.intervals, cls.bartime_side))
+
+    def _iter_calendars(self):
+        yield "", self
+        yield from self._sub_calendars.items()
+
+    def save_snapshot(self, path: str):
+        """
+        保存日历到本地快照文件, 包括所有品种已经计算好的K线时间、开盘收盘时间索引,
+        可以用`from_snapshot`离线打开
+        """
+        snapshot.write(path, *self._make_snapshot())
+
+    def to_shared_memory(self, name: str = None):
+        """
+        把日历(内容同`save_snapshot`)复制到共享内存, 其它进程(比如回测的worker)
+        可以用`attach_shared_memory(shm.name)`只读挂载, 索引数组不复制
+
+        Returns:
+            `multiprocessing.shared_memory.SharedMemory`, 不再使用时调用`close()`和`unlink()`
+        """
+        return snapshot.write_shared(*self._make_snapshot(), name=name)
 
-    def get_tradedays_gte(self, dt: datetime) -> List[datetime]:
+    @classmethod
+    def attach_shared_memory(cls, name: str):
+        """
+        挂载`to_shared_memory`创建的共享内存, 交易状态、交易日和K线时间等索引数组
+        直接引用共享内存, 不按交易日重新计算, 共享内存不可用时抛出`SnapshotError`
+        """
+        meta, arrays, shm = snapshot.read_shared(name)
+        cls._check_snapshot(meta, name)
+        cal = cls._load_snapshot(meta, arrays)
+        # 保持共享内存映射
+        cal._shared_memory = shm
+        return cal
+
+    def _make_snapshot(self):
+        """返回快照的(元数据, 数组)"""
+        arrays = {
+            "status": self._trade_status,
+            "tradedays": self._tradedays_ns,
+            "tradedays_lte": self._tradedays_lte,
+            "tradedays_gte": self._tradedays_gte,
+        }
+        saved = set()
+        for symbol, cal in self._iter_calendars():
+            # 共用模板的品种日历只保存一次
+            if id(cal._bartime_indexes) in saved:
+                continue
+            saved.add(id(cal._bartime_indexes))
+            for interval, index in cal._bartime_indexes.items():
+                arrays[f"{symbol}/bartime/{interval}"] = index
+            for interval, index in cal._bar_open_indexes.items():
+                arrays[f"{symbol}/baropen/{interval}"] = index
+            for with_breaks, index in cal._session_indexes.items():
+                for side, arr in enumerate(index):
+                    arrays[f"{symbol}/session/{int(with_breaks)}/{side}"] = arr
+        meta = {
+            "calendar": type(self).__name__,
+            "config": self._snapshot_config(),
+            "data_version": self.data_version,
+            "first_ordinal": self._first_ordinal,
+            "data": self._snapshot_data(),
+        }
+        return meta, arrays
+
+    @classmethod
+    def _check_snapshot(cls, meta: dict, path: str):
+        if meta["calendar"] != cls.__name__:
+            raise snapshot.SnapshotError(f"快照{path}不是{cls.__name__}")
+        if meta["config"] != cls._snapshot_config():
+            raise snapshot.SnapshotError(f"快照{path}的日历配置已改变")
+
+    @classmethod
+    def from_snapshot(cls, path: str, mongo_client=None):
+        """
+        从本地快照打开日历, 索引数组直接映射到文件
+
+        mongo_client为None时直接使用快照(离线环境), 快照不可用时抛出`SnapshotError`;
+        否则比较`get_data_version`, 快照不存在、已过期或者数据没有版本记录时,
+        从MongoDB(或者`CalendarSource`)重新读取并保存快照
+        """
+        if mongo_client is not None:
+            mongo_client = as_source(mongo_client)
+        version = None if mongo_client is None else cls.get_data_version(mongo_client)
+        try:
+            meta, arrays = snapshot.read(path)
+            cls._check_snapshot(meta, path)
+            if mongo_client is None or (
+                version is not None and version == meta["data_version"]
+            ):
+                return cls._load_snapshot(meta, arrays)
+        except snapshot.SnapshotError:
+            if mongo_client is None:
+                raise
+        cal = cls(mongo_client)
+        cal.save_snapshot(path)
+        return cal
+
+    @classmethod
+    def _load_snapshot(cls, meta: dict, arrays: Mapping[str, np.ndarray]):
+        days = {k: v for k, v in arrays.items() if "/" not in k}
+        cal = cls(data=dict(meta["data"], first_ordinal=meta["first_ordinal"], **days))
+        cal.data_version = meta["data_version"]
+        symbols = {name.split("/")[0] for name in arrays if "/" in name}
+        for symbol in symbols:
+            sub = cal.get(symbol) if symbol else cal
+            if symbol and sub is cal:
+                continue
+            for kind, indexes in (
+                ("bartime", sub._bartime_indexes),
+                ("baropen", sub._bar_open_indexes),
+            ):
+                prefix = f"{symbol}/{kind}/"
+                for name, arr in arrays.items():
+                    if name.startswith(prefix):
+                        indexes[int(name[len(prefix) :])] = arr
+            for with_breaks in (0, 1):
+                opens = arrays.get(f"{symbol}/session/{with_breaks}/0")
+                closes = arrays.get(f"{symbol}/session/{with_breaks}/1")
+                if opens is not None and closes is not None:
+                    sub._session_indexes[bool(with_breaks)] = (opens, closes)
+        return cal
+
+    def _get_bartime_index(self, interval: int):
+        index = self._bartime_indexes.get(interval)
+        if index is None:
+            if interval not in supproted_bartime:
+                times = self._get_bartimestamp(interval, True)
+                if times is None:
+                    return None
+                # 最多每个交易日len(times)根K线, 每根8字节
+                if len(times) * len(self._tradedays_ns) * 8 > self.bartime_cache_bytes:
+                    return None
+            index = self._build_bartime_index(interval)
+            index.flags.writeable = False
+            self._bartime_indexes[interval] = index
+        return index
+
+    def _get_bar_open_index(self, interval: int):
+        index = self._bar_open_indexes.get(interval)
+        if index is None:
+            closes = self._get_bartime_index(interval)
+            if closes is None:
+                return None
+            index = self._build_bar_open_index(closes)
+            index.flags.writeable = False
+            self._bar_open_indexes[interval] = index
+        return index
+
+    def _build_bar_open_index(self, closes: np.ndarray):
+        # 上一根K线的结束时间, 第一根K线从第一次开盘开始
+        prev = np.concatenate(([np.iinfo(np.int64).min], closes[:-1]))
+        session_opens, session_closes = self._get_session_index(True)
+        i = session_opens.searchsorted(prev, side="left")
+        j = session_closes.searchsorted(prev, side="right")
+        next_open = session_opens[np.minimum(i, len(session_opens) - 1)]
+        next_close = session_closes[np.minimum(j, len(session_closes) - 1)]
+        # 上一根K线在收盘时结束(下一次开盘早于下一次收盘), 本K线从下一次开盘开始
+        at_close = (i < len(session_opens)) & (next_open < next_close)
+        return np.where(at_close, next_open, prev)
+
+    def _build_bartime_index(self, interval: int):
+        if interval in supproted_bartime:
+            close = self._time_to_day_seconds(self._open_close_sessions[0][-1])
+            days = self._tradedays_ns
+            if interval != DAILY:
+                days = days[self._period_ends[interval]]
+            return days + close * ns_per_second
+        return self._build_tradedays_index(
+            self._get_sessions_with_breaks,
+            lambda sessions: self._calc_day_bartimes(sessions, interval),
+        )
+
+    def _get_session_index(self, with_breaks: bool):
+        index = self._session_indexes.get(with_breaks)
+        if index is None:
+            if with_breaks:
+                get_sessions = self._get_sessions_with_breaks
+            else:
+                get_sessions = self._get_sessions_without_breaks
+            index = tuple(
+                self._build_tradedays_index(
+                    get_sessions,
+                    lambda sessions: self._calc_day_session_bounds(sessions, side),
+                )
+                for side in (0, 1)
+            )
+            for arr in index:
+                arr.flags.writeable = False
+            self._session_indexes[with_breaks] = index
+        return index
+
+    def _build_tradedays_index(self, get_sessions, calc_seconds):
+        """
+        每个交易日按`get_sessions(day)`取得当天交易时间段，
+        `calc_seconds(sessions)`计算距离交易日0点的秒数，合并成排序好的纳秒时间戳
+        """
+        # 交易时间段相同(包括特殊时间段)的交易日一起计算
+        groups = {}
+        for i, day in enumerate(self._tradedays):
+            sessions = get_sessions(day)
+            groups.setdefault(id(sessions), (sessions, []))[1].append(i)
+        parts = [np.empty(0, dtype=np.int64)]
+        for sessions, days in groups.values():
+            seconds = np.array(calc_seconds(sessions), dtype=np.int64) * ns_per_second
+            parts.append((self._tradedays_ns[days][:, None] + seconds).ravel())
+        return np.sort(np.concatenate(parts))
+
+    def get_tradedays_gte(self, dt: datetime) -> TradeDaysView:
         """get trade days >= dt"""
-        return self._tradedays[self._tradedays_indexers[dt.date().isoformat()][1] :]
+        idx = int(self._tradedays_gte[self._day_pos(dt)])
+        return TradeDaysView(self._tradedays, idx)
 
-    def get_tradedays_lte(self, dt: datetime) -> List[datetime]:
+    def get_tradedays_lte(self, dt: datetime) -> TradeDaysView:
         """get trade days <= dt"""
-        return self._tradedays[: self._tradedays_indexers[dt.date().isoformat()][0] + 1]
+        idx = int(self._tradedays_lte[self._day_pos(dt)])
+        return TradeDaysView(self._tradedays, 0, idx + 1)
 
     def get_tradedays_next(self, dt: datetime) -> datetime:
         """equal to get_tradedays_gte(dt)[0]"""
-        return self._tradedays[self._tradedays_indexers[dt.date().isoformat()][1]]
+        return self._tradedays[self._tradedays_gte[self._day_pos(dt)]]
 
     def get_tradedays_last(self, dt: datetime) -> datetime:
         """equal to get_tradedays_lte(dt)[-1]"""
-        return self._tradedays[self._tradedays_indexers[dt.date().isoformat()][0]]
+        return self._tradedays[self._tradedays_lte[self._day_pos(dt)]]
 
     def get_tradedays_between(
         self, start_dt: datetime, end_dt: datetime
-    ) -> List[datetime]:
+    ) -> TradeDaysView:
         """get start_dt <= trade days <= end_dt"""
-        st_idx = self._tradedays_indexers[start_dt.date().isoformat()]
-        end_idx = self._tradedays_indexers[end_dt.date().isoformat()]
-        return self._tradedays[st_idx[1] : end_idx[0] + 1]
+        st_idx = int(self._tradedays_gte[self._day_pos(start_dt)])
+        end_idx = int(self._tradedays_lte[self._day_pos(end_dt)])
+        return TradeDaysView(self._tradedays, st_idx, end_idx + 1)
+
+    def get_tradedays_array(self, start_dt: datetime, end_dt: datetime) -> np.ndarray:
+        st_idx = self._tradedays_gte[self._day_pos(start_dt)]
+        end_idx = self._tradedays_lte[self._day_pos(end_dt)]
+        return self._tradedays_ns[st_idx : end_idx + 1].view("datetime64[ns]")
+
+    def tradeday_offset(self, dt: datetime, n: int, roll: str = "raise") -> datetime:
+        if roll not in ("forward", "backward", "raise"):
+            raise ValueError(f"roll {roll} not supported")
+        pos = self._day_pos(dt)
+        lte, gte = int(self._tradedays_lte[pos]), int(self._tradedays_gte[pos])
+        if lte != gte and roll == "raise":
+            raise ValueError(f"{dt}不是交易日")
+        idx = (gte if roll == "forward" else lte) + n
+        if idx < 0 or idx >= len(self._tradedays_ns):
+            raise OutOfCalendar()
+        return self._tradedays[idx]
+
+    def count_tradedays(self, start_dt: datetime, end_dt: datetime) -> int:
+        st_idx = int(self._tradedays_gte[self._day_pos(start_dt)])
+        end_idx = int(self._tradedays_lte[self._day_pos(end_dt)])
+        return max(end_idx + 1 - st_idx, 0)
+
+    def _get_tradedays_xxx_end(
+        self, start: datetime, end: datetime, count: int, period: int
+    ) -> List[datetime]:
+        ends = self._period_ends[period]
+        lo = ends.searchsorted(self._tradedays_gte[self._day_pos(start)])
+        return self._take_tradedays(ends[lo:], end, count)
+
+    def _get_tradedays_xxx_begin(
+        self, start: datetime, end: datetime, count: int, period: int
+    ) -> List[datetime]:
+        ends = self._period_ends[period]
+        last = self._tradedays_lte[self._day_pos(start - timedelta(days=1))]
+        lo = ends.searchsorted(max(last, 0))
+        return self._take_tradedays(ends[lo:] + 1, end, count)
+
+    def get_tradedays_week_day(
+        self, weekday: int, start: datetime, end: datetime = None, count: int = 0
+    ) -> List[datetime]:
+        if not 1 <= weekday <= 7:
+            return []
+        positions = self._weekday_positions[weekday - 1]
+        lo = positions.searchsorted(self._tradedays_gte[self._day_pos(start)])
+        return self._take_tradedays(positions[lo:], end, count)
+
+    def get_tradedays_nth(
+        self,
+        period: int,
+        n: int,
+        start: datetime,
+        end: datetime = None,
+        count: int = 0,
+        *,
+        weekday: int = None,
+    ) -> List[datetime]:
+        _check_nth_args(period, n, weekday)
+        positions = self._get_nth_positions(period, n, weekday)
+        lo = positions.searchsorted(self._tradedays_gte[self._day_pos(start)])
+        return self._take_tradedays(positions[lo:], end, count)
+
+    def _get_nth_positions(self, period: int, n: int, weekday: int):
+        """每个周期第n个交易日在`_tradedays`中的下标, 第一次用到时计算"""
+        key = (period, n, weekday)
+        positions = self._nth_positions.get(key)
+        if positions is not None:
+            return positions
+        ids = self._period_ids[period]
+        if weekday is None:
+            positions = np.arange(len(ids))
+        else:
+            positions = self._weekday_positions[weekday - 1]
+        period_ids = ids[positions]
+        starts = np.flatnonzero(np.diff(period_ids, prepend=ids[:1] - 1))
+        stops = np.append(starts[1:], len(positions))
+        idx = starts + (n - 1) if n > 0 else stops + n
+        # 日历的第一个周期不知道从哪天开始, 倒数的还要求周期已经结束
+        valid = (idx >= starts) & (idx < stops) & (period_ids[starts] != ids[:1])
+        if n < 0:
+            valid &= period_ids[starts] != ids[-1:]
+        positions = positions[idx[valid]]
+        positions.flags.writeable = False
+        self._nth_positions[key] = positions
+        return positions
+
+    def _take_tradedays(self, positions: np.ndarray, end: datetime, count: int):
+        """`positions`中不晚于`end`的前`count`个交易日"""
+        if end is not None:
+            hi = self._tradedays_ns.searchsorted(datetime_to_ns(end), side="right")
+            positions = positions[: positions.searchsorted(hi)]
+        if count > 0:
+            positions = positions[:count]
+        return [self._tradedays[i] for i in positions.tolist()]
+
+
+def _calc_day_arrays(name: str, dates, status):
+    """
+    按每天的交易状态计算交易日数组, 返回(第一天的ordinal, 只读数组),
+    数组同快照一起保存, `_load_data`直接引用
+    """
+    dates = _to_days(dates)
+    status = np.array(status, dtype=np.int8)
+    if len(dates) != len(status):
+        raise ValueError(f"{name}日期与交易状态长度不一致")
+    if len(dates) == 0:
+        dates = np.array([], dtype="datetime64[D]")
+    gaps = np.flatnonzero(np.diff(dates.view(np.int64)) != 1)
+    if len(gaps):
+        raise ValueError(f"{name}日期不连续: {dates[gaps[0] + 1].item()}")
+
+    first_ordinal = int(dates[0].view(np.int64)) + _EPOCH_ORDINAL if len(dates) else 0
+    is_tradeday = status == 1
+    count = np.cumsum(is_tradeday, dtype=np.int64)
+    days = {
+        "status": status,
+        "tradedays": dates[is_tradeday].astype("datetime64[ns]").view(np.int64),
+        "tradedays_lte": count - 1,
+        "tradedays_gte": count - is_tradeday,
+    }
+    for arr in days.values():
+        arr.flags.writeable = False
+    return first_ordinal, days
 
 
 def _check_next_month(day, last_day):
@@ -615,10 +1968,54 @@ def _check_next_week(day, last_day):
     return day.isocalendar().week != last_day.isocalendar().week
 
 
+def _check_next_quarter(day, last_day):
+    return (day.month - 1) // 3 != (
+        last_day.month - 1
+    ) // 3 or day.year != last_day.year
+
+
+def _check_next_year(day, last_day):
+    return day.year != last_day.year
+
+
 def _check_week_day(day, weekday):
     return weekday == day.isocalendar().weekday
 
 
+_PERIOD_CHECKS = {
+    WEEKLY: _check_next_week,
+    MONTHLY: _check_next_month,
+    QUARTERLY: _check_next_quarter,
+    YEARLY: _check_next_year,
+}
+""" 判断两个相邻交易日是否属于不同周期"""
+
+
+def _get_period_first_day(dt: datetime, period: int) -> datetime:
+    """`dt`所在周期的第一天"""
+    if period == WEEKLY:
+        return dt - timedelta(days=dt.weekday())
+    month = dt.month
+    if period == QUARTERLY:
+        month = (month - 1) // 3 * 3 + 1
+    elif period == YEARLY:
+        month = 1
+    return dt.replace(month=month, day=1)
+
+
+def _check_nth_args(period: int, n: int, weekday: int):
+    if period not in _PERIOD_CHECKS:
+        raise ValueError(f"period {period} not supported")
+    if n == 0:
+        raise ValueError("n must not be 0")
+    if weekday is not None and not 1 <= weekday <= 7:
+        raise ValueError(f"weekday {weekday} not in [1, 7]")
+    # 周期最多的天数
+    days = {WEEKLY: 7, MONTHLY: 31, QUARTERLY: 92, YEARLY: 366}[period]
+    if abs(n) > (days if weekday is None else (days + 6) // 7):
+        raise ValueError(f"n {n} out of period {period}")
+
+
 def seconds_to_time(seconds):
     if seconds == 86400:
         return time.min
@@ -632,3 +2029,111 @@ def seconds_to_time(seconds):
 
 def time_to_seconds(tm: time):
     return tm.hour * 3600 + tm.minute * 60 + tm.second
+
+
+_epoch = datetime(1970, 1, 1)
+_one_microsecond = timedelta(microseconds=1)
+
+
+def datetime_to_ns(dt: datetime) -> int:
+    """不带时区的`datetime`(或`pd.Timestamp`)转换为纳秒时间戳"""
+    return (dt - _epoch) // _one_microsecond * 1000 + getattr(dt, "nanosecond", 0)
+
+
+def _naive(dt: datetime) -> datetime:
+    return dt.replace(tzinfo=None) if dt.tzinfo is not None else dt
+
+
+def _is_aware(*dts) -> bool:
+    """是否有带时区的时间, None不算"""
+    return any(dt is not None and dt.tzinfo is not None for dt in dts)
+
+
+def _naive_local_index(dts, tz):
+    """带时区的`DatetimeIndex`转换为`tz`的当地时间并去掉时区, `tz`为None时只去掉时区"""
+    if getattr(dts, "tz", None) is None:
+        return dts
+    if tz is not None:
+        dts = dts.tz_convert(tz)
+    return dts.tz_localize(None)
+
+
+class _TzTable:
+    """
+    时区`tz`的UTC偏移变化表, 用于纳秒时间戳的UTC和当地时间互相转换,
+    按周采样查找偏移变化, 一周之内变化又恢复的不支持
+    """
+
+    first_year = 1970
+    last_year = 2100
+
+    def __init__(self, tz):
+        self.tz = tz
+        step = 7 * 86400
+        sec = int((datetime(self.first_year, 1, 1) - _epoch).total_seconds())
+        end = int((datetime(self.last_year, 1, 1) - _epoch).total_seconds())
+        prev = self._offset_at(sec)
+        starts = [np.iinfo(np.int64).min]
+        offsets = [prev]
+        while sec < end:
+            cur = self._offset_at(sec + step)
+            if cur != prev:
+                # 二分查找偏移变化的秒数
+                lo, hi = sec, sec + step
+                while hi - lo > 1:
+                    mid = (lo + hi) // 2
+                    if self._offset_at(mid) == prev:
+                        lo = mid
+                    else:
+                        hi = mid
+                starts.append(hi * ns_per_second)
+                offsets.append(cur)
+                prev = cur
+            sec += step
+        self._offsets = [offset * ns_per_second for offset in offsets]
+        self._starts = starts
+        # 每个偏移开始时的当地时间, 夏令时切换时不存在或者重复的当地时间按切换后的偏移
+        self._local_starts = starts[:1] + [
+            start + offset for start, offset in zip(starts[1:], self._offsets[1:])
+        ]
+        self._offsets_array = np.array(self._offsets, dtype=np.int64)
+        self._starts_array = np.array(self._starts, dtype=np.int64)
+        self._local_starts_array = np.array(self._local_starts, dtype=np.int64)
+
+    def _offset_at(self, sec: int) -> int:
+        return int(datetime.fromtimestamp(sec, self.tz).utcoffset().total_seconds())
+
+    def _shift(self, ns, starts, starts_array, sign: int):
+        if isinstance(ns, np.ndarray):
+            i = starts_array.searchsorted(ns, side="right") - 1
+            return ns + sign * self._offsets_array[i]
+        if ns >= starts[-1]:
+            # 大部分时间戳在最后一次偏移变化之后
+            return ns + sign * self._offsets[-1]
+        return ns + sign * self._offsets[bisect_right(starts, ns) - 1]
+
+    def to_local(self, ns):
+        return self._shift(ns, self._starts, self._starts_array, 1)
+
+    def to_utc(self, ns):
+        return self._shift(ns, self._local_starts, self._local_starts_array, -1)
+
+
+_tz_tables = {}
+
+
+def _get_tz_table(tz) -> _TzTable:
+    table = _tz_tables.get(tz)
+    if table is None:
+        table = _tz_tables[tz] = _TzTable(tz)
+    return table
+
+
+def ns_to_datetime(ns: int) -> datetime:
+    """纳秒时间戳转换为不带时区的`datetime`, 精度截断到微秒"""
+    return _epoch + timedelta(microseconds=ns // 1000)
+
+
+def datetime64_to_datetime(dt64: np.datetime64) -> datetime:
+    """`datetime64`转换为`datetime`, 精度截断到微秒"""
+    return dt64.astype("datetime64[us]").item()
@@ -1,7 +1,25 @@
 from datetime import datetime, time, timedelta
-from typing import List
+from typing import List, Tuple
 
-from .calendar import I1H, I2H, I3H, I4H, Calendar
+import numpy as np
+
+from .calendar import (
+    DAILY,
+    I1H,
+    I2H,
+    I3H,
+    I4H,
+    Calendar,
+    LRUCache,
+    _naive,
+    _naive_local_index,
+    datetime_to_ns,
+    ns_per_second,
+    ns_to_datetime,
+    time_to_seconds,
+)
+
+ns_per_day = 86400 * ns_per_second
 
 
 class Time7x24Calendar(Calendar):
@@ -17,6 +35,183 @@ class Time7x24Calendar(Calendar):
     intervals = (60, 180, 300, 600, 900, 1800, I1H, I2H, I3H, I4H)
     # bartime_side = "left"
 
+    def init(self):
+        super().init()
+        # 每天的K线都相同, {K线周期: (K线开始时间, K线结束时间)}, 单位为距离0点的纳秒数
+        self._day_bars = LRUCache(self.bartime_cache_size, "day_bars")
+
+    def _get_day_bars(self, interval: int):
+        day_bars = self._day_bars.get(interval)
+        if day_bars is None:
+            if interval == DAILY:
+                closes = [86400]
+            else:
+                times = self._get_bartimestamp(interval, True)
+                if times is None:
+                    return None
+                closes = [time_to_seconds(tm) or 86400 for tm in times]
+            day_bars = _day_bars(closes)
+            self._day_bars[interval] = day_bars
+        return day_bars
+
+    def _search_day_bars(self, interval: int, ns):
+        """
+        直接计算纳秒时间戳`ns`(可以是数组)所在K线，
+        返回(当天0点, 当天第几根K线)，不支持的K线周期返回None
+        """
+        day_bars = self._get_day_bars(interval)
+        if day_bars is None:
+            return None
+        opens, closes = day_bars
+        if self._bartime_side_right:
+            # K线包含结束时间, 0点属于前一天最后一根K线
+            day = (ns - 1) // ns_per_day * ns_per_day
+            return day, closes.searchsorted(ns - day, side="left")
+        # K线包含开始时间, 0点属于当天第一根K线
+        day = ns // ns_per_day * ns_per_day
+        return day, opens.searchsorted(ns - day, side="right") - 1
+
+    def _bar_labels(self, interval: int):
+        opens, closes = self._get_day_bars(interval)
+        return closes if self._bartime_side_right else opens
+
+    def get_current_bartime(self, dt: datetime, interval: int):
+        found = self._search_day_bars(
+            interval, datetime_to_ns(self._to_naive_local(dt))
+        )
+        if found is None:
+            return super().get_current_bartime(dt, interval)
+        day, i = found
+        bt = ns_to_datetime(int(day + self._bar_labels(interval)[i]))
+        return self._from_naive_local(bt, dt.tzinfo)
+
+    def get_current_bar(self, dt: datetime, interval: int) -> Tuple[datetime, datetime]:
+        found = self._search_day_bars(
+            interval, datetime_to_ns(self._to_naive_local(dt))
+        )
+        if found is None:
+            return super().get_current_bar(dt, interval)
+        day, i = found
+        opens, closes = self._get_day_bars(interval)
+        return (
+            self._from_naive_local(ns_to_datetime(int(day + opens[i])), dt.tzinfo),
+            self._from_naive_local(ns_to_datetime(int(day + closes[i])), dt.tzinfo),
+        )
+
+    def get_current_bartimes(self, dts, interval: int) -> np.ndarray:
+        if self._get_day_bars(interval) is None:
+            return super().get_current_bartimes(dts, interval)
+        dts = _naive_local_index(dts, self.tz)
+        values = np.asarray(dts, dtype="datetime64[ns]").view(np.int64)
+        day, idx = self._search_day_bars(interval, values)
+        return (day + self._bar_labels(interval)[idx]).view("datetime64[ns]")
+
+    def get_current_bartime_ns(self, ts, interval: int):
+        ns, as_datetime64 = self._epoch_to_local(ts)
+        found = self._search_day_bars(interval, ns)
+        if found is None:
+            return super().get_current_bartime_ns(ts, interval)
+        day, i = found
+        bt = day + self._bar_labels(interval)[i]
+        return self._local_to_epoch(
+            bt if isinstance(ns, np.ndarray) else int(bt), as_datetime64
+        )
+
+    def get_bartimes(
+        self, interval: int, start: datetime, end: datetime = None, count=0
+    ) -> List[datetime]:
+        bartimes = self._get_bartimes_ns(interval, start, end, count)
+        if bartimes is None:
+            return super().get_bartimes(interval, start, end, count)
+        return [
+            self._from_naive_local(ns_to_datetime(bt), start.tzinfo)
+            for bt in bartimes.tolist()
+        ]
+
+    def get_bartimes_array(
+        self, interval: int, start: datetime, end: datetime
+    ) -> np.ndarray:
+        bartimes = self._get_bartimes_ns(interval, start, end, 0)
+        if bartimes is None:
+            return super().get_bartimes_array(interval, start, end)
+        return bartimes.view("datetime64[ns]")
+
+    def _get_bartimes_ns(self, interval: int, start: datetime, end: datetime, count):
+        """`get_bartimes`的纳秒时间戳数组, 不支持的K线周期返回None"""
+        found = self._search_day_bars(
+            interval, datetime_to_ns(self._to_naive_local(start))
+        )
+        if found is None:
+            return None
+        if count <= 0 and end is None:
+            raise OverflowError("infinite generated bars, count must be great than 0")
+        day, i = found
+        labels = self._bar_labels(interval)
+        if count > 0:
+            days = (int(i) + count - 1) // len(labels) + 1
+        if end is not None:
+            end = datetime_to_ns(self._to_naive_local(end))
+            end_days = max((end - day) // ns_per_day + 1, 0)
+            days = end_days if count <= 0 else min(days, end_days)
+        bartimes = (day + np.arange(days)[:, None] * ns_per_day + labels).ravel()[i:]
+        if end is not None:
+            bartimes = bartimes[: bartimes.searchsorted(end, side="left")]
+        if count > 0:
+            bartimes = bartimes[:count]
+        return bartimes
+
+    def get_bar_ordinal(self, dt: datetime, interval: int) -> int:
+        """`dt`所在K线的序号, 1970-01-01的第一根K线为0"""
+        found = self._search_day_bars(
+            interval, datetime_to_ns(self._to_naive_local(dt))
+        )
+        if found is None:
+            return super().get_bar_ordinal(dt, interval)
+        day, i = found
+        return int(day // ns_per_day * len(self._bar_labels(interval)) + i)
+
+    def get_bar_ordinals(self, dts, interval: int) -> np.ndarray:
+        if self._get_day_bars(interval) is None:
+            return super().get_bar_ordinals(dts, interval)
+        dts = _naive_local_index(dts, self.tz)
+        values = np.asarray(dts, dtype="datetime64[ns]").view(np.int64)
+        day, idx = self._search_day_bars(interval, values)
+        return day // ns_per_day * len(self._bar_labels(interval)) + idx
+
+    def get_bartime_by_ordinal(self, ordinal: int, interval: int) -> datetime:
+        if self._get_day_bars(interval) is None:
+            return super().get_bartime_by_ordinal(ordinal, interval)
+        labels = self._bar_labels(interval)
+        day, i = divmod(int(ordinal), len(labels))
+        return ns_to_datetime(day * ns_per_day + int(labels[i]))
+
+    def get_closed_bar_ordinals(self, dts, interval: int) -> np.ndarray:
+        day_bars = self._get_day_bars(interval)
+        if day_bars is None:
+            return super().get_closed_bar_ordinals(dts, interval)
+        dts = _naive_local_index(dts, self.tz)
+        values = np.asarray(dts, dtype="datetime64[ns]").view(np.int64)
+        closes = day_bars[1]
+        # 之前每天的K线都已经结束, 包括结束时间为当天0点的K线
+        day = values // ns_per_day
+        count = day * len(closes) + closes.searchsorted(
+            values - day * ns_per_day, "right"
+        )
+        return count - 1
+
+    def count_bars(self, interval: int, start: datetime, end: datetime) -> int:
+        if self._get_day_bars(interval) is None:
+            return super().count_bars(interval, start, end)
+        labels = self._bar_labels(interval)
+        # 早于`end`的K线个数, 结束时间为0点的K线属于前一天
+        end = datetime_to_ns(self._to_naive_local(end))
+        if self._bartime_side_right:
+            day = (end - 1) // ns_per_day
+        else:
+            day = end // ns_per_day
+        hi = day * len(labels) + int(labels.searchsorted(end - day * ns_per_day))
+        return max(hi - self.get_bar_ordinal(start, interval), 0)
+
     def get_tradedays_gte(self, dt: datetime):
         """get trade days >= dt, generate from today to days after"""
         day = datetime.combine(dt.date(), time(0, 0, 0), tzinfo=dt.tzinfo)
@@ -74,6 +269,70 @@ class Time7x24Calendar(Calendar):
             raise OverflowError("infinite generated days, count must be great than 0")
         return super().get_tradedays_week_day(weekday, start, end, count)
 
+    def get_tradedays_quarter_end(
+        self, start: datetime, end: datetime = None, count: int = 0
+    ) -> List[datetime]:
+        if count <= 0 and end is None:
+            raise OverflowError("infinite generated days, count must be great than 0")
+        return super().get_tradedays_quarter_end(start, end, count)
+
+    def get_tradedays_quarter_begin(
+        self, start: datetime, end: datetime = None, count: int = 0
+    ) -> List[datetime]:
+        if count <= 0 and end is None:
+            raise OverflowError("infinite generated days, count must be great than 0")
+        return super().get_tradedays_quarter_begin(start, end, count)
+
+    def get_tradedays_year_end(
+        self, start: datetime, end: datetime = None, count: int = 0
+    ) -> List[datetime]:
+        if count <= 0 and end is None:
+            raise OverflowError("infinite generated days, count must be great than 0")
+        return super().get_tradedays_year_end(start, end, count)
+
+    def get_tradedays_year_begin(
+        self, start: datetime, end: datetime = None, count: int = 0
+    ) -> List[datetime]:
+        if count <= 0 and end is None:
+            raise OverflowError("infinite generated days, count must be great than 0")
+        return super().get_tradedays_year_begin(start, end, count)
+
+    def get_tradedays_nth(
+        self,
+        period: int,
+        n: int,
+        start: datetime,
+        end: datetime = None,
+        count: int = 0,
+        *,
+        weekday: int = None,
+    ) -> List[datetime]:
+        if count <= 0 and end is None:
+            raise OverflowError("infinite generated days, count must be great than 0")
+        return super().get_tradedays_nth(period, n, start, end, count, weekday=weekday)
+
+    def get_trading_seconds(self, start: datetime, end: datetime) -> float:
+        start, end = self._to_naive_local(start), self._to_naive_local(end)
+        return (end - start).total_seconds()
+
+    def trading_time_offset(self, dt: datetime, delta) -> datetime:
+        if not isinstance(delta, timedelta):
+            delta = timedelta(seconds=delta)
+        return dt + delta
+
+    def tradeday_offset(self, dt: datetime, n: int, roll: str = "raise") -> datetime:
+        if roll not in ("forward", "backward", "raise"):
+            raise ValueError(f"roll {roll} not supported")
+        return self.get_tradedays_next(dt) + timedelta(days=n)
+
+    def count_tradedays(self, start_dt: datetime, end_dt: datetime) -> int:
+        return max((end_dt.date() - start_dt.date()).days + 1, 0)
+
+    def get_tradedays_array(self, start_dt: datetime, end_dt: datetime) -> np.ndarray:
+        start = np.datetime64(_naive(start_dt).date(), "D")
+        end = np.datetime64(_naive(end_dt).date(), "D")
+        return np.arange(start, end + 1).astype("datetime64[ns]")
+
     def get_tradedays_between(
         self, start_dt: datetime, end_dt: datetime
     ) -> List[datetime]:
@@ -92,6 +351,31 @@ class Time7x24Calendar(Calendar):
     def is_trading(self, dt: datetime):
         return True
 
+    def is_trading_day(self, dt: datetime):
+        return True
+
+    def is_trading_ns(self, ts):
+        ns, _ = self._epoch_to_local(ts)
+        if isinstance(ns, np.ndarray):
+            return np.ones(ns.shape, dtype=bool)
+        return True
+
+    def _find_next_session_ns(self, ts, with_breaks: bool):
+        # 开盘为`ts`之后的0点, 收盘为`ts`之后(包括`ts`)的0点
+        ns, as_datetime64 = self._epoch_to_local(ts)
+        sos = (ns // ns_per_day + 1) * ns_per_day
+        eos = -(-ns // ns_per_day) * ns_per_day
+        return (
+            self._local_to_epoch(sos, as_datetime64),
+            self._local_to_epoch(eos, as_datetime64),
+        )
+
+
+def _day_bars(closes):
+    closes = np.array(closes, dtype=np.int64) * ns_per_second
+    opens = np.concatenate(([0], closes[:-1]))
+    return opens, closes
+
 
 if __name__ == "__main__":
     cal = Time7x24Calendar()
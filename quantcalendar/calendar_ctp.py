@@ -2,18 +2,20 @@ import re
 from datetime import datetime, time, timedelta
 from enum import Enum
 from functools import cache
+from types import MappingProxyType
+from typing import Iterable, Mapping
 from zoneinfo import ZoneInfo
 
-import quantdata as qd
+import numpy as np
 
 from .calendar import (
-    DB_NAME_CALENDAR,
     I1H,
     I2H,
     I3H,
     I4H,
     MongoDBCalendar,
     SpecialSessions,
+    _add_lock,
 )
 
 __all__ = ["CalendarCTP"]
@@ -46,53 +48,109 @@ class CalendarCTP(MongoDBCalendar):
     offset = timedelta(hours=2, minutes=30)
     # 1m - 3m - 5m - 10m - 15m - 30m - 1H - 2H - 3H - 4H
     intervals = (60, 180, 300, 600, 900, 1800, I1H, I2H, I3H, I4H)
-
-    def __init__(self, mongo_client):
-        super().__init__(mongo_client)
-        # 特殊规则：交易日夜盘不开盘。第二天是节假日，夜盘不交易
-        last_status = None
-        lastdt = None
-        for tradedt, status in self._trade_status.items():
-            if last_status is not None:
-                if last_status == 1:
-                    if status == 3:  # 今天节假日，昨天夜盘不交易
-                        self.special_sessions[lastdt] = _specialses_before_holiday(self)
-                elif last_status == 3:
-                    if status == 1:  # 昨天节假日，今日上午算开盘
-                        self.special_sessions[tradedt] = _specialses_after_holiday(self)
-            last_status = status
-            lastdt = tradedt
-
-        self.product_id = None
-        self.product_type = None
-        products = qd.mongo_get_data(
-            mongo_client[DB_NAME_CALENDAR], self.COLLECTION_NAME_SESSIONS
+    product_id = None
+    product_type = None
+    _holidays: Mapping[int, int] = {}
+    """ 节假日前后的交易日, {日期: SpecialSessions.name}"""
+
+    def __init__(
+        self, mongo_client=None, *, data: dict = None, preload: Iterable[str] = ()
+    ):
+        """
+        Params:
+            preload: 预先创建的品种日历(包括开盘收盘时间索引), 其它品种在第一次`get`时才创建
+        """
+        super().__init__(mongo_client, data=data)
+        for symbol in preload:
+            cal = self.get(symbol)
+            cal._get_session_index(True)
+            cal._get_session_index(False)
+
+    @classmethod
+    def collection_names(cls):
+        return (cls.COLLECTION_NAME, cls.COLLECTION_NAME_SESSIONS)
+
+    @classmethod
+    def _fetch_data(cls, source) -> dict:
+        """在父类的基础上增加{"products": 每个品种的交易时间段}"""
+        data = super()._fetch_data(source)
+        data["products"] = source.read_sessions(cls.COLLECTION_NAME_SESSIONS)
+        return data
+
+    def _snapshot_data(self) -> dict:
+        return {
+            "products": [
+                {"_id": product_id, "market_time": market_time}
+                for product_id, market_time in self._products.items()
+            ]
+        }
+
+    def _load_data(self, data: dict):
+        super()._load_data(data)
+        status = self._trade_status
+        last_status, status = status[:-1], status[1:]
+        # 昨天节假日，今日上午算开盘
+        after = np.flatnonzero((last_status == 3) & (status == 1)) + 1
+        # 今天节假日，昨天夜盘不交易
+        before = np.flatnonzero((last_status == 1) & (status == 3))
+        holidays = dict.fromkeys((after + self._first_ordinal).tolist(), 2)
+        holidays.update(dict.fromkeys((before + self._first_ordinal).tolist(), 1))
+        self._holidays = MappingProxyType(dict(sorted(holidays.items())))
+        self.special_sessions = self._calc_special_sessions()
+
+        # 品种日历在第一次`get`时才创建
+        self._products = {
+            prod["_id"].upper(): prod["market_time"] for prod in data["products"]
+        }
+
+    def _calc_special_sessions(self):
+        """
+        特殊规则：交易日夜盘不开盘。第二天是节假日，夜盘不交易
+        只针对大宗商品, 所有节假日共用两个SpecialSessions
+        """
+        if self.product_type not in (None, ProductType.Commodity):
+            return MappingProxyType({})
+        before = _specialses_before_holiday(self)
+        after = _specialses_after_holiday(self)
+        return MappingProxyType(
+            {
+                tradedt: before if name == 1 else after
+                for tradedt, name in self._holidays.items()
+            }
         )
-        for prod in products:
-            product_id = prod["_id"].upper()
-            cal = self.add(
-                product_id,
-                sessions=prod["market_time"],
-                product_id=product_id,
-                product_type=_get_product_type(product_id),
-            )
-            # 针对每个不同品种计算特殊规则：交易日夜盘不开盘。第二天是节假日，夜盘不交易
-            if cal.product_type == ProductType.Commodity:
-                for tradedt, special_ses in self.special_sessions.items():
-                    if special_ses.name == 1:
-                        cal.special_sessions[tradedt] = _specialses_before_holiday(cal)
-                    else:
-                        cal.special_sessions[tradedt] = _specialses_after_holiday(cal)
+
+    def _template_key(self):
+        return (super()._template_key(), self.product_type == ProductType.Commodity)
 
     def init(self):
         super().init()
-        self.special_sessions = {}
         self._sorted_session_time_without_night = tuple(
             s for s in self._sorted_session_time if s[0] != time(21)
         )
+        # 针对每个不同品种计算特殊规则
+        self.special_sessions = self._calc_special_sessions()
 
     def get(self, symbol: str = None):
-        return super().get(_convert_symbol(symbol))
+        """根据不同的证券品种获取不同的日历, 品种日历在第一次获取时创建"""
+        product_id = _convert_symbol(symbol)
+        if not product_id:
+            return self
+        cal = self._sub_calendars.get(product_id)
+        if cal is None:
+            market_time = self._products.get(product_id)
+            if market_time is None:
+                return self
+            with _add_lock:
+                # 等待锁的时候其它线程可能已经创建
+                cal = self._sub_calendars.get(product_id)
+                if cal is None:
+                    cal = self.add(
+                        product_id,
+                        sessions=market_time,
+                        product_id=product_id,
+                        product_type=_get_product_type(product_id),
+                    )
+        return cal
 
     def __str__(self):
         product_type = self.product_type.name if self.product_type else ""
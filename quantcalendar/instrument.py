@@ -0,0 +1,276 @@
+"""
+日历调用统计: 调用次数、耗时分布和内部缓存命中率
+
+    from quantcalendar import instrument
+
+    instrument.enable()
+    ...
+    print(instrument.to_prometheus())  # 或者instrument.get_stats()
+    instrument.disable()
+
+`enable`时替换`Calendar`及其子类的方法, `disable`时还原, 没有启用时没有任何额外开销。
+嵌套调用(比如子类调用`super()`)只统计最外层, 耗时不会重复计算
+"""
+
+import threading
+from bisect import bisect_left
+from functools import wraps
+from time import perf_counter_ns
+from types import FunctionType
+from typing import Iterable
+
+from .calendar import Calendar, LRUCache
+
+__all__ = [
+    "DEFAULT_METHODS",
+    "BUCKETS_NS",
+    "enable",
+    "disable",
+    "is_enabled",
+    "reset",
+    "get_stats",
+    "to_prometheus",
+]
+
+DEFAULT_METHODS = (
+    "get_current_bartime",
+    "get_current_bar",
+    "get_current_bartimes",
+    "get_bartimes",
+    "is_trading",
+    "is_trading_day",
+    "get_open_close_dt",
+    "get_session_dt",
+) + tuple(sorted(name for name in vars(Calendar) if name.startswith("get_tradedays_")))
+""" 默认统计的方法"""
+
+BUCKETS_NS = (
+    1_000,
+    2_500,
+    5_000,
+    10_000,
+    25_000,
+    50_000,
+    100_000,
+    250_000,
+    1_000_000,
+    10_000_000,
+)
+""" 耗时分布的上界(纳秒), 最后还有一个+Inf"""
+
+
+class _Histogram:
+    __slots__ = ("counts", "total_ns")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_NS) + 1)
+        self.total_ns = 0
+
+
+class _ThreadStats:
+    """每个线程单独记录, 调用时不需要加锁, 导出时再合并"""
+
+    __slots__ = ("active", "histograms", "cache_counts")
+
+    def __init__(self):
+        self.active = False
+        self.histograms = {}
+        """ {(日历类名, 方法名): _Histogram}"""
+        self.cache_counts = {}
+        """ {缓存名称: [命中次数, 未命中次数]}"""
+
+
+_lock = threading.Lock()
+_local = threading.local()
+_all_stats = []
+""" 所有线程的`_ThreadStats`"""
+_patched = []
+""" [(类, 方法名, 原来的方法)], `disable`时还原"""
+
+
+def enable(methods: Iterable[str] = DEFAULT_METHODS):
+    """
+    开始统计`Calendar`及其所有子类(调用时已经定义的)的`methods`,
+    以及`LRUCache`缓存的命中率, 重复调用时先`disable`
+    """
+    disable()
+    methods = set(methods)
+    for cls in _iter_subclasses(Calendar):
+        for name in methods & vars(cls).keys():
+            func = vars(cls)[name]
+            if isinstance(func, FunctionType):
+                _patch(cls, name, _timed(name, func))
+    _patch(LRUCache, "get", _counted_get(LRUCache.get))
+
+
+def disable():
+    """停止统计, 还原所有方法, 已经记录的统计保留到`reset`"""
+    while _patched:
+        cls, name, original = _patched.pop()
+        setattr(cls, name, original)
+
+
+def is_enabled() -> bool:
+    return bool(_patched)
+
+
+def reset():
+    """清空统计"""
+    with _lock:
+        for stats in _all_stats:
+            stats.histograms.clear()
+            stats.cache_counts.clear()
+
+
+def get_stats() -> dict:
+    """
+    返回
+    {
+        "calls": {"日历类名.方法名": {"count", "total_us", "mean_us",
+                                      "buckets": {上界(微秒)或者"+Inf": 累计次数}}},
+        "caches": {缓存名称: {"hits", "misses", "hit_rate"}},
+    }
+    """
+    histograms, cache_counts = _merge()
+    calls = {}
+    for (cls_name, method), (counts, total_ns) in sorted(histograms.items()):
+        count = sum(counts)
+        buckets = {}
+        cumulative = 0
+        for bound, n in zip(BUCKETS_NS + (None,), counts):
+            cumulative += n
+            buckets["+Inf" if bound is None else bound / 1000] = cumulative
+        calls[f"{cls_name}.{method}"] = {
+            "count": count,
+            "total_us": total_ns / 1000,
+            "mean_us": total_ns / 1000 / count if count else 0.0,
+            "buckets": buckets,
+        }
+    caches = {}
+    for name, (hits, misses) in sorted(cache_counts.items()):
+        total = hits + misses
+        caches[name] = {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+        }
+    return {"calls": calls, "caches": caches}
+
+
+def to_prometheus(prefix: str = "quantcalendar") -> str:
+    """按Prometheus文本格式导出统计, 耗时单位为秒"""
+    histograms, cache_counts = _merge()
+    histograms = sorted(histograms.items())
+    cache_counts = sorted(cache_counts.items())
+
+    lines = [
+        f"# HELP {prefix}_call_seconds Calendar method latency",
+        f"# TYPE {prefix}_call_seconds histogram",
+    ]
+    for (cls_name, method), (counts, total_ns) in histograms:
+        labels = f'calendar="{cls_name}",method="{method}"'
+        cumulative = 0
+        for bound, n in zip(BUCKETS_NS + (None,), counts):
+            cumulative += n
+            le = "+Inf" if bound is None else repr(bound / 1e9)
+            lines.append(
+                f'{prefix}_call_seconds_bucket{{{labels},le="{le}"}} {cumulative}'
+            )
+        lines.append(f"{prefix}_call_seconds_sum{{{labels}}} {total_ns / 1e9!r}")
+        lines.append(f"{prefix}_call_seconds_count{{{labels}}} {cumulative}")
+    for kind, index in (("hits", 0), ("misses", 1)):
+        lines.append(f"# HELP {prefix}_cache_{kind}_total Calendar cache {kind}")
+        lines.append(f"# TYPE {prefix}_cache_{kind}_total counter")
+        for name, counts in cache_counts:
+            lines.append(
+                f'{prefix}_cache_{kind}_total{{cache="{name}"}} {counts[index]}'
+            )
+    return "\n".join(lines) + "\n"
+
+
+def _new_thread_stats() -> _ThreadStats:
+    stats = _local.stats = _ThreadStats()
+    with _lock:
+        _all_stats.append(stats)
+    return stats
+
+
+def _merge():
+    """
+    合并所有线程的统计, 返回
+    ({(日历类名, 方法名): (各区间次数, 总耗时)}, {缓存名称: [命中, 未命中]})
+    """
+    histograms = {}
+    cache_counts = {}
+    with _lock:
+        stats = list(_all_stats)
+    for thread_stats in stats:
+        for key, hist in list(thread_stats.histograms.items()):
+            counts, total_ns = histograms.get(key, ([0] * len(hist.counts), 0))
+            counts = [a + b for a, b in zip(counts, hist.counts)]
+            histograms[key] = (counts, total_ns + hist.total_ns)
+        for name, (hits, misses) in list(thread_stats.cache_counts.items()):
+            total = cache_counts.setdefault(name or "LRUCache", [0, 0])
+            total[0] += hits
+            total[1] += misses
+    return histograms, cache_counts
+
+
+def _iter_subclasses(cls):
+    yield cls
+    for sub in cls.__subclasses__():
+        yield from _iter_subclasses(sub)
+
+
+def _patch(cls, name: str, func):
+    _patched.append((cls, name, vars(cls)[name]))
+    setattr(cls, name, func)
+
+
+def _timed(name: str, func):
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        try:
+            stats = _local.stats
+        except AttributeError:
+            stats = _new_thread_stats()
+        if stats.active:
+            return func(self, *args, **kwargs)
+        stats.active = True
+        start = perf_counter_ns()
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            elapsed = perf_counter_ns() - start
+            stats.active = False
+            key = (type(self).__name__, name)
+            hist = stats.histograms.get(key)
+            if hist is None:
+                hist = stats.histograms[key] = _Histogram()
+            hist.counts[bisect_left(BUCKETS_NS, elapsed)] += 1
+            hist.total_ns += elapsed
+
+    return wrapper
+
+
+def _counted_get(get):
+    @wraps(get)
+    def wrapper(self, key, default=None):
+        try:
+            cache_counts = _local.stats.cache_counts
+        except AttributeError:
+            cache_counts = _new_thread_stats().cache_counts
+        counts = cache_counts.get(self.name)
+        if counts is None:
+            counts = cache_counts[self.name] = [0, 0]
+        value = get(self, key, _MISSING)
+        if value is _MISSING:
+            counts[1] += 1
+            return default
+        counts[0] += 1
+        return value
+
+    return wrapper
+
+
+_MISSING = object()
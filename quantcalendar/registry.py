@@ -0,0 +1,102 @@
+import threading
+import time
+from typing import Type, TypeVar
+
+from .calendar import Calendar, MongoDBCalendar
+
+__all__ = ["CalendarRegistry", "get_calendar"]
+
+CalendarT = TypeVar("CalendarT", bound=Calendar)
+
+
+class _Entry:
+    def __init__(self, calendar: Calendar, source, version: str):
+        self.calendar = calendar
+        self.source = source
+        """ 保持数据来源的引用, key中的`id(source)`不会被复用"""
+        self.version = version
+        self.checked_at = time.monotonic()
+
+
+class CalendarRegistry:
+    """
+    进程内共用的日历, 按(日历类, 数据来源)缓存已经创建的日历,
+    同一个日历只在锁内创建一次, 数据版本(`get_data_version`)改变时重新创建
+
+    重新创建期间其它线程继续使用旧的日历, 已经拿到的旧日历仍然可以使用
+
+    返回的日历可以在多个线程中共用: 内部缓存(`LRUCache`)和品种日历的创建(`Calendar.add`)
+    都在锁内, 其它第一次用到时计算的索引可能被多个线程重复计算, 结果相同
+    """
+
+    def __init__(self, check_interval: float = 60):
+        """
+        Params:
+            check_interval(seconds): 最多每隔多少秒检查一次数据版本, None表示不检查,
+                数据没有版本记录时也不会重新创建, 需要调用`clear`
+        """
+        self.check_interval = check_interval
+        self._entries = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, cls: Type[CalendarT], source=None) -> CalendarT:
+        """
+        返回共用的日历
+
+        Params:
+            cls: 日历类, 比如`CalendarCTP`
+            source: MongoDB连接或者`CalendarSource`, 同一个对象共用一个日历,
+                不需要数据来源的日历(比如`Time7x24Calendar`)为None
+        """
+        key = (cls, id(source))
+        entry = self._entries.get(key)
+        if entry is not None and not self._is_stale(entry):
+            return entry.calendar
+        with self._key_lock(key):
+            current = self._entries.get(key)
+            if current is not None and current is not entry:
+                # 等待锁的时候其它线程已经创建
+                return current.calendar
+            current = self._build(cls, source)
+            self._entries[key] = current
+            return current.calendar
+
+    def clear(self):
+        """删除所有缓存的日历, 之后`get`重新创建"""
+        with self._lock:
+            self._entries.clear()
+
+    def _key_lock(self, key) -> threading.Lock:
+        with self._lock:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.Lock()
+            return lock
+
+    def _is_stale(self, entry: _Entry) -> bool:
+        """数据版本是否改变, 最多每隔`check_interval`秒读取一次数据版本"""
+        cls = type(entry.calendar)
+        if self.check_interval is None or not issubclass(cls, MongoDBCalendar):
+            return False
+        now = time.monotonic()
+        if now - entry.checked_at < self.check_interval:
+            return False
+        # 先更新检查时间, 其它线程不再重复读取
+        entry.checked_at = now
+        version = cls.get_data_version(entry.source)
+        return version is not None and version != entry.version
+
+    def _build(self, cls: Type[Calendar], source) -> _Entry:
+        if issubclass(cls, MongoDBCalendar):
+            calendar = cls(source)
+            return _Entry(calendar, source, calendar.data_version)
+        return _Entry(cls(), source, None)
+
+
+_default_registry = CalendarRegistry()
+
+
+def get_calendar(cls: Type[CalendarT], source=None) -> CalendarT:
+    """从进程内默认的`CalendarRegistry`获取共用的日历"""
+    return _default_registry.get(cls, source)
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+
+from .calendar import Calendar
+
+__all__ = ["resample_ohlcv"]
+
+_OHLC = ["open", "high", "low", "close"]
+
+
+def resample_ohlcv(
+    data: pd.DataFrame,
+    calendar: Calendar,
+    interval: int,
+    *,
+    symbol: str = None,
+    price: str = "price",
+    volume: str = "volume",
+    fill_empty: bool = False,
+) -> pd.DataFrame:
+    """
+    按交易所真实的K线时间合成OHLCV K线，支持夜盘、休息时间段(比如10:15-10:30)和
+    节假日前后的特殊交易时间段，K线时间由`Calendar.get_current_bartimes`批量计算
+
+    Params:
+        data: 索引为时间的tick数据(`price`, `volume`列)，或者K线数据
+            (open, high, low, close, `volume`列，K线时间为结束时间),
+            索引带时区时按日历时区`tz`的当地时间计算K线, 结果的时区与索引相同
+        calendar: 日历, 会通过`calendar.get(symbol)`获取品种日历
+        interval(seconds): K线间隔周期
+        fill_empty: 是否补齐没有数据的K线, 价格取上一根K线收盘价, 成交量为0
+
+    Returns:
+        索引为K线时间的DataFrame, 列为open, high, low, close(, volume)
+    """
+    cal = calendar.get(symbol)
+    if not data.index.is_monotonic_increasing:
+        data = data.sort_index(kind="stable")
+    if data.empty:
+        columns = _OHLC + (["volume"] if volume in data.columns else [])
+        return pd.DataFrame(
+            columns=columns, index=pd.DatetimeIndex([], name="datetime")
+        )
+
+    tz = data.index.tz
+    labels = cal.get_current_bartimes(data.index, interval)
+    if set(_OHLC).issubset(data.columns):
+        agg = {"open": "first", "high": "max", "low": "min", "close": "last"}
+        if volume in data.columns:
+            agg[volume] = "sum"
+        bars = data.groupby(labels).agg(agg)
+    else:
+        grouped = data.groupby(labels)
+        bars = grouped[price].ohlc()
+        if volume in data.columns:
+            bars[volume] = grouped[volume].sum()
+    bars = bars.rename(columns={volume: "volume"})
+    bars.index = pd.DatetimeIndex(bars.index, name="datetime")
+
+    if fill_empty and len(bars) > 1:
+        start = bars.index[0].to_pydatetime()
+        end = bars.index[-1].to_pydatetime()
+        # 从第一根K线开始, 不依赖`get_bartimes`按K线时间查找所在K线的方式
+        grid = cal.get_bartimes(interval, start, end=end)
+        grid = [bt for bt in grid if start <= bt < end]
+        grid.append(end)
+        grid = np.array(grid, dtype="datetime64[ns]")
+        bars = bars.reindex(pd.DatetimeIndex(grid, name="datetime"))
+        bars["close"] = bars["close"].ffill()
+        for col in ("open", "high", "low"):
+            bars[col] = bars[col].fillna(bars["close"])
+        if "volume" in bars.columns:
+            bars["volume"] = bars["volume"].fillna(0)
+    if tz is not None:
+        bars.index = bars.index.tz_localize(cal.tz or tz).tz_convert(tz)
+    return bars
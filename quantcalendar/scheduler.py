@@ -0,0 +1,172 @@
+import asyncio
+import heapq
+import itertools
+from collections import deque, namedtuple
+from datetime import datetime, timezone
+from functools import partial
+from typing import AsyncIterator, Callable, Iterable
+
+from .calendar import Calendar, OutOfCalendar, _one_microsecond
+
+__all__ = ["BarCloseEvent", "CalendarScheduler"]
+
+BarCloseEvent = namedtuple(
+    "BarCloseEvent", ["symbol", "bartime", "bar_open", "bar_close"]
+)
+""" K线结束事件, `bartime`按日历的`bartime_side`取结束时间或者开始时间"""
+
+
+class CalendarScheduler:
+    """
+    asyncio定时器, 等待开盘、收盘或者K线结束
+
+    所有品种的定时共用一个按时间排序的最小堆和一个asyncio定时器, 几百个品种也只有
+    最早到期的定时在事件循环中, 不需要每个品种一个线程或者每秒轮询`is_trading`
+
+    定时按交易所当地时间计算, 到期时重新读取时钟, 系统时间调整后也不会提前触发,
+    必须在事件循环中使用
+    """
+
+    def __init__(self, calendar: Calendar, now: Callable[[], datetime] = None):
+        """
+        Params:
+            calendar: 日历, 会通过`calendar.get(symbol)`获取品种日历
+            now: 返回当前交易所当地时间(不带时区)的函数, 默认按日历时区`tz`取系统时间,
+                `tz`为None时取UTC时间
+        """
+        self.calendar = calendar
+        self._now = now or partial(_local_now, calendar.tz)
+        # (触发时间, 序号, 回调), 序号保证同一时间的回调按添加顺序调用
+        self._heap = []
+        self._counter = itertools.count()
+        self._timer: asyncio.TimerHandle = None
+        self._timer_when: datetime = None
+
+    def now(self) -> datetime:
+        return self._now()
+
+    def call_at(self, when: datetime, callback: Callable[[], None]):
+        """在交易所当地时间`when`调用`callback()`, 已经过去的时间在下一次事件循环调用"""
+        heapq.heappush(self._heap, (when, next(self._counter), callback))
+        if self._timer_when is None or when < self._timer_when:
+            self._arm()
+
+    def cancel(self):
+        """取消所有定时, 正在等待的`wait_until_*`不会再返回"""
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = self._timer_when = None
+        self._heap.clear()
+
+    def _arm(self):
+        """按最早到期的定时设置asyncio定时器"""
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = self._timer_when = None
+        if not self._heap:
+            return
+        when = self._heap[0][0]
+        delay = max((when - self._now()).total_seconds(), 0)
+        self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+        self._timer_when = when
+
+    def _on_timer(self):
+        self._timer = self._timer_when = None
+        now = self._now()
+        while self._heap and self._heap[0][0] <= now:
+            _, _, callback = heapq.heappop(self._heap)
+            callback()
+        self._arm()
+
+    async def wait_until(self, when: datetime) -> datetime:
+        """等待到交易所当地时间`when`, 返回`when`"""
+        future = asyncio.get_running_loop().create_future()
+        self.call_at(when, partial(_set_result, future, when))
+        return await future
+
+    async def wait_until_open(self, symbol: str = None, breaks: bool = True):
+        """
+        等待品种下一次开盘, 返回开盘时间
+
+        Params:
+            breaks: 休息时间段之后的开盘也算, 同`get_session_dt`,
+                否则同`get_open_close_dt`
+        """
+        sos, _ = self._find_next_session(symbol, breaks)
+        return await self.wait_until(sos)
+
+    async def wait_until_close(self, symbol: str = None, breaks: bool = True):
+        """等待品种下一次收盘, 返回收盘时间, 参数同`wait_until_open`"""
+        _, eos = self._find_next_session(symbol, breaks)
+        return await self.wait_until(eos)
+
+    async def wait_until_bar_close(self, symbol: str, interval: int) -> datetime:
+        """
+        等待品种当前K线结束, 返回K线时间
+
+        Params:
+            interval(seconds): K线间隔周期
+        """
+        cal = self.calendar.get(symbol)
+        bar_open, bar_close = cal.get_current_bar(self._now(), interval)
+        await self.wait_until(bar_close)
+        return bar_close if cal.bartime_side == "right" else bar_open
+
+    async def bar_closes(
+        self, symbols: Iterable[str], interval: int
+    ) -> AsyncIterator[BarCloseEvent]:
+        """
+        多个品种K线结束事件的异步迭代器, 从当前K线开始,
+        同一时间结束的K线按`symbols`的顺序返回, 日历结束的品种不再返回
+
+        Params:
+            interval(seconds): K线间隔周期
+        """
+        calendars = {symbol: self.calendar.get(symbol) for symbol in symbols}
+        pending = deque()
+        ready = asyncio.Event()
+        active = set()
+
+        def fire(event: BarCloseEvent):
+            pending.append(event)
+            ready.set()
+
+        def schedule(symbol: str, dt: datetime):
+            cal = calendars[symbol]
+            try:
+                bar_open, bar_close = cal.get_current_bar(dt, interval)
+            except OutOfCalendar:
+                active.discard(symbol)
+                return
+            bartime = bar_close if cal.bartime_side == "right" else bar_open
+            event = BarCloseEvent(symbol, bartime, bar_open, bar_close)
+            self.call_at(bar_close, partial(fire, event))
+
+        now = self._now()
+        for symbol in calendars:
+            active.add(symbol)
+            schedule(symbol, now)
+        while pending or active:
+            if not pending:
+                ready.clear()
+                await ready.wait()
+                continue
+            event = pending.popleft()
+            # 先定时下一根K线, 不受调用方处理时间影响
+            schedule(event.symbol, event.bar_close + _one_microsecond)
+            yield event
+
+    def _find_next_session(self, symbol: str, breaks: bool):
+        cal = self.calendar.get(symbol)
+        if breaks:
+            return cal.get_session_dt(self._now())
+        return cal.get_open_close_dt(self._now())
+
+
+def _local_now(tz) -> datetime:
+    return datetime.now(tz or timezone.utc).replace(tzinfo=None)
+
+
+def _set_result(future: asyncio.Future, result):
+    if not future.done():
+        future.set_result(result)
@@ -0,0 +1,162 @@
+"""
+日历本地快照文件
+
+文件格式: MAGIC | 格式版本(uint32) | 头部长度(uint64) | 头部JSON | 数组数据
+头部JSON记录元数据和每个数组的dtype、shape、偏移，数组按64字节对齐，
+读取时通过mmap映射，不复制数据
+
+同样格式的数据也可以放在共享内存中(`write_shared`)，多个进程只读挂载(`read_shared`)
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+from multiprocessing import shared_memory
+from typing import Mapping, Tuple
+
+import numpy as np
+
+__all__ = [
+    "SnapshotError",
+    "FORMAT_VERSION",
+    "write",
+    "read",
+    "write_shared",
+    "read_shared",
+]
+
+MAGIC = b"QCALSNAP"
+FORMAT_VERSION = 2
+""" 快照格式或者索引计算方式改变时需要加1，旧版本快照失效"""
+
+_PREFIX = struct.Struct("<8sIQ")
+_ALIGN = 64
+
+
+class SnapshotError(Exception):
+    """快照文件不存在、已损坏或者版本不匹配"""
+
+
+def _align(n):
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def _layout(meta: dict, arrays: Mapping[str, np.ndarray]):
+    """返回(连续的数组, 每个数组的偏移, 文件头, 数组数据开始位置, 总长度)"""
+    arrays = {k: np.ascontiguousarray(v) for k, v in arrays.items()}
+    manifest = {}
+    offset = 0
+    for name, arr in arrays.items():
+        manifest[name] = {"dtype": arr.dtype.str, "shape": arr.shape, "offset": offset}
+        offset = _align(offset + arr.nbytes)
+    header = json.dumps({"meta": meta, "arrays": manifest}, ensure_ascii=False).encode()
+    prefix = _PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)) + header
+    data_start = _align(len(prefix))
+    offsets = {name: data_start + info["offset"] for name, info in manifest.items()}
+    return arrays, offsets, prefix, data_start, data_start + offset
+
+
+def write(path: str, meta: dict, arrays: Mapping[str, np.ndarray]):
+    """写入快照，先写临时文件再替换，保证不会读到写了一半的文件"""
+    arrays, offsets, prefix, _, size = _layout(meta, arrays)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(prefix)
+        for name, arr in arrays.items():
+            f.seek(offsets[name])
+            f.write(arr.tobytes())
+        f.truncate(size)
+    os.replace(tmp_path, path)
+
+
+def read(path: str) -> Tuple[dict, Mapping[str, np.ndarray]]:
+    """读取快照，返回(元数据, 只读数组)，数组直接映射到文件"""
+    try:
+        with open(path, "rb") as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError) as e:
+        raise SnapshotError(f"无法读取快照{path}: {e}") from e
+    return _parse(buf, path)
+
+
+def write_shared(
+    meta: dict, arrays: Mapping[str, np.ndarray], name: str = None
+) -> shared_memory.SharedMemory:
+    """
+    把快照写入新建的共享内存, `name`为None时自动生成名字,
+    返回`SharedMemory`, 不再使用时由调用方`close()`和`unlink()`
+    """
+    arrays, offsets, prefix, _, size = _layout(meta, arrays)
+    shm = shared_memory.SharedMemory(name, create=True, size=max(size, 1))
+    try:
+        shm.buf[: len(prefix)] = prefix
+        for key, arr in arrays.items():
+            start = offsets[key]
+            shm.buf[start : start + arr.nbytes] = memoryview(arr.reshape(-1)).cast("B")
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+    return shm
+
+
+class _AttachedSharedMemory(shared_memory.SharedMemory):
+    """
+    只读挂载的共享内存, 数组引用期间不能`close`,
+    映射在数组全部释放后由mmap自动解除
+    """
+
+    def __del__(self):
+        # 只关闭文件描述符, mmap已经复制了一份
+        if getattr(self, "_fd", -1) >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def read_shared(name: str) -> Tuple[dict, Mapping[str, np.ndarray], object]:
+    """
+    挂载`write_shared`创建的共享内存, 返回(元数据, 只读数组, 共享内存),
+    数组直接引用共享内存, 不复制数据
+
+    Python 3.13之前挂载的共享内存会登记到resource_tracker, 进程退出时可能被删除,
+    只有创建共享内存的进程的子进程(共用同一个resource_tracker)可以安全挂载
+    """
+    kwargs = {"track": False} if sys.version_info >= (3, 13) else {}
+    try:
+        shm = _AttachedSharedMemory(name, **kwargs)
+    except (OSError, ValueError) as e:
+        raise SnapshotError(f"无法挂载共享内存{name}: {e}") from e
+    meta, arrays = _parse(shm.buf, name)
+    for arr in arrays.values():
+        arr.flags.writeable = False
+    return meta, arrays, shm
+
+
+def _parse(buf, path: str) -> Tuple[dict, Mapping[str, np.ndarray]]:
+    """从`buf`(mmap或者共享内存)解析快照, 数组直接引用`buf`"""
+    if len(buf) < _PREFIX.size:
+        raise SnapshotError(f"快照{path}已损坏")
+    magic, version, header_len = _PREFIX.unpack_from(buf)
+    if magic != MAGIC:
+        raise SnapshotError(f"{path}不是日历快照文件")
+    if version != FORMAT_VERSION:
+        raise SnapshotError(f"快照{path}格式版本{version}, 需要{FORMAT_VERSION}")
+    try:
+        header = json.loads(bytes(buf[_PREFIX.size : _PREFIX.size + header_len]))
+    except ValueError as e:
+        raise SnapshotError(f"快照{path}已损坏") from e
+    data_start = _align(_PREFIX.size + header_len)
+
+    arrays = {}
+    for name, info in header["arrays"].items():
+        dtype = np.dtype(info["dtype"])
+        shape = tuple(info["shape"])
+        count = int(np.prod(shape, dtype=np.int64))
+        offset = data_start + info["offset"]
+        if offset + count * dtype.itemsize > len(buf):
+            raise SnapshotError(f"快照{path}已损坏")
+        arr = np.frombuffer(buf, dtype=dtype, count=count, offset=offset)
+        arrays[name] = arr.reshape(shape)
+    return header["meta"], arrays
@@ -0,0 +1,209 @@
+"""
+日历数据来源
+
+`MongoDBCalendar`按集合名从数据来源读取交易日和品种交易时间段, 除了MongoDB,
+还可以从Parquet文件、Arrow表或者pandas DataFrame按列批量读取
+
+交易日集合: `_id`列为连续的日期, `status`列为每天的交易状态
+品种交易时间段集合: `_id`列为品种, `market_time`列为交易时间段[(开盘, 收盘), ...]
+"""
+
+import os
+from datetime import datetime
+from abc import ABC, abstractmethod
+from typing import List, Mapping, Optional, Tuple
+
+import numpy as np
+import quantdata as qd
+
+__all__ = [
+    "CalendarSource",
+    "MongoSource",
+    "DataFrameSource",
+    "ArrowSource",
+    "ParquetSource",
+    "as_source",
+    "export_parquet",
+]
+
+DB_NAME_CALENDAR = "quantcalendar"
+COLLECTION_NAME_VERSIONS = "versions"
+""" 记录每个集合的数据版本, 由`update`写入"""
+VERSION_METADATA_KEY = b"quantcalendar.version"
+""" Parquet文件和Arrow表中保存数据版本的metadata"""
+_EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+""" `datetime64[D]`的0对应的ordinal"""
+
+
+class CalendarSource(ABC):
+    """日历数据来源"""
+
+    @abstractmethod
+    def read_days(self, collection: str) -> Tuple[np.ndarray, np.ndarray]:
+        """返回(连续的日期`datetime64[D]`数组, 每天的交易状态`int8`数组)"""
+        pass
+
+    @abstractmethod
+    def read_sessions(self, collection: str) -> List[dict]:
+        """返回[{"_id": 品种, "market_time": 交易时间段}]"""
+        pass
+
+    def read_version(self, collection: str) -> Optional[str]:
+        """数据版本, 没有记录时返回None"""
+        return None
+
+
+class MongoSource(CalendarSource):
+    def __init__(self, mongo_client):
+        self.mongo_client = mongo_client
+
+    def read_days(self, collection: str) -> Tuple[np.ndarray, np.ndarray]:
+        days = qd.mongo_get_data(self.mongo_client[DB_NAME_CALENDAR], collection)
+        dates = []
+        status = []
+        for day in days:
+            dates.append(day["_id"])
+            status.append(day["status"])
+        return _to_days(dates), np.array(status, dtype=np.int8)
+
+    def read_sessions(self, collection: str) -> List[dict]:
+        return list(qd.mongo_get_data(self.mongo_client[DB_NAME_CALENDAR], collection))
+
+    def read_version(self, collection: str) -> Optional[str]:
+        db = self.mongo_client[DB_NAME_CALENDAR]
+        doc = db[COLLECTION_NAME_VERSIONS].find_one({"_id": collection})
+        return None if doc is None else doc["version"]
+
+
+class DataFrameSource(CalendarSource):
+    """
+    {集合名: pandas DataFrame}, 数据版本从`DataFrame.attrs["version"]`读取
+    """
+
+    def __init__(self, frames: Mapping[str, "pd.DataFrame"]):  # noqa: F821
+        self.frames = frames
+
+    def read_days(self, collection: str) -> Tuple[np.ndarray, np.ndarray]:
+        df = self.frames[collection]
+        dates = df["_id"].to_numpy(dtype="datetime64[ns]")
+        return _to_days(dates), df["status"].to_numpy(np.int8)
+
+    def read_sessions(self, collection: str) -> List[dict]:
+        df = self.frames[collection]
+        return _sessions_from_columns(df["_id"].tolist(), df["market_time"].tolist())
+
+    def read_version(self, collection: str) -> Optional[str]:
+        return self.frames[collection].attrs.get("version")
+
+
+class ArrowSource(CalendarSource):
+    """
+    {集合名: pyarrow.Table}, 数据版本从表的schema metadata读取
+    """
+
+    def __init__(self, tables: Mapping[str, "pa.Table"]):  # noqa: F821
+        self.tables = tables
+
+    def _table(self, collection: str):
+        return self.tables[collection]
+
+    def read_days(self, collection: str) -> Tuple[np.ndarray, np.ndarray]:
+        table = self._table(collection)
+        dates = table.column("_id").cast("timestamp[ns]").to_numpy()
+        status = table.column("status").to_numpy().astype(np.int8, copy=False)
+        return _to_days(dates), status
+
+    def read_sessions(self, collection: str) -> List[dict]:
+        table = self._table(collection)
+        return _sessions_from_columns(
+            table.column("_id").to_pylist(), table.column("market_time").to_pylist()
+        )
+
+    def read_version(self, collection: str) -> Optional[str]:
+        metadata = self._table(collection).schema.metadata or {}
+        version = metadata.get(VERSION_METADATA_KEY)
+        return None if version is None else version.decode()
+
+
+class ParquetSource(ArrowSource):
+    """
+    目录`path`下每个集合一个`{集合名}.parquet`文件, 可以用`export_parquet`生成
+    """
+
+    def __init__(self, path: str):
+        super().__init__({})
+        self.path = path
+
+    def _table(self, collection: str):
+        table = self.tables.get(collection)
+        if table is None:
+            import pyarrow.parquet as pq
+
+            table = pq.read_table(os.path.join(self.path, f"{collection}.parquet"))
+            self.tables[collection] = table
+        return table
+
+
+def as_source(source) -> CalendarSource:
+    """`CalendarSource`原样返回, 其它的当作MongoDB连接"""
+    if isinstance(source, CalendarSource):
+        return source
+    return MongoSource(source)
+
+
+def export_parquet(source, path: str, collections: Mapping[str, str]):
+    """
+    把日历数据保存成Parquet文件, 之后可以用`ParquetSource(path)`读取
+
+    Params:
+        source: 数据来源或者MongoDB连接
+        collections: {集合名: "days"或者"sessions"}, 比如
+            {"cn_future": "days", "cn_future_sessions": "sessions"}
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    source = as_source(source)
+    os.makedirs(path, exist_ok=True)
+    for collection, kind in collections.items():
+        if kind == "days":
+            dates, status = source.read_days(collection)
+            table = pa.table({"_id": dates, "status": status})
+        elif kind == "sessions":
+            sessions = source.read_sessions(collection)
+            table = pa.table(
+                {
+                    "_id": [s["_id"] for s in sessions],
+                    "market_time": [
+                        [list(map(int, s)) for s in prod["market_time"]]
+                        for prod in sessions
+                    ],
+                }
+            )
+        else:
+            raise ValueError(f"unknown collection kind {kind}")
+        version = source.read_version(collection)
+        if version is not None:
+            table = table.replace_schema_metadata(
+                {VERSION_METADATA_KEY: version.encode()}
+            )
+        pq.write_table(table, os.path.join(path, f"{collection}.parquet"))
+
+
+def _to_days(dates) -> np.ndarray:
+    """日期列表或者`datetime64`数组转换为`datetime64[D]`数组"""
+    if isinstance(dates, np.ndarray) and dates.dtype.kind == "M":
+        return dates.astype("datetime64[D]")
+    # numpy逐个转换datetime对象很慢, 先转换为ordinal
+    ordinals = np.array([dt.toordinal() for dt in dates], dtype=np.int64)
+    return (ordinals - _EPOCH_ORDINAL).astype("datetime64[D]")
+
+
+def _sessions_from_columns(product_ids, market_times) -> List[dict]:
+    return [
+        {
+            "_id": product_id,
+            "market_time": [tuple(map(int, s)) for s in market_time],
+        }
+        for product_id, market_time in zip(product_ids, market_times)
+    ]
@@ -3,7 +3,7 @@ from datetime import datetime
 import fire
 import quantdata as qd
 
-from .calendar import DB_NAME_CALENDAR
+from .calendar import COLLECTION_NAME_VERSIONS, DB_NAME_CALENDAR
 from .tools import download_tqsdk, download_tushare
 
 
@@ -32,6 +32,12 @@ def update(
         for col, data in updating.items():
             db.drop_collection(col)
             db[col].insert_many(data)
+            # 数据版本改变后, 本地快照失效
+            db[COLLECTION_NAME_VERSIONS].replace_one(
+                {"_id": col},
+                {"_id": col, "version": datetime.now().isoformat()},
+                upsert=True,
+            )
             print(f"{col} updated, last row: {data[-1]}")
 
 
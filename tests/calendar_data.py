@@ -0,0 +1,69 @@
+"""
+不依赖MongoDB的日历数据, 格式同MongoDB集合, 单元测试和性能测试(`benchmarks`)共用
+"""
+
+import numpy as np
+import pandas as pd
+
+__all__ = ["HOLIDAYS", "PRODUCTS", "calendar_frames"]
+
+# 2023-2025年交易所节假日休市的日期
+HOLIDAYS = [
+    ("2023-01-02", "2023-01-02"),
+    ("2023-01-21", "2023-01-27"),
+    ("2023-04-05", "2023-04-05"),
+    ("2023-04-29", "2023-05-03"),
+    ("2023-06-22", "2023-06-24"),
+    ("2023-09-29", "2023-10-06"),
+    ("2024-01-01", "2024-01-01"),
+    ("2024-02-09", "2024-02-17"),
+    ("2024-04-04", "2024-04-06"),
+    ("2024-05-01", "2024-05-05"),
+    ("2024-06-10", "2024-06-10"),
+    ("2024-09-15", "2024-09-17"),
+    ("2024-10-01", "2024-10-07"),
+    ("2025-01-01", "2025-01-01"),
+    ("2025-01-28", "2025-02-04"),
+    ("2025-04-04", "2025-04-06"),
+    ("2025-05-01", "2025-05-05"),
+    ("2025-05-31", "2025-06-02"),
+    ("2025-10-01", "2025-10-08"),
+]
+
+# 中国期货品种的交易时间段
+PRODUCTS = {
+    "AG": [(75600, 9000), (32400, 36900), (37800, 41400), (48600, 54000)],
+    "AU": [(75600, 9000), (32400, 36900), (37800, 41400), (48600, 54000)],
+    "CU": [(75600, 3600), (32400, 36900), (37800, 41400), (48600, 54000)],
+    "C": [(75600, 82800), (32400, 36900), (37800, 41400), (48600, 54000)],
+    "EC": [(32400, 36900), (37800, 41400), (48600, 54000)],
+    "IF": [(34200, 41400), (46800, 54000)],
+    "IH": [(34200, 41400), (46800, 54000)],
+    "T": [(34200, 41400), (46800, 54900)],
+}
+
+
+def calendar_frames(
+    start: str = "2022-12-01",
+    end: str = "2025-12-31",
+    holidays=HOLIDAYS,
+    products: dict = PRODUCTS,
+):
+    """
+    `start`到`end`每天的交易状态 1-交易日 2-周末 3-节假日(包括连着节假日的周末),
+    以及期货品种的交易时间段, 返回{集合名: DataFrame}, 可以用`DataFrameSource`读取
+    """
+    dates = pd.date_range(start, end)
+    weekend = np.asarray(dates.dayofweek >= 5)
+    holiday = np.zeros(len(dates), dtype=bool)
+    for first, last in holidays:
+        holiday |= np.asarray((dates >= first) & (dates <= last))
+    for _ in range(2):
+        holiday[1:] |= weekend[1:] & holiday[:-1]
+        holiday[:-1] |= weekend[:-1] & holiday[1:]
+    status = np.where(holiday, 3, np.where(weekend, 2, 1))
+    days = pd.DataFrame({"_id": dates, "status": status})
+    sessions = pd.DataFrame(
+        {"_id": list(products), "market_time": list(products.values())}
+    )
+    return {"cn_stock": days, "cn_future": days.copy(), "cn_future_sessions": sessions}
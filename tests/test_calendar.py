@@ -1,14 +1,33 @@
+import asyncio
 import os
+import pickle
 import re
-from datetime import datetime, date, time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date, time, timedelta, timezone
 
+import numpy as np
 import pandas as pd
 import pytest
 import quantdata as qd
+from calendar_data import calendar_frames
 
 from quantcalendar.calendar_astock import CalendarAstock
 from quantcalendar.calendar_ctp import CalendarCTP
 from quantcalendar.calendar_7x24 import Time7x24Calendar
+from quantcalendar.bar_clock import BarClock, BarStatus
+from quantcalendar.scheduler import BarCloseEvent, CalendarScheduler
+from quantcalendar.registry import CalendarRegistry, get_calendar
+from quantcalendar import instrument
+from quantcalendar.resample import resample_ohlcv
+from quantcalendar.align import (
+    align_bars,
+    intersect_bartimes,
+    intersect_tradedays,
+    union_bartimes,
+    union_tradedays,
+)
+from quantcalendar.snapshot import SnapshotError
+from quantcalendar.source import DataFrameSource, ParquetSource, export_parquet
 from quantcalendar.calendar import (
     I1H,
     I2H,
@@ -17,20 +36,37 @@ from quantcalendar.calendar import (
     DAILY,
     WEEKLY,
     MONTHLY,
+    QUARTERLY,
+    YEARLY,
+    Calendar,
+    LRUCache,
+    OutOfCalendar,
+    TradeDaysView,
 )
 
 
 @pytest.fixture(scope="module")
 def mongo_client():
     conn = qd.mongo_connect("127.0.0.1")
+    try:
+        conn.admin.command("ping")
+    except Exception:
+        qd.mongo_close(conn)
+        pytest.skip("MongoDB不可用")
     print("connect mongodb")
     yield conn
     qd.mongo_close(conn)
     print("disconnect mongodb")
 
 
+@pytest.fixture(scope="module")
+def calendar_source():
+    """不需要MongoDB的日历数据来源"""
+    return DataFrameSource(calendar_frames())
+
+
 # fmt: off
-def test_get_tradedays(mongo_client):
+def test_get_tradedays(calendar_source):
     cal = Time7x24Calendar()
     assert cal.get_tradedays_between(datetime(2024, 9, 13), datetime(2024, 9, 13)) == [datetime(2024, 9, 13)]
     assert cal.get_tradedays_between(datetime(2024, 9, 13), datetime(2024, 9, 14)) == [datetime(2024, 9, 13), datetime(2024, 9, 14)]
@@ -56,13 +92,17 @@ def test_get_tradedays(mongo_client):
     assert cal.get_tradedays_week_day(3, datetime(2023, 12, 27), datetime(2024, 1, 10)) == week_days
     assert cal.get_tradedays_week_day(3, datetime(2023, 12, 27), count=3) == week_days
 
-    cal = CalendarAstock(mongo_client)
+    cal = CalendarAstock(calendar_source)
     assert cal.get_tradedays_gte(datetime(2023, 6, 30))[0] == datetime(2023, 6, 30)
     assert cal.get_tradedays_lte(datetime(2024, 9, 17))[-1] == datetime(2024, 9, 13)
     assert cal.get_tradedays_lte(datetime(2024, 9, 14))[-1] == datetime(2024, 9, 13)
     assert cal.get_tradedays_lte(datetime(2024, 9, 13))[-1] == datetime(2024, 9, 13)
     assert cal.get_tradedays_between(datetime(2024, 9, 13), datetime(2024, 9, 17)) == [datetime(2024, 9, 13)]
     assert cal.get_tradedays_between(datetime(2024, 9, 13), datetime(2024, 9, 18)) == [datetime(2024, 9, 13), datetime(2024, 9, 18)]
+    days = cal.get_tradedays_gte(datetime(2024, 9, 13))
+    assert isinstance(days, TradeDaysView)
+    assert days[:2] == [datetime(2024, 9, 13), datetime(2024, 9, 18)]
+    assert len(days[1:]) == len(days) - 1
     month_ends = [ datetime(2024, 1, 31), datetime(2024, 2, 29), datetime(2024, 3, 29), ]
     month_begins = [ datetime(2024, 1, 2), datetime(2024, 2, 1), datetime(2024, 3, 1), ]
     week_ends = [ datetime(2024, 1, 5), datetime(2024, 1, 12), datetime(2024, 1, 19), ]
@@ -114,6 +154,11 @@ def test_calendar_7x24_bartime():
     for query, answer, interval in bartime_testcases:
         assert cal.get_current_bartime(query, interval) == answer
 
+    queries = pd.DatetimeIndex([q for q, _, i in bartime_testcases if i == 60])
+    answers = [a for _, a, i in bartime_testcases if i == 60]
+    assert (cal.get_current_bartimes(queries, 60) == pd.DatetimeIndex(answers).values).all()
+    assert len(cal.get_current_bartimes(pd.DatetimeIndex([]), 60)) == 0
+
     bartimes = cal.get_bartimes(MONTHLY, datetime(2024, 9, 13), count=20)
     assert bartimes[0] == datetime(2024, 10, 1)
     assert bartimes[1] == datetime(2024, 11, 1)
@@ -128,6 +173,7 @@ def test_calendar_7x24_bartime():
 
     bartimes = cal.get_bartimes(1800, datetime(2024, 9, 13, 1, 0, 1), end=datetime(2024, 9, 14))
     assert bartimes[0] == datetime(2024, 9, 13, 1, 30)
+    assert cal.get_bartimes(1800, datetime(2024, 9, 13, 1, 0, 1), end=datetime(2024, 9, 13, 1, 20)) == []
 
     bartimes = cal.get_bartimes(I4H, datetime(2024, 9, 13), end=datetime(2024, 9, 14))
     assert len(bartimes) == 6
@@ -141,8 +187,10 @@ def test_calendar_7x24_bartime():
     ]
 
 
-def test_calendar_astock(mongo_client):
-    cal = CalendarAstock(mongo_client)
+def test_calendar_astock(calendar_source):
+    cal = CalendarAstock(calendar_source)
+    assert cal.is_trading_day(datetime(2024, 9, 13, 10))
+    assert not cal.is_trading_day(datetime(2024, 9, 14, 10))
     assert cal.is_trading(datetime(2024, 9, 20, 9, 0)) == False
     assert cal.is_trading(datetime(2024, 9, 20, 9, 30)) == True
     assert cal.is_trading(datetime(2024, 9, 20, 11, 30)) == True
@@ -151,6 +199,8 @@ def test_calendar_astock(mongo_client):
     assert cal.is_trading(datetime(2024, 9, 20, 15, 0)) == True
     assert cal.is_trading(datetime(2024, 9, 20, 15, 1)) == False
     assert cal.is_trading(datetime(2024, 9, 17, 10, 0)) == False
+    assert cal.get_session_dt(datetime(2024, 9, 20, 11, 0)) == (datetime(2024, 9, 20, 13), datetime(2024, 9, 20, 11, 30))
+    assert cal.get_session_dt(datetime(2024, 9, 20, 12, 0)) == (datetime(2024, 9, 20, 13), datetime(2024, 9, 20, 15))
     assert cal.get_open_close_dt(datetime(2024, 9, 13)) == (datetime(2024, 9, 13, 9, 30), datetime(2024, 9, 13, 15))
     assert cal.get_open_close_dt(datetime(2024, 9, 14)) == (datetime(2024, 9, 18, 9, 30), datetime(2024, 9, 18, 15))
     assert cal.get_open_close_dt(datetime(2024, 9, 18, 10)) == (datetime(2024, 9, 19, 9, 30), datetime(2024, 9, 18, 15))
@@ -168,6 +218,13 @@ def test_calendar_astock(mongo_client):
     ]
     for query, answer, interval in bartime_testcases:
         assert cal.get_current_bartime(query, interval) == answer
+    # 时间段内没有K线时返回空列表, 超出日历时抛出OutOfCalendar
+    assert cal.get_bartimes(DAILY, datetime(2024, 9, 14), datetime(2024, 9, 15)) == []
+    assert cal.get_bartimes(60, datetime(2024, 9, 20, 12), datetime(2024, 9, 20, 12, 30)) == []
+    assert cal.get_bartimes(WEEKLY, datetime(2024, 9, 23), datetime(2024, 9, 25)) == []
+    assert cal.count_bars(60, datetime(2024, 9, 20, 12), datetime(2024, 9, 20, 12, 30)) == 0
+    with pytest.raises(OutOfCalendar):
+        cal.get_bartimes(DAILY, datetime(2100, 1, 1), count=1)
 
 
 def _ctp_close_time(product_id, year, month, day):
@@ -227,8 +284,8 @@ _ctp_get_open_answers = {
 
 
 @pytest.mark.parametrize("product_id", [None, "IH", "AG"])
-def test_calendar_ctp(mongo_client, product_id):
-    cal = CalendarCTP(mongo_client)
+def test_calendar_ctp(calendar_source, product_id):
+    cal = get_calendar(CalendarCTP, calendar_source)
     cal = cal.get(product_id)
     # 2023-06-22 端午节
     # 2024-09-14 中秋节
@@ -251,6 +308,24 @@ def test_calendar_ctp(mongo_client, product_id):
     assert cal.is_trading(datetime(2023, 6, 22, 9, 0, 0)) == False
     assert cal.is_trading(datetime(2023, 6, 22, 9, 30, 0)) == False
 
+    # end不包含在内
+    bartimes = cal.get_bartimes(60, datetime(2024, 9, 12, 14, 59), end=datetime(2024, 9, 12, 21, 2))
+    if product_id == "IH":
+        assert bartimes[-1] == _ctp_close_time(product_id, 2024, 9, 12)
+    else:
+        assert bartimes[-1] == datetime(2024, 9, 12, 21, 1)
+    # end与加上offset后的K线时间比较, 不再包含end之后offset范围内的K线
+    bartimes = cal.get_bartimes(300, datetime(2024, 9, 12, 14, 50), end=datetime(2024, 9, 12, 15))
+    assert bartimes == [datetime(2024, 9, 12, 14, 50), datetime(2024, 9, 12, 14, 55)]
+    if product_id == "AG":
+        bartimes = cal.get_bartimes(60, datetime(2024, 9, 12, 23, 58), end=datetime(2024, 9, 13))
+        assert bartimes == [datetime(2024, 9, 12, 23, 58), datetime(2024, 9, 12, 23, 59)]
+    # 日盘收盘后时间段内没有K线时返回空列表, 超出日历时抛出OutOfCalendar
+    assert cal.get_bartimes(300, datetime(2024, 9, 12, 15, 30), end=datetime(2024, 9, 12, 16)) == []
+    assert cal.count_bars(300, datetime(2024, 9, 12, 15, 30), datetime(2024, 9, 12, 16)) == 0
+    with pytest.raises(OutOfCalendar):
+        cal.get_bartimes(300, datetime(2100, 1, 1), count=1)
+
     for q, ans in zip(
         _ctp_get_open_close_queries,
         list(
@@ -260,8 +335,386 @@ def test_calendar_ctp(mongo_client, product_id):
         assert cal.get_open_close_dt(q) == ans
 
 
-def test_calendar_ctp_bartime(mongo_client):
+def test_calendar_ctp_lazy(calendar_source):
+    cal = CalendarCTP(calendar_source)
+    assert not cal._sub_calendars
+    ag = cal.get("ag2412")
+    assert ag.product_id == "AG"
+    assert cal.get("AG") is ag
+    assert cal.get("IH").get("AG") is ag
+    assert set(cal._sub_calendars) == {"AG", "IH"}
+    # 交易时间段相同的品种共用交易时间段、特殊交易时间段和索引
+    au = cal.get("AU")
+    assert au.product_id == "AU"
+    assert au.special_sessions is ag.special_sessions
+    assert au._bartime_indexes is ag._bartime_indexes
+    assert cal.get("IH").special_sessions == {}
+    cal = CalendarCTP(calendar_source, preload=["AG"])
+    assert set(cal._sub_calendars) == {"AG"}
+
+
+def test_calendar_add_template(calendar_source):
+    cal = CalendarAstock(calendar_source)
+    dt = datetime(2024, 9, 20, 10, 4)
+    right = cal.add("R")
+    assert right.get_current_bartime(dt, 300) == datetime(2024, 9, 20, 10, 5)
+    # 改变`init`结果或者索引的参数不共用模板
+    left = cal.add("L", bartime_side="left")
+    assert left._bartime_indexes is not right._bartime_indexes
+    assert left.get_current_bartime(dt, 300) == datetime(2024, 9, 20, 10)
+    shifted = cal.add("O", offset=timedelta(hours=2))
+    assert shifted._offset_seconds == 7200 and shifted._bartime_indexes is not right._bartime_indexes
+    small = cal.add("C", bartime_cache_size=2)
+    assert small._bartime_indexes.maxsize == 2
+    assert cal.add("S", sessions=cal.sessions)._bartime_indexes is right._bartime_indexes
+    assert len(cal._templates) == 4
+
+
+def test_calendar_period_index(calendar_source):
+    cal = CalendarCTP(calendar_source)
+    ag = cal.get("ag2412")
+    start = datetime(2023, 1, 1)
+    end = datetime(2024, 6, 30)
+    # 预先计算的周期边界与逐日扫描的结果相同
+    for period in (WEEKLY, MONTHLY, QUARTERLY, YEARLY):
+        for func in ("_get_tradedays_xxx_end", "_get_tradedays_xxx_begin"):
+            for args in ((start, None, 0), (start, end, 0), (start, None, 7)):
+                assert getattr(cal, func)(*args, period) == getattr(Calendar, func)(cal, *args, period)
+        closes = ag._iter_bar_closes(period, start)
+        bartimes = [next(closes) + ag.offset for _ in range(2)]
+        assert ag.get_bartimes(period, start + ag.offset, count=2) == bartimes
+    for weekday in range(1, 8):
+        assert cal.get_tradedays_week_day(weekday, start, end) == Calendar.get_tradedays_week_day(cal, weekday, start, end)
+    for period, n, weekday in ((MONTHLY, 3, None), (QUARTERLY, -1, 5), (YEARLY, -2, None), (WEEKLY, 2, None), (MONTHLY, 5, 1)):
+        expected = Calendar.get_tradedays_nth(cal, period, n, start, end, weekday=weekday)
+        assert cal.get_tradedays_nth(period, n, start, end, weekday=weekday) == expected
+
+    assert cal.get_tradedays_nth(MONTHLY, 1, start, end) == cal.get_tradedays_month_begin(start, end)
+    assert cal.get_tradedays_nth(QUARTERLY, -1, start, end) == cal.get_tradedays_quarter_end(start, end)
+    assert cal.get_tradedays_nth(YEARLY, -1, start, count=1) == cal.get_tradedays_year_end(start, count=1)
+    for day in cal.get_tradedays_nth(QUARTERLY, -1, start, end, weekday=5):
+        # 季度最后一个交易周五, 下一个交易周五属于下一个季度
+        next_friday = cal.get_tradedays_week_day(5, day, count=2)[1]
+        assert day.isoweekday() == 5 and (next_friday.month - 1) // 3 != (day.month - 1) // 3
+    with pytest.raises(ValueError):
+        cal.get_tradedays_nth(MONTHLY, 0, start)
+    with pytest.raises(ValueError):
+        cal.get_tradedays_nth(MONTHLY, 6, start, weekday=5)
+
+
+def test_tradeday_offset(calendar_source):
+    cal = CalendarCTP(calendar_source)
+    day = datetime(2024, 9, 13)  # 周五
+    days = cal.get_tradedays_lte(day)
+    assert cal.tradeday_offset(day, 0) == day
+    assert cal.tradeday_offset(day, -20) == days[-21]
+    assert cal.tradeday_offset(day, 5) == cal.get_tradedays_gte(day)[5]
+    saturday = datetime(2024, 9, 14, 10)
+    with pytest.raises(ValueError):
+        cal.tradeday_offset(saturday, 1)
+    assert cal.tradeday_offset(saturday, 0, roll="backward") == day
+    assert cal.tradeday_offset(saturday, 0, roll="forward") == cal.get_tradedays_next(saturday)
+    assert cal.tradeday_offset(saturday, -1, roll="forward") == day
+    for start, end in ((datetime(2024, 1, 1), datetime(2024, 12, 31)), (saturday, saturday), (day, datetime(2024, 9, 1))):
+        assert cal.count_tradedays(start, end) == len(cal.get_tradedays_between(start, end))
+
+    cal = Time7x24Calendar()
+    assert cal.tradeday_offset(datetime(2024, 2, 28, 10), 2) == datetime(2024, 3, 1)
+    assert cal.tradeday_offset(datetime(2024, 3, 1), -1) == datetime(2024, 2, 29)
+    assert cal.count_tradedays(datetime(2024, 2, 1), datetime(2024, 3, 1, 12)) == 30
+
+
+def test_trading_seconds(calendar_source):
+    ag = CalendarCTP(calendar_source).get("ag2412")
+    # 休息时间10:15-10:30不算
+    assert ag.get_trading_seconds(datetime(2024, 9, 13, 10), datetime(2024, 9, 13, 10, 45)) == 1800
+    assert ag.get_trading_seconds(datetime(2024, 9, 13, 10, 45), datetime(2024, 9, 13, 10)) == -1800
+    # 夜盘跨过0点
+    assert ag.get_trading_seconds(datetime(2024, 9, 11, 23), datetime(2024, 9, 12, 1)) == 7200
+    assert ag.trading_time_offset(datetime(2024, 9, 13, 10, 14), 120) == datetime(2024, 9, 13, 10, 31)
+    assert ag.trading_time_offset(datetime(2024, 9, 13, 10, 31), timedelta(minutes=-1)) == datetime(2024, 9, 13, 10, 30)
+    assert ag.trading_time_offset(datetime(2024, 9, 13, 14, 59), 60) == datetime(2024, 9, 13, 15)
+    # 节假日前一天没有夜盘, 下一次开盘是节后上午
+    assert ag.trading_time_offset(datetime(2024, 9, 13, 15), 60) == datetime(2024, 9, 18, 9, 1)
+    # 与逐分钟判断是否交易的结果相同
+    start = datetime(2024, 9, 12, 20)
+    minutes = [start + timedelta(minutes=m, seconds=30) for m in range(3 * 24 * 60)]
+    assert ag.get_trading_seconds(start, start + timedelta(days=3)) == 60 * sum(map(ag.is_trading, minutes))
+    # 带时区的按北京时间计算, 返回相同时区的时间: UTC 06:00-14:00为北京时间14:00-22:00
+    utc = datetime(2024, 9, 12, 6, tzinfo=timezone.utc)
+    assert ag.get_trading_seconds(utc, utc + timedelta(hours=8)) == 7200
+    assert ag.trading_time_offset(utc, 3600) == datetime(2024, 9, 12, 7, tzinfo=timezone.utc)
+    assert ag.trading_time_offset(utc, 3600).tzinfo is timezone.utc
+
+    cal = Time7x24Calendar()
+    assert cal.get_trading_seconds(datetime(2024, 1, 1), datetime(2024, 1, 2, 12)) == 129600
+    assert cal.trading_time_offset(datetime(2024, 1, 1), -90) == datetime(2023, 12, 31, 23, 58, 30)
+
+
+def test_bar_ordinal(calendar_source):
+    ag = CalendarCTP(calendar_source).get("ag2412")
+    dt = datetime(2024, 9, 13, 10, 14, 30)
+    ordinal = ag.get_bar_ordinal(dt, 300)
+    assert ag.get_bartime_by_ordinal(ordinal, 300) == ag.get_current_bartime(dt, 300)
+    # 200根K线之前
+    bartimes = ag.get_bartimes(300, ag.get_bartime_by_ordinal(ordinal - 200, 300), count=201)
+    assert bartimes[-1] == datetime(2024, 9, 13, 10, 15)
+    end = datetime(2024, 9, 20)
+    assert ag.count_bars(300, dt, end) == len(ag.get_bartimes(300, dt, end))
+    assert ag.count_bars(300, end, dt) == 0
+    dts = pd.DatetimeIndex([dt, datetime(2024, 9, 18, 9, 1), datetime(2024, 9, 18, 21, 30)])
+    assert ag.get_bar_ordinals(dts, 300).tolist() == [ag.get_bar_ordinal(d, 300) for d in dts]
+    # 没有K线索引的周期不支持序号
+    with pytest.raises(ValueError):
+        ag.get_bar_ordinal(dt, 1)
+
+    cal = Time7x24Calendar()
+    assert cal.get_bar_ordinal(datetime(1970, 1, 2), DAILY) == 0
+    assert cal.get_bar_ordinal(datetime(1970, 1, 2, 0, 0, 1), DAILY) == 1
+    assert cal.get_bartime_by_ordinal(cal.get_bar_ordinal(dt, 60) - 60, 60) == datetime(2024, 9, 13, 9, 15)
+    assert cal.count_bars(60, dt, datetime(2024, 9, 13, 11)) == 45
+
+
+def test_calendar_align(calendar_source):
+    cal = CalendarCTP(calendar_source)
+    ag, ih = cal.get("ag2412"), cal.get("IH")
+    start, end = datetime(2024, 9, 12, 14, 50), datetime(2024, 9, 12, 21, 10)
+    grid = union_bartimes([ag, ih], 300, start, end)
+    assert pd.DatetimeIndex(grid)[-2:].tolist() == [datetime(2024, 9, 12, 15), datetime(2024, 9, 12, 21, 5)]
+    assert len(intersect_bartimes([ag, ih], 300, start, end)) == len(grid) - 1
+    ordinals = align_bars(grid, [ag, ih], 300)
+    assert ordinals.shape == (len(grid), 2)
+    assert [ag.get_bartime_by_ordinal(k, 300) for k in ordinals[:, 0]] == pd.DatetimeIndex(grid).tolist()
+    # 夜盘时IH最后一根K线是下午收盘的K线
+    assert ih.get_bartime_by_ordinal(ordinals[-1, 1], 300) == datetime(2024, 9, 12, 15)
+
+    start, end = datetime(2024, 9, 27), datetime(2024, 10, 8)
+    days = intersect_tradedays([CalendarAstock(calendar_source), ag], start, end)
+    assert pd.DatetimeIndex(days).tolist() == [datetime(2024, 9, 27), datetime(2024, 9, 30), datetime(2024, 10, 8)]
+    assert len(union_tradedays([ag, Time7x24Calendar()], start, end)) == 12
+
+
+def test_epoch_ns(calendar_source):
+    ag = CalendarCTP(calendar_source).get("ag2412")
+    utc = pd.Timestamp("2024-09-13 02:14:30", tz="UTC")  # 北京时间10:14:30
+    assert ag.is_trading_ns(utc.value)
+    assert ag.is_trading(utc.to_pydatetime())  # 带时区的转换为北京时间
+    assert ag.get_current_bartime_ns(utc.value, 300) == pd.Timestamp("2024-09-13 02:15", tz="UTC").value
+    assert ag.get_current_bartime_ns(np.datetime64(utc.value, "ns"), 300) == np.datetime64("2024-09-13T02:15")
+    assert ag.get_session_ns(utc.value) == tuple(pd.Timestamp(dt, tz="Asia/Shanghai").value for dt in ag.get_session_dt(datetime(2024, 9, 13, 10, 14, 30)))
+    ticks = pd.DatetimeIndex(["2024-09-13 02:14:30", "2024-09-13 07:30", "2024-09-18 13:01"], tz="UTC")
+    assert ag.is_trading_ns(ticks).tolist() == [True, False, True]
+    bartimes = ag.get_current_bartime_ns(ticks, 60)
+    assert pd.DatetimeIndex(bartimes).strftime("%m-%d %H:%M").tolist() == ["09-13 02:15", "09-18 01:01", "09-18 13:01"]
+    ns = bartimes.view(np.int64)
+    assert ag.is_trading_ns(ns).tolist() == [True, True, True]
+    assert ag.to_utc_ns(ag.to_local_ns(ns)).tolist() == ns.tolist()
+    # 带时区的时间先转换为北京时间
+    local = ticks.tz_convert(ag.tz).tz_localize(None)
+    assert (ag.get_current_bartimes(ticks, 60) == ag.get_current_bartimes(local, 60)).all()
+    assert ag.get_bar_ordinals(ticks, 60).tolist() == ag.get_bar_ordinals(local, 60).tolist()
+    assert ag.get_closed_bar_ordinals(ticks, 60).tolist() == ag.get_closed_bar_ordinals(local, 60).tolist()
+    assert ag.get_current_bartime(utc.to_pydatetime(), 300) == datetime(2024, 9, 13, 10, 15, tzinfo=ag.tz)
+    assert ag.get_current_bar(utc, 300) == (datetime(2024, 9, 13, 10, 10, tzinfo=ag.tz), datetime(2024, 9, 13, 10, 15, tzinfo=ag.tz))
+
+    cal = Time7x24Calendar()  # 没有时区, 不转换
+    assert cal.get_current_bartime_ns(utc.value, 3600) == pd.Timestamp("2024-09-13 03:00").value
+    assert cal.get_open_close_ns(utc.value) == (pd.Timestamp("2024-09-14").value,) * 2
+
+
+def _as_shanghai(value):
+    """带时区的结果转换为不带时区的北京时间, 用于与不带时区的查询结果比较"""
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        assert value.tzinfo is timezone.utc  # 返回与输入相同的时区
+        return value.astimezone(CalendarCTP.tz).replace(tzinfo=None)
+    if isinstance(value, (list, tuple)):
+        return [_as_shanghai(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return value
+
+
+@pytest.mark.parametrize("call", [
+    lambda cal, dt, end: cal.get_open_close_dt(dt),
+    lambda cal, dt, end: cal.get_session_dt(end),
+    lambda cal, dt, end: cal.is_trading(end),
+    lambda cal, dt, end: cal.is_trading_day(dt),
+    lambda cal, dt, end: cal.is_trading_time(end),
+    lambda cal, dt, end: cal.get_current_bartime(dt, 300),
+    lambda cal, dt, end: cal.get_current_bartime(dt, 1),
+    lambda cal, dt, end: cal.get_current_bar(dt, 300),
+    lambda cal, dt, end: cal.get_bartimes(300, dt, end),
+    lambda cal, dt, end: cal.get_bartimes(1, dt, count=3),
+    lambda cal, dt, end: cal.get_bartimes_array(300, dt, end),
+    lambda cal, dt, end: cal.count_bars(300, dt, end),
+    lambda cal, dt, end: cal.get_bar_ordinal(dt, 300),
+    lambda cal, dt, end: cal.get_trading_seconds(dt, end),
+    lambda cal, dt, end: cal.trading_time_offset(dt, 3600),
+])
+def test_tz_aware_inputs(calendar_source, call):
+    # UTC 02:14:30-07:30为北京时间10:14:30-15:30, 带时区的先转换为北京时间
+    ag = get_calendar(CalendarCTP, calendar_source).get("ag2412")
+    dt = datetime(2024, 9, 13, 2, 14, 30, tzinfo=timezone.utc)
+    end = datetime(2024, 9, 13, 7, 30, tzinfo=timezone.utc)
+    local = call(ag, datetime(2024, 9, 13, 10, 14, 30), datetime(2024, 9, 13, 15, 30))
+    assert _as_shanghai(call(ag, dt, end)) == _as_shanghai(local)
+
+
+def test_calendar_registry(calendar_source):
+    assert get_calendar(CalendarCTP, calendar_source) is get_calendar(CalendarCTP, calendar_source)
+    assert get_calendar(Time7x24Calendar) is get_calendar(Time7x24Calendar)
+
+    days = pd.DataFrame({"_id": pd.date_range("2024-09-02", periods=14), "status": [1, 1, 1, 1, 1, 0, 0] * 2})
+    days.attrs["version"] = "1"
+    source = DataFrameSource({"cn_stock": days})
+    registry = CalendarRegistry(check_interval=0)
+    with ThreadPoolExecutor(8) as pool:
+        cals = list(pool.map(lambda _: registry.get(CalendarAstock, source), range(16)))
+    assert all(cal is cals[0] for cal in cals)
+    assert cals[0].data_version == "cn_stock:1"
+    assert registry.get(CalendarAstock, DataFrameSource({"cn_stock": days})) is not cals[0]
+    # 数据版本改变后重新创建
+    days.attrs["version"] = "2"
+    cal = registry.get(CalendarAstock, source)
+    assert cal is not cals[0] and cal.data_version == "cn_stock:2"
+    assert registry.get(CalendarAstock, source) is cal
+    registry.clear()
+    assert registry.get(CalendarAstock, source) is not cal
+
+    # 多个线程共用的日历, 品种日历只创建一次, 缓存在多个线程中读写
+    ctp = CalendarCTP(calendar_source)
+    dt = datetime(2024, 9, 13, 10, 14, 30)
+    with ThreadPoolExecutor(8) as pool:
+        subs = list(pool.map(lambda _: ctp.get("AU"), range(16)))
+        bartimes = list(pool.map(lambda i: ctp.get("AU").get_current_bartime(dt, 60 * (i % 4 + 1)), range(64)))
+    assert all(sub is subs[0] for sub in subs)
+    assert bartimes == [subs[0].get_current_bartime(dt, 60 * (i % 4 + 1)) for i in range(64)]
+    cache = LRUCache(2)
+    cache[1] = np.zeros(1)
+    assert pickle.loads(pickle.dumps(cache)).keys() == cache.keys()
+
+
+def test_instrument(calendar_source):
+    cal = CalendarCTP(calendar_source).get("AG")
+    dt = datetime(2024, 9, 13, 10, 14, 30)
+    original = CalendarCTP.get_current_bartime
+    instrument.reset()
+    instrument.enable()
+    try:
+        for i in range(10):
+            cal.get_current_bartime(dt + timedelta(minutes=i), 300)
+            cal.is_trading(dt)
+        Time7x24Calendar().get_current_bartime(dt, 7)  # 调用super()只统计一次
+        stats = instrument.get_stats()
+    finally:
+        instrument.disable()
+    assert CalendarCTP.get_current_bartime is original and not instrument.is_enabled()
+    calls = stats["calls"]
+    assert calls["CalendarCTP.get_current_bartime"]["count"] == 10
+    assert calls["CalendarCTP.get_current_bartime"]["buckets"]["+Inf"] == 10
+    assert calls["CalendarCTP.is_trading"]["count"] == 10
+    assert calls["Time7x24Calendar.get_current_bartime"]["count"] == 1
+    assert stats["caches"]["bartime_indexes"]["hits"] >= 9
+    text = instrument.to_prometheus()
+    assert 'quantcalendar_call_seconds_count{calendar="CalendarCTP",method="is_trading"} 10' in text
+    assert 'quantcalendar_cache_hits_total{cache="bartime_indexes"}' in text
+    cal.is_trading(dt)  # 停止后不再统计
+    assert instrument.get_stats()["calls"]["CalendarCTP.is_trading"]["count"] == 10
+    instrument.reset()
+    assert instrument.get_stats() == {"calls": {}, "caches": {}}
+
+
+def test_calendar_snapshot(calendar_source, tmp_path):
+    path = str(tmp_path / "cn_future.snap")
+    with pytest.raises(SnapshotError):
+        CalendarCTP.from_snapshot(path)
+    cal = CalendarCTP.from_snapshot(path, calendar_source)
+    queries = [datetime(2024, 9, 13, 10, 3), datetime(2024, 9, 13, 22), datetime(2023, 6, 21, 23)]
+    answers = {}
+    for product_id in (None, "IH", "AG"):
+        _cal = cal.get(product_id)
+        answers[product_id] = [(_cal.get_current_bartime(q, 300), _cal.get_session_dt(q)) for q in queries]
+    cal.save_snapshot(path)
+
+    cal = CalendarCTP.from_snapshot(path)  # 离线打开
+    assert cal.get("AG")._bartime_indexes[300] is not None
+    for product_id in (None, "IH", "AG"):
+        _cal = cal.get(product_id)
+        assert [(_cal.get_current_bartime(q, 300), _cal.get_session_dt(q)) for q in queries] == answers[product_id]
+    with pytest.raises(SnapshotError):
+        CalendarAstock.from_snapshot(path)
+
+
+def test_calendar_shared_memory(calendar_source):
+    cal = CalendarCTP(calendar_source)
+    queries = [datetime(2024, 9, 13, 10, 3), datetime(2024, 9, 13, 22), datetime(2023, 6, 21, 23)]
+    answers = [(cal.get("AG").get_current_bartime(q, 300), cal.get("IH").get_session_dt(q)) for q in queries]
+    shm = cal.to_shared_memory()
+    try:
+        attached = CalendarCTP.attach_shared_memory(shm.name)
+        assert not attached.get("AG")._bartime_indexes[300].flags.writeable
+        # 交易状态和交易日索引直接引用共享内存, 交易日列表第一次用到时才生成
+        for arr in (attached._trade_status, attached._tradedays_ns, attached._tradedays_lte, attached._tradedays_gte):
+            assert not arr.flags.owndata and not arr.flags.writeable
+        assert [(attached.get("AG").get_current_bartime(q, 300), attached.get("IH").get_session_dt(q)) for q in queries] == answers
+        assert "_tradedays" not in vars(attached)
+        assert attached.get_tradedays_next(queries[0]) == cal.get_tradedays_next(queries[0])
+        assert attached.tradeday_offset(queries[0], -20) == cal.tradeday_offset(queries[0], -20)
+        assert attached.get_tradedays_month_end(queries[2], count=3) == cal.get_tradedays_month_end(queries[2], count=3)
+        with pytest.raises(SnapshotError):
+            CalendarAstock.attach_shared_memory(shm.name)
+    finally:
+        shm.close()
+        shm.unlink()
+    with pytest.raises(SnapshotError):
+        CalendarCTP.attach_shared_memory(shm.name)
+
+
+def _source_answers(cal):
+    queries = [datetime(2024, 9, 13, 10, 3), datetime(2024, 9, 13, 22), datetime(2023, 6, 21, 23)]
+    return [
+        (_cal.get_current_bartime(q, 300), _cal.get_session_dt(q), _cal.get_tradedays_next(q))
+        for _cal in (cal, cal.get("IH"), cal.get("AG"))
+        for q in queries
+    ]
+
+
+def test_calendar_source(calendar_source, tmp_path):
+    cal = CalendarCTP(calendar_source)
+
+    pytest.importorskip("pyarrow")
+    export_parquet(calendar_source, str(tmp_path), {"cn_future": "days", "cn_future_sessions": "sessions"})
+    parquet_cal = CalendarCTP(ParquetSource(str(tmp_path)))
+    assert parquet_cal._tradedays == cal._tradedays
+    assert parquet_cal._holidays == cal._holidays
+    assert _source_answers(parquet_cal) == _source_answers(cal)
+
+    frames = {name: pd.read_parquet(tmp_path / f"{name}.parquet") for name in ("cn_future", "cn_future_sessions")}
+    frames["cn_future"].attrs["version"] = "1"
+    frames["cn_future_sessions"].attrs["version"] = "2"
+    df_cal = CalendarCTP(DataFrameSource(frames))
+    assert df_cal.data_version == "cn_future:1,cn_future_sessions:2"
+    assert _source_answers(df_cal) == _source_answers(cal)
+
+    days = frames["cn_future"].drop(index=10)
+    with pytest.raises(ValueError):
+        CalendarCTP(DataFrameSource(dict(frames, cn_future=days)))
+
+
+def test_mongo_source(mongo_client, tmp_path):
+    # MongoDB和导出的Parquet文件得到相同的日历
     cal = CalendarCTP(mongo_client)
+    pytest.importorskip("pyarrow")
+    export_parquet(mongo_client, str(tmp_path), {"cn_future": "days", "cn_future_sessions": "sessions"})
+    parquet_cal = CalendarCTP(ParquetSource(str(tmp_path)))
+    assert parquet_cal.data_version == cal.data_version
+    assert parquet_cal._tradedays == cal._tradedays
+    assert parquet_cal._holidays == cal._holidays
+    assert _source_answers(parquet_cal) == _source_answers(cal)
+
+
+def test_calendar_ctp_bartime(calendar_source):
+    cal = CalendarCTP(calendar_source)
     path = "tests/bartime_answers"
 
     for pickle_file in os.listdir(path):
@@ -283,6 +736,8 @@ def test_calendar_ctp_bartime(mongo_client):
                 answer.index.map(lambda x: _cal.get_current_bartime(x, i)),
             ):
                 assert ans == value, f"{pickle_file} {q}: {ans} != {value}"
+            values = _cal.get_current_bartimes(answer.index, i)
+            assert (values == answer.values).all(), pickle_file
             print(f"{pickle_file} pass")
             # test bartime
             bartime_testcases = [
@@ -304,4 +759,202 @@ def test_calendar_ctp_bartime(mongo_client):
             ]
             for query, answer, interval in bartime_testcases:
                 assert _cal.get_current_bartime(query, interval) == answer
+
+
+def test_calendar_arbitrary_interval(calendar_source):
+    cal = Time7x24Calendar()
+    assert cal.get_current_bartime(datetime(2024, 9, 13, 0, 0, 1), 10) == datetime(2024, 9, 13, 0, 0, 10)
+    assert cal.get_current_bartime(datetime(2024, 9, 13, 1, 10), 5400) == datetime(2024, 9, 13, 1, 30)
+    assert cal.get_bartimes(2700, datetime(2024, 9, 13), count=3) == [datetime(2024, 9, 13), datetime(2024, 9, 13, 0, 45), datetime(2024, 9, 13, 1, 30)]
+    with pytest.raises(ValueError):
+        cal.get_current_bartime(datetime(2024, 9, 13), 2 * DAILY)
+
+    cal = CalendarCTP(calendar_source).get("ag2412")
+    assert len(cal._bartimestamps) == 0  # 第一次用到时才计算
+    assert cal.get_current_bartime(datetime(2024, 9, 12, 10, 14, 3), 30) == datetime(2024, 9, 12, 10, 14, 30)
+    assert cal.get_current_bartime(datetime(2024, 9, 12, 10, 14, 59), 30) == datetime(2024, 9, 12, 10, 15)
+    assert cal.get_current_bartime(datetime(2024, 9, 12, 10, 14, 3), 120) == datetime(2024, 9, 12, 10, 31)
+    assert cal.get_bartimes(5400, datetime(2024, 9, 12, 10, 14), count=3) == [datetime(2024, 9, 12, 11, 15), datetime(2024, 9, 12, 14, 45), datetime(2024, 9, 12, 15)]
+    for interval in range(60, 60 * (cal.bartime_cache_size + 10), 60):
+        cal.get_current_bartime(datetime(2024, 9, 12, 10, 14), interval)
+    assert len(cal._bartime_indexes) == cal.bartime_cache_size
+    # 整个日历的索引超过`bartime_cache_bytes`的K线周期不建索引, 逐日计算
+    assert cal.get_current_bartime(datetime(2024, 9, 12, 10, 14, 3, 500000), 1) == datetime(2024, 9, 12, 10, 14, 4)
+    assert 1 not in cal._bartime_indexes
+    assert cal._bartime_indexes.nbytes <= cal.bartime_cache_bytes
+
+    cache = LRUCache(4, maxbytes=100)
+    cache[1] = np.zeros(10)  # 80字节
+    cache[2] = np.zeros(5)
+    assert list(cache) == [2] and cache.nbytes == 40
+    cache[3] = np.zeros(20)  # 超过maxbytes也保留最后添加的
+    assert list(cache) == [3] and cache.nbytes == 160
+
+
+class Time7x24LeftCalendar(Time7x24Calendar):
+    bartime_side = "left"
+
+
+class CalendarCTPLeft(CalendarCTP):
+    bartime_side = "left"
+
+
+def test_calendar_bartime_left(calendar_source):
+    # K线包含开始时间不包含结束时间, 同数字货币的K线
+    cal = Time7x24LeftCalendar()
+    bartime_testcases = [
+        (datetime(2024, 9, 13), datetime(2024, 9, 13), 60),
+        (datetime(2024, 9, 12, 23, 59, 59), datetime(2024, 9, 12, 23, 59), 60),
+        (datetime(2024, 9, 13, 0, 0, 1), datetime(2024, 9, 13), 60),
+        (datetime(2024, 9, 13, 0, 1, 0), datetime(2024, 9, 13, 0, 1), 60),
+        (datetime(2024, 9, 13, 0, 0, 1), datetime(2024, 9, 13), 900),
+        (datetime(2024, 9, 13, 23, 59, 1), datetime(2024, 9, 13, 23, 59), 60),
+        (datetime(2024, 9, 13, 23), datetime(2024, 9, 13, 23), I1H),
+        (datetime(2024, 9, 13, 1), datetime(2024, 9, 13), DAILY),
+        (datetime(2024, 9, 14), datetime(2024, 9, 14), DAILY),
+        (datetime(2024, 9, 15), datetime(2024, 9, 9), WEEKLY),
+        (datetime(2024, 9, 16), datetime(2024, 9, 16), WEEKLY),
+        (datetime(2024, 9, 30, 1), datetime(2024, 9, 1), MONTHLY),
+        (datetime(2024, 10, 1), datetime(2024, 10, 1), MONTHLY),
+    ]
+    for query, answer, interval in bartime_testcases:
+        assert cal.get_current_bartime(query, interval) == answer
+    queries = pd.DatetimeIndex([q for q, _, i in bartime_testcases if i == 60])
+    answers = [a for _, a, i in bartime_testcases if i == 60]
+    assert (cal.get_current_bartimes(queries, 60) == pd.DatetimeIndex(answers).values).all()
+    assert cal.get_current_bar(datetime(2024, 9, 13, 0, 30), I1H) == (datetime(2024, 9, 13), datetime(2024, 9, 13, 1))
+    bartimes = cal.get_bartimes(1800, datetime(2024, 9, 13, 1, 0, 1), count=2)
+    assert bartimes == [datetime(2024, 9, 13, 1), datetime(2024, 9, 13, 1, 30)]
+    bartimes = cal.get_bartimes(I4H, datetime(2024, 9, 13, 0, 0, 1), end=datetime(2024, 9, 14))
+    assert bartimes == [datetime(2024, 9, 13, h) for h in (0, 4, 8, 12, 16, 20)]
+    assert cal.get_bartimes(I4H, datetime(2024, 9, 13), count=1) == [datetime(2024, 9, 13)]
+    assert cal.get_bar_ordinal(datetime(2024, 9, 13, 0, 1), 60) == cal.get_bar_ordinal(datetime(2024, 9, 13), 60) + 1
+    assert cal.count_bars(60, datetime(2024, 9, 13), datetime(2024, 9, 13, 0, 5)) == 5
+
+    cal = CalendarCTPLeft(calendar_source).get("ag2412")
+    bartime_testcases = [
+        (datetime(2024, 9, 12, 10, 14), datetime(2024, 9, 12, 10, 10), 300),
+        (datetime(2024, 9, 12, 10, 10), datetime(2024, 9, 12, 10, 10), 300),  # 开始时间属于本K线
+        (datetime(2024, 9, 12, 10, 15), datetime(2024, 9, 12, 10, 10), 300),  # 休息开始时刻属于休息前的K线
+        (datetime(2024, 9, 12, 10, 20), datetime(2024, 9, 12, 10, 30), 300),  # 休息时间算下一根K线
+        (datetime(2024, 9, 12, 10, 30), datetime(2024, 9, 12, 10, 30), 300),
+        (datetime(2024, 9, 12, 11, 30), datetime(2024, 9, 12, 11, 25), 300),
+        (datetime(2024, 9, 12, 15), datetime(2024, 9, 12, 14, 55), 300),
+        (datetime(2024, 9, 12, 2, 30), datetime(2024, 9, 12, 2, 25), 300),
+        (datetime(2024, 9, 12, 2, 30, 1), datetime(2024, 9, 12, 9), 300),
+        (datetime(2024, 9, 12, 9, 10), datetime(2024, 9, 12, 2), I1H),  # 02:00-02:30, 09:00-09:30
+        (datetime(2024, 9, 12, 22), datetime(2024, 9, 12, 21), DAILY),
+    ]
+    for query, answer, interval in bartime_testcases:
+        assert cal.get_current_bartime(query, interval) == answer
+    queries = pd.DatetimeIndex([q for q, _, i in bartime_testcases if i == 300])
+    answers = [a for _, a, i in bartime_testcases if i == 300]
+    assert (cal.get_current_bartimes(queries, 300) == pd.DatetimeIndex(answers).values).all()
+    assert cal.get_current_bar(datetime(2024, 9, 12, 9, 10), I1H) == (datetime(2024, 9, 12, 2), datetime(2024, 9, 12, 9, 30))
+    bartimes = cal.get_bartimes(I1H, datetime(2024, 9, 12, 9, 10), count=3)
+    assert bartimes == [datetime(2024, 9, 12, 2), datetime(2024, 9, 12, 9, 30), datetime(2024, 9, 12, 10, 45)]
+
+    clock = BarClock(cal, 300)
+    assert clock.update(datetime(2024, 9, 12, 10, 9)) == BarStatus.NEW_BAR
+    assert clock.bartime == datetime(2024, 9, 12, 10, 5)
+    assert clock.update(datetime(2024, 9, 12, 10, 10)) == BarStatus.NEW_BAR
+    assert clock.bartime == datetime(2024, 9, 12, 10, 10)
+    assert clock.update(datetime(2024, 9, 12, 10, 14)) == BarStatus.SAME_BAR
+    assert clock.update(datetime(2024, 9, 12, 10, 15)) == BarStatus.SAME_BAR
+    assert clock.bartime == datetime(2024, 9, 12, 10, 10)
+    assert clock.update(datetime(2024, 9, 12, 10, 30, 1)) == BarStatus.NEW_SESSION
+    assert clock.bartime == datetime(2024, 9, 12, 10, 30)
+
+
+def test_bar_clock(calendar_source):
+    clock = BarClock(CalendarCTP(calendar_source), 60, "ag2412")
+    ticks = [
+        (datetime(2024, 9, 12, 10, 14, 10), BarStatus.NEW_BAR, datetime(2024, 9, 12, 10, 15)),
+        (datetime(2024, 9, 12, 10, 14, 50), BarStatus.SAME_BAR, datetime(2024, 9, 12, 10, 15)),
+        (datetime(2024, 9, 12, 10, 15), BarStatus.SAME_BAR, datetime(2024, 9, 12, 10, 15)),
+        (datetime(2024, 9, 12, 10, 30, 1), BarStatus.NEW_SESSION, datetime(2024, 9, 12, 10, 31)),
+        (datetime(2024, 9, 12, 10, 32, 5), BarStatus.NEW_BAR, datetime(2024, 9, 12, 10, 33)),
+    ]
+    for tick, status, bar_close in ticks:
+        assert clock.update(tick) == status
+        assert clock.bar_close == bar_close
+    assert clock.prev_bar_close == datetime(2024, 9, 12, 10, 31)
+    assert clock.seconds_remaining() == 55
+    with pytest.raises(ValueError):
+        clock.update(datetime(2024, 9, 12, 10, 32))
+
+    clock = BarClock(Time7x24Calendar(), 60)
+    assert clock.update(datetime(2024, 9, 13, 23, 59, 1)) == BarStatus.NEW_BAR
+    assert clock.update(datetime(2024, 9, 14, 0, 0, 1)) == BarStatus.NEW_BAR
+    assert clock.bar_close == datetime(2024, 9, 14, 0, 1)
+
+
+def test_scheduler(calendar_source):
+    cal = CalendarCTP(calendar_source)
+
+    def clock(start):
+        # 从`start`开始的模拟时钟, 与事件循环的时间同步
+        t0 = asyncio.get_running_loop().time()
+        return lambda: start + timedelta(seconds=asyncio.get_running_loop().time() - t0)
+
+    async def main():
+        scheduler = CalendarScheduler(cal, clock(datetime(2024, 9, 12, 10, 14, 59, 950000)))
+        closes = await asyncio.gather(scheduler.wait_until_close("ag2412"), scheduler.wait_until_bar_close("IH", 300))
+        assert closes == [datetime(2024, 9, 12, 10, 15), datetime(2024, 9, 12, 10, 15)]
+        assert scheduler.now() >= datetime(2024, 9, 12, 10, 15)
+
+        scheduler = CalendarScheduler(cal, clock(datetime(2024, 9, 12, 10, 29, 59, 950000)))
+        assert await scheduler.wait_until_open("ag2412") == datetime(2024, 9, 12, 10, 30)
+
+        scheduler = CalendarScheduler(cal, clock(datetime(2024, 9, 12, 14, 59, 59, 950000)))
+        events = []
+        async for event in scheduler.bar_closes(["ag2412", "IH"], 60):
+            events.append(event)
+            if len(events) == 2:
+                break
+        bar = (datetime(2024, 9, 12, 14, 59), datetime(2024, 9, 12, 15))
+        assert events == [BarCloseEvent("ag2412", bar[1], *bar), BarCloseEvent("IH", bar[1], *bar)]
+        # 下一根K线是夜盘
+        assert scheduler._heap[0][0] == datetime(2024, 9, 12, 21, 1)
+        scheduler.cancel()
+
+    asyncio.run(main())
+
+
+def test_resample_ohlcv(calendar_source):
+    cal = CalendarCTP(calendar_source)
+    index = pd.to_datetime(["2024-09-12 10:13:30", "2024-09-12 10:14:10", "2024-09-12 10:15:00", "2024-09-12 10:30:01", "2024-09-12 10:34:59"])
+    ticks = pd.DataFrame({"price": [1.0, 3.0, 2.0, 5.0, 4.0], "volume": [1, 1, 1, 2, 2]}, index=index)
+    # AG 10:15-10:30 休息
+    bars = resample_ohlcv(ticks, cal, 300, symbol="ag2412")
+    assert bars.index.tolist() == [pd.Timestamp("2024-09-12 10:15"), pd.Timestamp("2024-09-12 10:35")]
+    assert bars.iloc[0].tolist() == [1.0, 3.0, 1.0, 2.0, 3]
+    assert bars.iloc[1].tolist() == [5.0, 5.0, 4.0, 4.0, 4]
+    minute_bars = resample_ohlcv(ticks, cal, 60, symbol="ag2412")
+    assert resample_ohlcv(minute_bars, cal, 300, symbol="ag2412").equals(bars)
+    filled = resample_ohlcv(ticks, cal, 60, symbol="ag2412", fill_empty=True)
+    assert len(filled) == 7
+    assert filled.loc["2024-09-12 10:32", "close"] == 5.0
+    assert filled.loc["2024-09-12 10:32", "volume"] == 0
+    utc_ticks = ticks.tz_localize("Asia/Shanghai").tz_convert("UTC")
+    utc_bars = resample_ohlcv(utc_ticks, cal, 300, symbol="ag2412")
+    assert utc_bars.index.tz_convert("Asia/Shanghai").tz_localize(None).equals(bars.index)
+    assert utc_bars.reset_index(drop=True).equals(bars.reset_index(drop=True))
+
+    # K线时间为开始时间时, 补齐的K线也从第一根K线开始
+    index = pd.date_range("2024-01-01 00:01", periods=4, freq="1min").append(pd.date_range("2024-01-01 00:16", periods=4, freq="1min"))
+    ticks = pd.DataFrame({"price": range(8), "volume": 1}, index=index)
+    filled = resample_ohlcv(ticks, Time7x24LeftCalendar(), 300, fill_empty=True)
+    assert filled.index.strftime("%H:%M").tolist() == ["00:00", "00:05", "00:10", "00:15"]
+    assert filled["close"].tolist() == [3, 3, 3, 7] and filled["volume"].tolist() == [4, 0, 0, 4]
+    index = pd.to_datetime(["2024-09-12 10:10", "2024-09-12 10:15", "2024-09-12 10:40"])
+    ticks = pd.DataFrame({"price": [1.0, 2.0, 3.0], "volume": 1}, index=index)
+    filled = resample_ohlcv(ticks, CalendarCTPLeft(calendar_source), 300, symbol="ag2412", fill_empty=True)
+    assert filled.index.strftime("%H:%M").tolist() == ["10:10", "10:30", "10:35", "10:40"]
+    assert filled["close"].tolist() == [2.0, 2.0, 2.0, 3.0]
+
+    ticks = pd.DataFrame({"price": range(7200)}, index=pd.date_range("2024-09-13", periods=7200, freq="1s"))
+    bars = resample_ohlcv(ticks, Time7x24Calendar(), I1H)
+    assert bars.index.tolist() == [pd.Timestamp("2024-09-13"), pd.Timestamp("2024-09-13 01:00"), pd.Timestamp("2024-09-13 02:00")]
+    assert bars["close"].tolist() == [0, 3600, 7199]
 # fmt: on